@@ -2,24 +2,57 @@ import os
 import re
 import json
 import time
+import math
 import base64
-from datetime import timedelta, datetime
+import hmac
+import hashlib
+import gzip
+import queue
+import asyncio
+import functools
+import contextvars
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
+from datetime import date, timedelta, datetime
 from zoneinfo import ZoneInfo
 from urllib.parse import quote, urlparse, parse_qs
 
-from flask import Flask, request, jsonify, render_template_string, redirect, Response
-import dateparser
-
-# Google Calendar
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-
-# OpenAI (GPT 3.5 Turbo)
-from openai import OpenAI
-
-# HTTP para WhatsApp Cloud API
-import requests
+import lazy
+
+# Tiempos de arranque por componente (se ven en /_diag -> startup)
+STARTUP = lazy.StartupReport()
+
+# LAZY_INIT=1: los clientes de Google/OpenAI y dateparser se cargan en el primer uso
+# (o en un hilo de calentamiento tras el primer request), no al importar el módulo
+LAZY_INIT = os.getenv("LAZY_INIT", "0") == "1"
+
+with STARTUP.timed("flask"):
+    from flask import Flask, request, jsonify, redirect, Response, copy_current_request_context, g
+
+# Google Calendar (discovery, google-auth y OpenAI se importan dentro de sus fábricas)
+with STARTUP.timed("googleapiclient.errors"):
+    from googleapiclient.errors import HttpError
+
+# Brotli es opcional: sin él, /chat y /nuevo se sirven solo con gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+with STARTUP.timed("modulos locales"):
+    from wa_worker import CoalescingMailbox
+    from wa_sender import WhatsAppSender
+    from availability import Availability
+    from calendar_mirror import CalendarMirror, IntervalIndex
+    from importer import Importer, Checkpoint, iter_rows, is_rate_limited
+    import dates
+    from storage import LRUCache, TTLDedup, SQLiteDedup, MemorySessionStore, SQLiteSessionStore
+    from resilience import Upstream, UpstreamBusy, UpstreamUnavailable, CircuitBreaker, Admission
+    import metrics
+    import tracing
+    from profiling import Profiler, ProfilerMiddleware
 
 # =========================
 # Config / Entornoo
@@ -39,24 +72,127 @@ GREETING_TEXT = os.getenv(
 WA_TOKEN = os.getenv("WA_TOKEN")
 WA_PHONE_ID = os.getenv("WA_PHONE_ID")  # fallback
 WA_VERIFY_TOKEN = os.getenv("WA_VERIFY_TOKEN", "verify_me")
-DEBUG_WA = os.getenv("DEBUG_WA", "0") == "1"
+DEBUG_WA = os.getenv("DEBUG_WA", "0") == "1"  # trazas de todos los turnos, con payloads
+
+# Trazas por turno (JSON por línea): fracción muestreada y archivo (vacío = stdout)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+
+# Procesamiento del webhook en segundo plano (responde 200 de inmediato)
+WA_ASYNC = os.getenv("WA_ASYNC", "0") == "1"
+WA_WORKERS = int(os.getenv("WA_WORKERS", "4"))
+WA_QUEUE_MAX = int(os.getenv("WA_QUEUE_MAX", "1000"))
+# Mensajes seguidos de un mismo remitente (ventana deslizante, con tope) = un solo turno
+WA_COALESCE_MS = int(os.getenv("WA_COALESCE_MS", "1500"))  # 0 = un turno por mensaje
+WA_COALESCE_MAX_MS = int(os.getenv("WA_COALESCE_MAX_MS", "5000"))
+
+# Envíos a Graph API: Session con keep-alive, en paralelo entre destinatarios
+WA_SEND_WORKERS = int(os.getenv("WA_SEND_WORKERS", "4"))  # 0 = enviar en línea
+WA_SEND_TIMEOUT = float(os.getenv("WA_SEND_TIMEOUT_SEC", "30"))
+WA_HTTP_POOL = int(os.getenv("WA_HTTP_POOL", "10"))
+
+# Copia local del calendario (sync incremental + índice de intervalos)
+CAL_MIRROR_ENABLED = os.getenv("CAL_MIRROR", "0") == "1"
+CAL_MIRROR_MAX_AGE = float(os.getenv("CAL_MIRROR_MAX_AGE_SEC", "60"))    # más vieja: se refresca en segundo plano
+CAL_MIRROR_MAX_STALE = float(os.getenv("CAL_MIRROR_MAX_STALE_SEC", "600"))  # más vieja: no se usa, se va a la API
+CAL_MIRROR_PAST_DAYS = float(os.getenv("CAL_MIRROR_PAST_DAYS", "30"))      # ventana hacia atrás de la copia
+CAL_WATCH_TOKEN = os.getenv("CAL_WATCH_TOKEN", "")
+
+# Lotes para la API batch de Calendar (máximo 50 por lote) y carga masiva
+CAL_BATCH_SIZE = min(50, int(os.getenv("CAL_BATCH_SIZE", "50")))
+CAL_BULK_MAX = int(os.getenv("CAL_BULK_MAX", "1000"))
+
+# Importación masiva (python app.py --import archivo.csv|.jsonl)
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "4"))
+
+# Disponibilidad (freebusy cacheado, celdas de 30 min)
+AVAIL_CALENDAR_IDS = [c.strip() for c in os.getenv("AVAIL_CALENDAR_IDS", "").split(",") if c.strip()]
+AVAIL_HOURS = os.getenv("AVAIL_HOURS", "09:00-18:00")
+AVAIL_DAYS = os.getenv("AVAIL_DAYS", "0,1,2,3,4")  # 0 = lunes
+AVAIL_BUFFER_MIN = int(os.getenv("AVAIL_BUFFER_MIN", "0"))
+AVAIL_MIN_NOTICE_MIN = int(os.getenv("AVAIL_MIN_NOTICE_MIN", "60"))
+AVAIL_CACHE_TTL = float(os.getenv("AVAIL_CACHE_TTL_SEC", "60"))
+AVAIL_MAX_DAYS = int(os.getenv("AVAIL_MAX_DAYS", "62"))
+AVAIL_SUGGEST = os.getenv("AVAIL_SUGGEST", "1") == "1"  # sugerir horarios al pedir fecha/hora
+
+# .ics pre-renderizados (por id de evento, validados por etag)
+ICS_CACHE_SIZE = int(os.getenv("ICS_CACHE_SIZE", "2048"))
+
+# Feed .ics de suscripción (/ics/feed.ics)
+ICS_FEED_TOKEN = os.getenv("ICS_FEED_TOKEN", "")  # ?token= obligatorio; sin definir, /ics/feed.ics no existe
+ICS_FEED_PAST_DAYS = int(os.getenv("ICS_FEED_PAST_DAYS", "7"))
+ICS_FEED_PROBE_TTL = float(os.getenv("ICS_FEED_PROBE_TTL_SEC", "60"))
+
+# Páginas estáticas pre-renderizadas (/chat, /nuevo)
+STATIC_PAGE_MAX_AGE = int(os.getenv("STATIC_PAGE_MAX_AGE_SEC", "300"))
+
+# Camino async (asgi.py): hilos para el I/O bloqueante (Calendar, sesiones, envíos)
+ASYNC_IO_THREADS = int(os.getenv("ASYNC_IO_THREADS", "32"))
+
+# Límite de tasa por upstream (por proceso) y reintentos con backoff exponencial + jitter
+OPENAI_RPS = float(os.getenv("OPENAI_RPS", "5"))
+OPENAI_BURST = float(os.getenv("OPENAI_BURST", "10"))
+GCAL_RPS = float(os.getenv("GCAL_RPS", "8"))
+GCAL_BURST = float(os.getenv("GCAL_BURST", "16"))
+GRAPH_RPS = float(os.getenv("GRAPH_RPS", "20"))
+GRAPH_BURST = float(os.getenv("GRAPH_BURST", "40"))
+UPSTREAM_MAX_WAIT = float(os.getenv("UPSTREAM_MAX_WAIT_SEC", "10"))  # más espera por cupo = 503
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_SEC = float(os.getenv("RETRY_BASE_SEC", "0.5"))
+RETRY_CAP_SEC = float(os.getenv("RETRY_CAP_SEC", "20"))
+
+# Google Calendar: timeout por operación y circuit breaker (falla rápido mientras no responde)
+GCAL_READ_TIMEOUT = float(os.getenv("GCAL_READ_TIMEOUT_SEC", "8"))     # get/list/freebusy
+GCAL_WRITE_TIMEOUT = float(os.getenv("GCAL_WRITE_TIMEOUT_SEC", "15"))  # insert/update/delete/watch
+GCAL_BATCH_TIMEOUT = float(os.getenv("GCAL_BATCH_TIMEOUT_SEC", "30"))  # lotes de hasta 50
+GCAL_BREAKER_FAILURES = int(os.getenv("GCAL_BREAKER_FAILURES", "5"))
+GCAL_BREAKER_RESET_SEC = float(os.getenv("GCAL_BREAKER_RESET_SEC", "30"))
+CALENDAR_DOWN_REPLY = ("En este momento no puedo acceder a la agenda. "
+                       "¿Me escribes de nuevo en un par de minutos? Tus datos quedan guardados.")
+
+# Métricas (/_metrics). Con varios workers de gunicorn, METRICS_DIR debe apuntar a un
+# directorio compartido por los workers y vacío al desplegar (p. ej. bajo /tmp)
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_SEC = float(os.getenv("METRICS_FLUSH_SEC", "10"))
+
+# Perfiles bajo demanda (X-Profile: <token>, ?_profile=<token>, muestreo o sesiones fijas).
+# Sin PROFILE_TOKEN no se instala nada: costo cero.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile")  # cprofile | wall
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_SESSIONS = [x.strip() for x in os.getenv("PROFILE_SESSIONS", "").split(",") if x.strip()]
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")  # compartido entre workers para servir cualquier perfil
+
+# Control de admisión: turnos de chat en curso por proceso (el resto recibe 503)
+CHAT_MAX_INFLIGHT = int(os.getenv("CHAT_MAX_INFLIGHT", "32"))
+ASYNC_CHAT_MAX_INFLIGHT = int(os.getenv("ASYNC_CHAT_MAX_INFLIGHT", "500"))  # asgi.py
+BUSY_REPLY = "Estamos con mucha demanda en este momento. ¿Me escribes de nuevo en unos segundos?"
+
+# URL pública (para links .ics cuando no hay request, ej. hilos del webhook)
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
 
 # Anti-duplicados (idempotencia webhook)
 WA_DEDUP_TTL = int(os.getenv("WA_DEDUP_TTL_SEC", "300"))  # 5 min
-_PROCESADOS = {}  # {message_id: expire_ts}
+WA_DEDUP_BACKEND = os.getenv("WA_DEDUP_BACKEND", "memory")  # memory | sqlite (compartido entre workers)
+STATE_DB = os.getenv("STATE_DB", "/tmp/agendador-state.db")
+
+if WA_DEDUP_BACKEND == "sqlite":
+    WA_DEDUP = SQLiteDedup(os.getenv("WA_DEDUP_DB", STATE_DB), WA_DEDUP_TTL)
+else:
+    WA_DEDUP = TTLDedup(WA_DEDUP_TTL)
 
 def wa_is_dup(message_id: str) -> bool:
     """True si ya procesamos este message_id dentro del TTL."""
-    now = time.time()
-    for k, exp in list(_PROCESADOS.items()):
-        if exp < now:
-            _PROCESADOS.pop(k, None)
     if not message_id:
         return False
-    if message_id in _PROCESADOS and _PROCESADOS[message_id] > now:
-        return True
-    _PROCESADOS[message_id] = now + WA_DEDUP_TTL
-    return False
+    return WA_DEDUP.check_and_add(message_id)
+
+def wa_forget(message_id: str):
+    """Olvida un message_id (ej. no se pudo encolar y Meta lo reintentará)."""
+    if message_id:
+        WA_DEDUP.forget(message_id)
 
 # Validaciones iniciales
 if not os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON"):
@@ -66,18 +202,331 @@ if not CALENDAR_ID:
 if not OPENAI_API_KEY:
     raise Exception("Falta OPENAI_API_KEY en variables de entorno.")
 
-# Google Calendar client
+# =========================
+# Upstreams: límite de tasa + reintentos
+# =========================
+def _gcal_classify(e):
+    if isinstance(e, HttpError):
+        status = getattr(e.resp, "status", None)
+        if status == 403 and is_rate_limited(e):
+            status = 429
+        return status, e.resp.get("retry-after")
+    if isinstance(e, (TimeoutError, ConnectionError)) or type(e).__name__ == "ServerNotFoundError":
+        return 0, None
+    return None, None
+
+def _openai_classify(e):
+    status = getattr(e, "status_code", None)
+    if status is None and type(e).__name__ in ("APIConnectionError", "APITimeoutError"):
+        status = 0
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    return status, headers.get("retry-after")
+
+def _graph_response_status(r):
+    if r.status_code == 429 or r.status_code >= 500:
+        return r.status_code, r.headers.get("Retry-After")
+    return None, None
+
+def _upstream(name, rate, burst, classify, response_status=None):
+    return Upstream(name, rate, burst, classify, response_status=response_status,
+                    max_attempts=RETRY_MAX_ATTEMPTS, backoff_base=RETRY_BASE_SEC,
+                    backoff_cap=RETRY_CAP_SEC, max_wait=UPSTREAM_MAX_WAIT)
+
+OPENAI_UPSTREAM = _upstream("openai", OPENAI_RPS, OPENAI_BURST, _openai_classify)
+GCAL_UPSTREAM = _upstream("calendar", GCAL_RPS, GCAL_BURST, _gcal_classify)
+GRAPH_UPSTREAM = _upstream("graph", GRAPH_RPS, GRAPH_BURST, lambda e: (None, None), _graph_response_status)
+
+GCAL_BREAKER = CircuitBreaker("calendar", GCAL_BREAKER_FAILURES, GCAL_BREAKER_RESET_SEC)
+
+CHAT_ADMISSION = Admission(CHAT_MAX_INFLIGHT)
+ASYNC_CHAT_ADMISSION = Admission(ASYNC_CHAT_MAX_INFLIGHT)
+
+# =========================
+# Métricas
+# =========================
+TRACE_WRITER = tracing.JsonLineWriter(TRACE_FILE)
+tracing.configure(1.0 if DEBUG_WA else TRACE_SAMPLE_RATE, TRACE_WRITER)
+
+METRICS = metrics.Registry(prefix="agendador_")
+METRICS.use_dir(METRICS_DIR, METRICS_FLUSH_SEC)
+
+HTTP_REQUESTS = METRICS.counter("http_requests_total", "Requests HTTP por ruta, método y status.",
+                                ("route", "method", "status"))
+HTTP_SECONDS = METRICS.histogram("http_request_duration_seconds",
+                                 "Duración de los requests HTTP (hasta el primer byte en streaming).",
+                                 ("route", "method"))
+HTTP_INFLIGHT = METRICS.gauge("http_requests_in_flight", "Requests HTTP en curso.")
+LLM_REQUESTS = METRICS.counter("llm_requests_total", "Llamados al LLM por modo y resultado.", ("mode", "outcome"))
+LLM_SECONDS = METRICS.histogram("llm_request_duration_seconds", "Duración de los llamados al LLM.", ("mode",))
+LLM_INFLIGHT = METRICS.gauge("llm_requests_in_flight", "Llamados al LLM en curso.")
+LLM_TOKENS = METRICS.counter("llm_tokens_total", "Tokens consumidos por el LLM.", ("kind",))
+CAL_REQUESTS = METRICS.counter("calendar_requests_total", "Operaciones de Google Calendar por método y status.",
+                               ("method", "status"))
+CAL_SECONDS = METRICS.histogram("calendar_request_duration_seconds",
+                                "Duración de las operaciones de Google Calendar (con reintentos).", ("method",))
+CAL_INFLIGHT = METRICS.gauge("calendar_requests_in_flight", "Operaciones de Google Calendar en curso.")
+WA_SENDS = METRICS.counter("whatsapp_sends_total", "Envíos a la Graph API de WhatsApp por status.", ("status",))
+WA_SEND_SECONDS = METRICS.histogram("whatsapp_send_duration_seconds", "Duración de los envíos a la Graph API.")
+REPLACED_DELETE_FAILURES = METRICS.counter(
+    "replaced_event_delete_failures_total",
+    "Citas reprogramadas cuya versión anterior no se pudo borrar (queda duplicada en el calendario).")
+TURN_AFTER_ERRORS = METRICS.counter("turn_after_errors_total",
+                                    "Pasos posteriores a un turno (fuera de la respuesta) que lanzaron una excepción.")
+DATEPARSE_SECONDS = METRICS.histogram("dateparse_duration_seconds", "Duración de parse_datetime_es (con caché).")
+
+def observe_request(route: str, method: str, status: int, seconds: float):
+    HTTP_REQUESTS.inc(route=route, method=method, status=status)
+    HTTP_SECONDS.observe(seconds, route=route, method=method)
+
+@contextmanager
+def _llm_observed(mode: str):
+    outcome = "error"
+    t0 = time.perf_counter()
+    LLM_INFLIGHT.inc()
+    try:
+        with tracing.span("llm", mode=mode, model=OPENAI_MODEL):
+            yield
+        outcome = "ok"
+    except UpstreamBusy:
+        outcome = "busy"
+        raise
+    finally:
+        LLM_INFLIGHT.dec()
+        LLM_REQUESTS.inc(mode=mode, outcome=outcome)
+        LLM_SECONDS.observe(time.perf_counter() - t0, mode=mode)
+
+def _wa_send_observed(status, seconds: float):
+    WA_SENDS.inc(status=status or "error")
+    WA_SEND_SECONDS.observe(seconds)
+
+def parse_datetime_es(payload: dict):
+    with DATEPARSE_SECONDS.time(), tracing.span("dateparse"):
+        return dates.parse_datetime_es(payload)
+
+# Google Calendar client (con LAZY_INIT son proxies que se construyen en el primer uso)
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
-info = json.loads(os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON"))
-creds = Credentials.from_service_account_info(info, scopes=SCOPES)
-gc_service = build("calendar", "v3", credentials=creds, cache_discovery=False)
+
+def _load_info():
+    return json.loads(os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON"))
+
+def _load_creds():
+    from google.oauth2.service_account import Credentials
+    return Credentials.from_service_account_info(lazy.unwrap(info), scopes=SCOPES)
+
+def _build_calendar():
+    from googleapiclient.discovery import build
+    return build("calendar", "v3", credentials=lazy.unwrap(creds), cache_discovery=False)
+
+info = lazy.build("service_account_info", _load_info, LAZY_INIT, STARTUP)
+creds = lazy.build("credentials", _load_creds, LAZY_INIT, STARTUP)
+gc_service = lazy.build("calendar_service", _build_calendar, LAZY_INIT, STARTUP)
+
+# httplib2.Http no es thread-safe: cada hilo (request o worker del webhook) usa
+# los suyos, uno por timeout (el timeout es del socket, no de cada request)
+_gc_local = threading.local()
+
+def _gc_http(timeout: float = GCAL_WRITE_TIMEOUT):
+    pool = getattr(_gc_local, "http", None)
+    if pool is None:
+        pool = _gc_local.http = {}
+    h = pool.get(timeout)
+    if h is None:
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        h = pool[timeout] = AuthorizedHttp(lazy.unwrap(creds), http=httplib2.Http(timeout=timeout))
+    return h
+
+# Lecturas: se pueden reintentar también ante 5xx y errores de red
+GCAL_IDEMPOTENT = {"calendar.events.get", "calendar.events.list", "calendar.freebusy.query"}
+
+def _gcal_timeout(req) -> float:
+    method = getattr(req, "methodId", None)
+    if method is None:
+        return GCAL_BATCH_TIMEOUT  # BatchHttpRequest
+    return GCAL_READ_TIMEOUT if method in GCAL_IDEMPOTENT else GCAL_WRITE_TIMEOUT
+
+def gcal_execute(req, retry: bool = True):
+    """Una operación de Calendar (ver _gcal_execute), con sus métricas por método."""
+    method = (getattr(req, "methodId", None) or "batch").removeprefix("calendar.")
+    status = "error"
+    t0 = time.perf_counter()
+    CAL_INFLIGHT.inc()
+    sp = tracing.start(f"calendar.{method}")
+    try:
+        result = _gcal_execute(req, retry)
+        status = "ok"
+        if sp and isinstance(result, dict) and result.get("id"):
+            sp.set(event_id=result["id"])
+        return result
+    except HttpError as e:
+        status = str(e.resp.status)
+        raise
+    except UpstreamBusy:
+        status = "busy"
+        raise
+    except UpstreamUnavailable:
+        status = "unavailable"
+        raise
+    finally:
+        if sp:
+            sp.set(status=status)
+            sp.end()
+        CAL_INFLIGHT.dec()
+        CAL_REQUESTS.inc(method=method, status=status)
+        CAL_SECONDS.observe(time.perf_counter() - t0, method=method)
+
+def _gcal_execute(req, retry: bool = True):
+    """
+    Ejecuta un request de googleapiclient con el Http del hilo actual y el
+    timeout de su operación, con cupo en GCAL_UPSTREAM, reintentos y
+    GCAL_BREAKER. Si Calendar no responde (circuito abierto, timeouts o 5xx
+    tras los reintentos) lanza UpstreamUnavailable. retry=False lo ejecuta tal
+    cual (el importador tiene su propio control de tasa y reintentos).
+    """
+    timeout = _gcal_timeout(req)
+    if not retry:
+        return req.execute(http=_gc_http(timeout))
+    if not GCAL_BREAKER.allow():
+        raise UpstreamUnavailable("calendar", GCAL_BREAKER.retry_after())
+    idempotent = getattr(req, "methodId", None) in GCAL_IDEMPOTENT
+    try:
+        result = GCAL_UPSTREAM.call(lambda: req.execute(http=_gc_http(timeout)), idempotent=idempotent)
+    except HttpError as e:
+        if e.resp.status < 500:
+            GCAL_BREAKER.success()  # 4xx (404, 409, 410...): Calendar está respondiendo
+            raise
+        GCAL_BREAKER.failure()
+        raise UpstreamUnavailable("calendar", GCAL_BREAKER.retry_after()) from e
+    except UpstreamBusy:
+        raise
+    except Exception as e:
+        if _gcal_classify(e)[0] != 0:
+            raise
+        GCAL_BREAKER.failure()
+        raise UpstreamUnavailable("calendar", GCAL_BREAKER.retry_after()) from e
+    GCAL_BREAKER.success()
+    return result
+
+def gcal_batch(items):
+    """
+    Ejecuta [(clave, request), ...] con la API batch, en lotes de CAL_BATCH_SIZE.
+    Devuelve {clave: (respuesta, excepción | None)}; si un lote entero falla, sus
+    claves llevan esa excepción.
+    """
+    results = {}
+
+    def collect(request_id, response, exception):
+        results[request_id] = (response, exception)
+
+    for i in range(0, len(items), CAL_BATCH_SIZE):
+        chunk = items[i:i + CAL_BATCH_SIZE]
+        batch = gc_service.new_batch_http_request(callback=collect)
+        for key, req in chunk:
+            batch.add(req, request_id=str(key))
+        try:
+            gcal_execute(batch)
+        except (HttpError, UpstreamUnavailable, UpstreamBusy) as e:
+            # Falla el lote completo: solo sus ítems quedan con error, los lotes anteriores ya se crearon
+            for key, _req in chunk:
+                results.setdefault(str(key), (None, e))
+    return results
+
+def _list_events(**kwargs):
+    return gcal_execute(gc_service.events().list(**kwargs))
+
+def _watch_events(**kwargs):
+    return gcal_execute(gc_service.events().watch(**kwargs))
+
+CAL_MIRROR = CalendarMirror(_list_events, CALENDAR_ID, TIMEZONE, max_age_sec=CAL_MIRROR_MAX_AGE,
+                            watch_events=_watch_events, past_days=CAL_MIRROR_PAST_DAYS,
+                            max_stale_sec=CAL_MIRROR_MAX_STALE)
+
+def _mirror_ready(dt=None) -> bool:
+    """La copia local sirve para consultar `dt`; si no (o si no se pudo sincronizar) se va a la API."""
+    return CAL_MIRROR_ENABLED and (dt is None or CAL_MIRROR.covers(dt)) and CAL_MIRROR.ensure_fresh()
+
+def slot_taken(start_dt, end_dt, exclude_id=None) -> bool:
+    """Con CAL_MIRROR, ¿hay otra cita en [start_dt, end_dt)? Sin la copia al día, lo pregunta a events.list."""
+    if not CAL_MIRROR_ENABLED:
+        return False
+    if _mirror_ready(start_dt):
+        return bool(CAL_MIRROR.overlapping(start_dt, end_dt, exclude_id=exclude_id))
+    resp = gcal_execute(gc_service.events().list(
+        calendarId=CALENDAR_ID, timeMin=start_dt.isoformat(), timeMax=end_dt.isoformat(),
+        singleEvents=True, maxResults=10))
+    return any(ev.get("id") != exclude_id for ev in (resp.get("items") or []))
+
+def _query_freebusy(time_min, time_max, calendar_ids):
+    body = {"timeMin": time_min, "timeMax": time_max, "timeZone": TIMEZONE,
+            "items": [{"id": c} for c in calendar_ids]}
+    return gcal_execute(gc_service.freebusy().query(body=body))
+
+AVAILABILITY = Availability(_query_freebusy, AVAIL_CALENDAR_IDS or [CALENDAR_ID], TIMEZONE,
+                            hours=AVAIL_HOURS, days=AVAIL_DAYS, buffer_min=AVAIL_BUFFER_MIN,
+                            min_notice_min=AVAIL_MIN_NOTICE_MIN, ttl_sec=AVAIL_CACHE_TTL)
 
 # OpenAI client
-oa_client = OpenAI(api_key=OPENAI_API_KEY)
+def _build_openai():
+    from openai import OpenAI
+    # Los reintentos los hace OPENAI_UPSTREAM (con el límite de tasa compartido)
+    return OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+oa_client = lazy.build("openai_client", _build_openai, LAZY_INIT, STARTUP)
+
+def _build_async_openai():
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+# Solo lo usa el camino async (asgi.py): siempre se construye en el primer uso
+aoa_client = lazy.LazyObject("openai_async_client", _build_async_openai, STARTUP)
+
+# dateparser: cargar datos de español antes del primer request (corre en el master con --preload).
+# Con LAZY_INIT lo hace el hilo de calentamiento de cada worker, primero; un parseo que
+# lo necesite antes espera a que termine (dates._dp), no compite con él.
+DATEPARSER_PREWARM = os.getenv("DATEPARSER_PREWARM", "1") == "1"
+if DATEPARSER_PREWARM and not LAZY_INIT:
+    with STARTUP.timed("dateparser_prewarm", "inits"):
+        dates.prewarm()
+
+WARMUP = lazy.WarmUp([
+    ("warmup:dateparser", dates.prewarm if DATEPARSER_PREWARM else (lambda: None)),
+    ("warmup:calendar_service", lambda: lazy.unwrap(gc_service)),
+    ("warmup:google_auth_httplib2", lambda: __import__("google_auth_httplib2")),
+    ("warmup:openai_client", lambda: lazy.unwrap(oa_client)),
+], STARTUP)
 
 # Flask app
 app = Flask(__name__)
 
+PROFILER = None
+if PROFILE_TOKEN:
+    PROFILER = Profiler(PROFILE_TOKEN, sample_rate=PROFILE_SAMPLE_RATE, mode=PROFILE_MODE, keep=PROFILE_KEEP,
+                        interval_ms=PROFILE_INTERVAL_MS, sessions=PROFILE_SESSIONS, directory=PROFILE_DIR)
+    app.wsgi_app = ProfilerMiddleware(app.wsgi_app, PROFILER)
+
+@app.before_request
+def _metrics_start():
+    METRICS.start()
+    g.metrics_t0 = time.perf_counter()
+    HTTP_INFLIGHT.inc()
+
+@app.after_request
+def _metrics_observe(resp):
+    if "metrics_t0" in g:
+        route = request.url_rule.rule if request.url_rule else "<sin ruta>"
+        observe_request(route, request.method, resp.status_code, time.perf_counter() - g.metrics_t0)
+    return resp
+
+@app.teardown_request
+def _metrics_done(exc=None):
+    if "metrics_t0" in g:
+        HTTP_INFLIGHT.dec()
+
+if LAZY_INIT:
+    @app.before_request
+    def _warmup_on_first_request():
+        WARMUP.start()
+
 # =========================
 # Estado por sesión
 # =========================
@@ -87,23 +536,30 @@ app = Flask(__name__)
 #     "awaiting_confirm": bool,
 #     "candidate": {...},
 #     "last_event_id": str|None,
-#     "cancel_pending": {"event_id","calendar_id","when"}|None
+#     "cancel_pending": {"event_id","calendar_id","when"}|None,
+#     "summary": str  (vueltas antiguas plegadas, ver compact_history)
 # } }
-SESSIONS = {}
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # memory | sqlite (persistente, multi-worker)
+
+def _new_session():
+    return {
+        "history": [],
+        "slots": {"nombre":"", "datetime_text":"", "fecha":"", "hora":"", "telefono":"", "email":""},
+        "awaiting_confirm": False,
+        "candidate": None,
+        "last_event_id": None,
+        "cancel_pending": None,
+        "summary": "",
+    }
+
+if SESSION_BACKEND == "sqlite":
+    SESSION_STORE = SQLiteSessionStore(os.getenv("SESSION_DB", STATE_DB), _new_session,
+                                       ttl_sec=int(os.getenv("SESSION_TTL_SEC", str(30 * 86400))))
+else:
+    SESSION_STORE = MemorySessionStore(_new_session)
 
 def _get_session(session_id: str):
-    s = SESSIONS.get(session_id)
-    if not s:
-        s = {
-            "history": [],
-            "slots": {"nombre":"", "datetime_text":"", "fecha":"", "hora":"", "telefono":"", "email":""},
-            "awaiting_confirm": False,
-            "candidate": None,
-            "last_event_id": None,
-            "cancel_pending": None,
-        }
-        SESSIONS[session_id] = s
-    return s
+    return SESSION_STORE.get(session_id)
 
 # =========================
 # HTML: Chat Web
@@ -183,6 +639,7 @@ function addMsg(text, who='bot'){
   div.appendChild(b);
   chat.appendChild(div);
   chat.scrollTop = chat.scrollHeight;
+  return b;
 }
 
 function addEventCard(htmlLink, phone, email, icsUrl, gcalUrl){
@@ -213,6 +670,54 @@ async function callBot(text){
     email: mailI.value || '',
     comentario: comI.value || ''
   };
+  let resp;
+  try {
+    resp = await fetch('/chatbot/stream', {
+      method: 'POST',
+      headers: {'Content-Type': 'application/json', 'Accept': 'text/event-stream'},
+      body: JSON.stringify(payload)
+    });
+  } catch (e) { resp = null; }
+  if (!resp || !resp.ok || !resp.body) {
+    return callBotJson(payload);
+  }
+
+  // Server-Sent Events: 'delta' trae texto incremental, 'done' el resultado final
+  let bubble = null;
+  const reader = resp.body.getReader();
+  const dec = new TextDecoder();
+  let buf = '';
+  while (true) {
+    const {value, done} = await reader.read();
+    if (done) break;
+    buf += dec.decode(value, {stream: true});
+    let i;
+    while ((i = buf.indexOf('\\n\\n')) >= 0) {
+      const frame = buf.slice(0, i); buf = buf.slice(i + 2);
+      let ev = 'message', data = '';
+      for (const line of frame.split('\\n')) {
+        if (line.startsWith('event:')) ev = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      const obj = data ? JSON.parse(data) : {};
+      if (ev === 'delta') {
+        if (!bubble) bubble = addMsg('', 'bot');
+        bubble.textContent += obj.text;
+        chat.scrollTop = chat.scrollHeight;
+      } else if (ev === 'done') {
+        if (!bubble) bubble = addMsg('', 'bot');
+        bubble.textContent = obj.reply || '(sin respuesta)';
+        if (obj.done && obj.evento) {
+          addEventCard(obj.evento.htmlLink, obj.evento.telefono, obj.evento.email, obj.evento.icsUrl, obj.evento.gcalAddUrl);
+        }
+      } else if (ev === 'error') {
+        addMsg(obj.error || 'No pude procesarlo ahora. Intenta nuevamente.', 'bot');
+      }
+    }
+  }
+}
+
+async function callBotJson(payload){
   const resp = await fetch('/chatbot', {
     method: 'POST',
     headers: {'Content-Type': 'application/json'},
@@ -249,61 +754,6 @@ addMsg({{ greeting|tojson }});
 </html>
 """
 
-# =========================
-# Fechas: parser robusto
-# =========================
-def _has_time_token(text: str) -> bool:
-    if not text:
-        return False
-    t = text.lower()
-    if re.search(r"\b(mediod[ií]a|medianoche)\b", t):
-        return True
-    return bool(re.search(r"\b\d{1,2}(:\d{2})?\s*(am|pm)?\b", t))
-
-def parse_datetime_es(payload: dict):
-    """
-    Convierte texto o (fecha+hora) a datetime con tz.
-    - DATE_ORDER=DMY (12/08 = 12 de agosto)
-    - Normaliza '13 horas/hrs', 'a las 13' y '13' (al final) -> '13:00'
-    - Requiere hora cuando viene por texto natural
-    - Prefiere futuro; RELATIVE_BASE ahora en TZ
-    """
-    now = datetime.now(ZoneInfo(TIMEZONE))
-    settings = {
-        "PREFER_DATES_FROM": "future",
-        "RETURN_AS_TIMEZONE_AWARE": True,
-        "TIMEZONE": TIMEZONE,
-        "RELATIVE_BASE": now,
-        "DATE_ORDER": "DMY",
-    }
-
-    dt_text = (payload.get("datetime_text") or "").strip()
-    if dt_text:
-        txt = dt_text.lower()
-        txt = re.sub(r"\b(a\s*las\s*)?(\d{1,2})\s*(h|hs|hrs|horas)\b", r"\2:00", txt)
-        txt = re.sub(r"\b(a\s*las\s*)?(\d{1,2})\b(?=\s*$)", r"\2:00", txt)
-        if not _has_time_token(txt):
-            return None
-        dt = dateparser.parse(txt, languages=["es"], settings=settings)
-        if dt:
-            return dt
-
-    fecha = (payload.get("fecha") or "").strip()
-    hora = (payload.get("hora") or "").strip()
-    if fecha and hora:
-        if re.fullmatch(r"\d{1,2}", hora):
-            hora = f"{hora}:00"
-        dt = dateparser.parse(f"{fecha} {hora}", languages=["es"], settings=settings)
-        if dt:
-            return dt
-
-    if fecha and not hora and payload.get("_allow_date_only"):
-        dt = dateparser.parse(f"{fecha} 10:00", languages=["es"], settings=settings)
-        if dt:
-            return dt
-
-    return None
-
 # =========================
 # Links “Añadir a GCal” y .ics
 # =========================
@@ -323,32 +773,87 @@ def make_gcal_template_link(summary: str, start_dt, end_dt, description: str = "
     base = "https://calendar.google.com/calendar/render?"
     return base + "&".join([f"{k}={quote(v)}" for k, v in qs.items() if v])
 
-def build_ics_from_event(ev: dict):
-    uid = ev.get("id") + "@bot-citas"
-    summary = ev.get("summary", "Cita")
-    description = (ev.get("description") or "").replace("\n", "\\n")
-    start = ev["start"]["dateTime"]
-    end   = ev["end"]["dateTime"]
-    start_dt = datetime.fromisoformat(start.replace("Z","+00:00"))
-    end_dt   = datetime.fromisoformat(end.replace("Z","+00:00"))
-    dtstamp  = _to_utc_fmt(datetime.now(ZoneInfo("UTC")))
-    ics = "\r\n".join([
-        "BEGIN:VCALENDAR","VERSION:2.0","PRODID:-//Bot Citas//EN","CALSCALE:GREGORIAN","METHOD:PUBLISH",
+def _event_updated(ev: dict):
+    if ev.get("updated"):
+        return datetime.fromisoformat(ev["updated"].replace("Z", "+00:00"))
+    return datetime.now(ZoneInfo("UTC"))
+
+# {event_id: {"etag", "updated", "ics"}}; se llena al crear/actualizar y se borra al eliminar
+ICS_CACHE = LRUCache(ICS_CACHE_SIZE)
+
+def cache_ics(ev: dict) -> dict | None:
+    """Renderiza el .ics del evento y lo guarda con su etag."""
+    if not ev.get("id") or not (ev.get("start") or {}).get("dateTime"):
+        return None
+    ics = build_ics_from_event(ev).encode("utf-8")
+    entry = {
+        "etag": (ev.get("etag") or "").strip('"') or hashlib.sha1(ics).hexdigest(),
+        "updated": _event_updated(ev).replace(microsecond=0),
+        "ics": ics,
+    }
+    ICS_CACHE.set(ev["id"], entry)
+    return entry
+
+ICS_HEADER = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Bot Citas//EN", "CALSCALE:GREGORIAN", "METHOD:PUBLISH"]
+
+def _ics_escape(text: str) -> str:
+    """Escapado de TEXT según RFC 5545 (\\ ; , y saltos de línea)."""
+    return (text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+                .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+def _ics_fold(line: str) -> str:
+    """Pliega una línea a 75 octetos (continuación con CRLF + espacio) sin cortar caracteres UTF-8."""
+    if len(line.encode("utf-8")) <= 75:
+        return line
+    out, cur, size = [], [], 0
+    for ch in line:
+        n = len(ch.encode("utf-8"))
+        if size + n > 75:
+            out.append("".join(cur))
+            cur, size = [" "], 1
+        cur.append(ch)
+        size += n
+    out.append("".join(cur))
+    return "\r\n".join(out)
+
+def _ics_when(prop: str, when: dict) -> str:
+    if when.get("dateTime"):
+        return f"{prop}:{_to_utc_fmt(datetime.fromisoformat(when['dateTime'].replace('Z', '+00:00')))}"
+    return f"{prop};VALUE=DATE:{when['date'].replace('-', '')}"
+
+def build_vevent(ev: dict) -> str:
+    """Un VEVENT (líneas escapadas y plegadas, terminado en CRLF)."""
+    lines = [
         "BEGIN:VEVENT",
-        f"UID:{uid}",
-        f"DTSTAMP:{dtstamp}",
-        f"DTSTART:{_to_utc_fmt(start_dt)}",
-        f"DTEND:{_to_utc_fmt(end_dt)}",
-        f"SUMMARY:{summary}",
-        f"DESCRIPTION:{description}",
+        f"UID:{ev.get('id')}@bot-citas",
+        # DTSTAMP = última modificación del evento: el mismo etag siempre produce el mismo archivo
+        f"DTSTAMP:{_to_utc_fmt(_event_updated(ev))}",
+        _ics_when("DTSTART", ev["start"]),
+        _ics_when("DTEND", ev["end"]),
+        f"SUMMARY:{_ics_escape(ev.get('summary') or 'Cita')}",
+        f"DESCRIPTION:{_ics_escape(ev.get('description') or '')}",
         "END:VEVENT",
-        "END:VCALENDAR",""
-    ])
-    return ics
+    ]
+    return "".join(_ics_fold(l) + "\r\n" for l in lines)
+
+def build_ics_from_event(ev: dict):
+    return "\r\n".join(ICS_HEADER) + "\r\n" + build_vevent(ev) + "END:VCALENDAR\r\n"
 
 # =========================
 # Helpers Google Calendar
 # =========================
+# "Etiqueta: valor" en la descripción que arma build_event_payload
+_DESC_FIELD_RE = {}
+
+def _desc_field(desc: str, label: str) -> str:
+    if not desc:
+        return ""
+    rx = _DESC_FIELD_RE.get(label)
+    if rx is None:
+        rx = _DESC_FIELD_RE[label] = re.compile(fr"{re.escape(label)}:\s*(.+)")
+    m = rx.search(desc)
+    return m.group(1).strip() if m else ""
+
 def build_event_payload(nombre, start_dt, end_dt, telefono="", email="", comentario=""):
     description_lines = ["Tipo: Llamada saliente", f"Nombre: {nombre}"]
     if telefono:  description_lines.append(f"Teléfono: {telefono}")
@@ -369,8 +874,27 @@ def format_confirmation_message(nombre: str, start_dt, telefono: str | None):
             f"Un ejecutivo te contactará{tel_txt}. Dura 30 minutos. "
             "Si necesitas cambiarla o cancelarla, avísame por aquí.")
 
-def create_event_calendar(nombre, datetime_text=None, fecha=None, hora=None,
-                          telefono="", email="", comentario="", allow_date_only=False):
+_LAST_BASE_URL = ""
+
+def _public_base_url():
+    """Base URL del servicio: la del request actual o, fuera de él (workers del webhook),
+    PUBLIC_BASE_URL o la última vista en un request."""
+    global _LAST_BASE_URL
+    try:
+        _LAST_BASE_URL = request.host_url.rstrip("/")
+        return _LAST_BASE_URL
+    except RuntimeError:
+        return PUBLIC_BASE_URL or _LAST_BASE_URL
+
+def remember_base_url(url: str):
+    """Para servidores fuera de Flask (asgi.py): la URL con que llegó el último request."""
+    global _LAST_BASE_URL
+    _LAST_BASE_URL = url.rstrip("/")
+
+def prepare_event(nombre, datetime_text=None, fecha=None, hora=None,
+                  telefono="", email="", comentario="", allow_date_only=False, event_id=None):
+    """Valida los datos de una cita. Devuelve (datos, None) o (None, mensaje para el cliente).
+    Con `event_id` la cita se insertará con ese id (importación idempotente)."""
     start_dt = parse_datetime_es({
         "datetime_text": datetime_text, "fecha": fecha, "hora": hora,
         "_allow_date_only": allow_date_only
@@ -385,23 +909,48 @@ def create_event_calendar(nombre, datetime_text=None, fecha=None, hora=None,
         return None, "¿Cuál es tu correo electrónico? (lo usamos solo para respaldo de contacto)."
 
     end_dt = start_dt + timedelta(minutes=30)
-    event_body = build_event_payload(nombre or "Cliente", start_dt, end_dt, telefono, email, comentario)
-    created = gc_service.events().insert(calendarId=CALENDAR_ID, body=event_body, sendUpdates="none").execute()
-
-    gcal_link = make_gcal_template_link(event_body["summary"], start_dt, end_dt, event_body.get("description",""))
-    try:
-        base = request.host_url.rstrip("/")
-        ics_url = f"{base}/ics/{created.get('id')}.ics"
-    except RuntimeError:
-        ics_url = ""
-
-    msg = format_confirmation_message(nombre or "Cliente", start_dt, telefono)
-    created["telefono"] = telefono
-    created["email"] = email
+    if slot_taken(start_dt, end_dt, exclude_id=event_id):
+        return None, "Ese horario ya está tomado. ¿Te acomoda otra hora? (ejemplo: 12/08 13:30)"
+    body = build_event_payload(nombre or "Cliente", start_dt, end_dt, telefono, email, comentario)
+    if event_id:
+        body["id"] = event_id
+    return {
+        "nombre": nombre or "Cliente",
+        "start_dt": start_dt,
+        "end_dt": end_dt,
+        "telefono": telefono,
+        "email": email,
+        "body": body,
+    }, None
+
+def _finish_created(created: dict, prep: dict):
+    """Registra la cita creada localmente y le agrega links .ics / 'Añadir a GCal'."""
+    if CAL_MIRROR_ENABLED:
+        CAL_MIRROR.apply(created)
+    AVAILABILITY.invalidate()
+    cache_ics(created)
+
+    event_body = prep["body"]
+    gcal_link = make_gcal_template_link(event_body["summary"], prep["start_dt"], prep["end_dt"],
+                                        event_body.get("description",""))
+    base = _public_base_url()
+    ics_url = f"{base}/ics/{created.get('id')}.ics" if base else ""
+
+    msg = format_confirmation_message(prep["nombre"], prep["start_dt"], prep["telefono"])
+    created["telefono"] = prep["telefono"]
+    created["email"] = prep["email"]
     created["icsUrl"] = ics_url
     created["gcalAddUrl"] = gcal_link
     return created, msg
 
+def create_event_calendar(nombre, datetime_text=None, fecha=None, hora=None,
+                          telefono="", email="", comentario="", allow_date_only=False):
+    prep, err = prepare_event(nombre, datetime_text, fecha, hora, telefono, email, comentario, allow_date_only)
+    if not prep:
+        return None, err
+    created = gcal_execute(gc_service.events().insert(calendarId=CALENDAR_ID, body=prep["body"], sendUpdates="none"))
+    return _finish_created(created, prep)
+
 def update_event_calendar(event_id: str,
                           nombre: str | None = None,
                           datetime_text: str | None = None,
@@ -411,7 +960,7 @@ def update_event_calendar(event_id: str,
                           email: str | None = None,
                           comentario: str | None = None):
     try:
-        ev = gc_service.events().get(calendarId=CALENDAR_ID, eventId=event_id).execute()
+        ev = gcal_execute(gc_service.events().get(calendarId=CALENDAR_ID, eventId=event_id))
     except HttpError:
         return None, f"No encontré la cita ({event_id})."
 
@@ -422,6 +971,8 @@ def update_event_calendar(event_id: str,
         if not start_dt:
             return None, "No entendí la nueva fecha/hora. Ej: 12/08 13:00."
         end_dt = start_dt + timedelta(minutes=30)
+        if slot_taken(start_dt, end_dt, exclude_id=event_id):
+            return None, "Ese horario ya está tomado. ¿Te acomoda otra hora? (ejemplo: 12/08 13:30)"
         ev["start"] = {"dateTime": start_dt.isoformat(), "timeZone": TIMEZONE}
         ev["end"]   = {"dateTime": end_dt.isoformat(),   "timeZone": TIMEZONE}
 
@@ -434,8 +985,7 @@ def update_event_calendar(event_id: str,
         def pick(label, nuevo):
             if nuevo is not None and nuevo != "":
                 return nuevo
-            m = re.search(fr"{label}:\s*(.+)", desc_prev)
-            return (m.group(1).strip() if m else "")
+            return _desc_field(desc_prev, label)
         nombre_desc   = nombre or (re.sub(r"^Llamada con\s*", "", ev.get("summary","")) or "Cliente")
         telefono_desc = pick("Teléfono", telefono)
         email_desc    = pick("Email", email)
@@ -446,17 +996,42 @@ def update_event_calendar(event_id: str,
         if coment_desc:   lines.append(f"Comentario: {coment_desc}")
         ev["description"] = "\n".join(lines)
 
-    updated = gc_service.events().update(calendarId=CALENDAR_ID, eventId=event_id, body=ev).execute()
+    ICS_CACHE.pop(event_id)
+    updated = gcal_execute(gc_service.events().update(calendarId=CALENDAR_ID, eventId=event_id, body=ev))
+    if CAL_MIRROR_ENABLED:
+        CAL_MIRROR.apply(updated)
+    AVAILABILITY.invalidate()
+    cache_ics(updated)
     return updated, "Cita actualizada correctamente."
 
 def delete_event_calendar(event_id: str, calendar_id: str | None = None):
     cal_id = calendar_id or CALENDAR_ID
     try:
-        gc_service.events().delete(calendarId=cal_id, eventId=event_id, sendUpdates="none").execute()
+        gcal_execute(gc_service.events().delete(calendarId=cal_id, eventId=event_id, sendUpdates="none"))
+        ICS_CACHE.pop(event_id)
+        if CAL_MIRROR_ENABLED and cal_id == CALENDAR_ID:
+            CAL_MIRROR.remove(event_id)
+        AVAILABILITY.invalidate()
         return True, "Cita eliminada."
     except HttpError as e:
         return False, f"No pude eliminar la cita ({event_id}). {e.reason}"
 
+def delete_replaced_event(event_id: str, calendar_id: str | None = None):
+    """
+    Borra la cita anterior después de crear la nueva (reprogramación). La nueva ya
+    existe: si Calendar falla o no responde se informa (False, motivo) en vez de
+    lanzar, y el fallo queda registrado porque el calendario queda con un duplicado.
+    """
+    try:
+        ok, msg = delete_event_calendar(event_id, calendar_id)
+    except (UpstreamUnavailable, UpstreamBusy):
+        ok, msg = False, f"No pude eliminar la cita ({event_id}): Google Calendar no responde."
+    if not ok:
+        REPLACED_DELETE_FAILURES.inc()
+        with tracing.trace("calendar.replaced_delete_error", force=True, event_id=event_id, error=msg):
+            pass
+    return ok, msg
+
 def extract_event_and_cal_from_eid(eid_or_link: str):
     """Acepta el 'eid' o el 'htmlLink' y devuelve (event_id, calendar_id|None)."""
     if not eid_or_link:
@@ -498,22 +1073,66 @@ def human_dt(dt_iso: str):
 def find_event_id_by_datetime(dt_target, cal_id=None, tolerance_min=15):
     """Busca un evento que empiece cerca de dt_target ±tolerance_min y tenga summary 'Llamada con ...'."""
     cal_id = cal_id or CALENDAR_ID
+    if cal_id == CALENDAR_ID and _mirror_ready(dt_target - timedelta(minutes=tolerance_min)):
+        items = CAL_MIRROR.find_near(dt_target, tolerance_min)[:5]
+        for ev in items:
+            if (ev.get("summary") or "").lower().startswith("llamada con"):
+                return ev.get("id"), ev
+        return (items[0].get("id"), items[0]) if items else (None, None)
     tmin = (dt_target - timedelta(minutes=tolerance_min)).isoformat()
     tmax = (dt_target + timedelta(minutes=tolerance_min)).isoformat()
-    resp = gc_service.events().list(
+    resp = gcal_execute(gc_service.events().list(
         calendarId=cal_id,
         timeMin=tmin,
         timeMax=tmax,
         singleEvents=True,
         orderBy="startTime",
         maxResults=5
-    ).execute()
+    ))
     for ev in (resp.get("items") or []):
         if (ev.get("summary") or "").lower().startswith("llamada con"):
             return ev.get("id"), ev
     items = resp.get("items") or []
     return (items[0].get("id"), items[0]) if items else (None, None)
 
+@app.post("/calendar/notify")
+def calendar_notify():
+    """Notificación de events.watch: el calendario cambió, refrescar la copia local."""
+    if not CAL_MIRROR_ENABLED:
+        return "", 204
+    if CAL_WATCH_TOKEN and request.headers.get("X-Goog-Channel-Token") != CAL_WATCH_TOKEN:
+        return "forbidden", 403
+    if request.headers.get("X-Goog-Resource-State") != "sync":
+        CAL_MIRROR.refresh_async()
+    return "", 200
+
+# =========================
+# Páginas pre-renderizadas
+# =========================
+class StaticPage:
+    """HTML fijo con sus versiones comprimidas y ETag calculados una vez."""
+
+    def __init__(self, html: str, max_age: int = 300):
+        self.body = html.encode("utf-8")
+        self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+        self.max_age = max_age
+        self.encoded = {"gzip": gzip.compress(self.body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.encoded["br"] = brotli.compress(self.body, quality=11)
+
+    def response(self):
+        accept = request.accept_encodings
+        enc = next((e for e in ("br", "gzip") if e in self.encoded and accept[e]), None)
+        body = self.encoded[enc] if enc else self.body
+        resp = Response(body, content_type="text/html; charset=utf-8")
+        if enc:
+            resp.headers["Content-Encoding"] = enc
+        resp.headers["Vary"] = "Accept-Encoding"
+        resp.headers["Cache-Control"] = f"public, max-age={self.max_age}"
+        # Una representación por codificación: ETag distinto para cada una
+        resp.set_etag(f"{self.etag}-{enc}" if enc else self.etag)
+        return resp.make_conditional(request)
+
 # =========================
 # Rutas básicas / formulario / .ics
 # =========================
@@ -528,8 +1147,52 @@ def diag():
         "calendar_id": CALENDAR_ID,
         "timezone": TIMEZONE,
         "service_account_email": info.get("client_email"),
+        "wa_mailbox": WA_MAILBOX.stats() if WA_ASYNC else None,
+        "wa_sender": WA_SENDER.stats(),
+        "calendar_mirror": CAL_MIRROR.stats() if CAL_MIRROR_ENABLED else None,
+        "fastpath": FASTPATH_STATS,
+        "date_cache": dates.cache_stats(),
+        "ics_cache": ICS_CACHE.stats(),
+        "startup": {"lazy_init": LAZY_INIT, **STARTUP.as_dict()},
+        "llm": {**LLM_STATS, "recent_prompt_tokens": list(LLM_STATS["recent_prompt_tokens"])},
+        "upstreams": {u.name: u.stats() for u in (OPENAI_UPSTREAM, GCAL_UPSTREAM, GRAPH_UPSTREAM)},
+        "calendar_breaker": GCAL_BREAKER.stats(),
+        "profiling": PROFILER.stats() if PROFILER else None,
+        "tracing": {"sample_rate": 1.0 if DEBUG_WA else TRACE_SAMPLE_RATE, **TRACE_WRITER.stats()},
+        "admission": {"chat": CHAT_ADMISSION.stats(), "async_chat": ASYNC_CHAT_ADMISSION.stats()},
     })
 
+@app.get("/_metrics")
+def metrics_endpoint():
+    """Métricas en formato de texto de Prometheus (sumadas entre workers con METRICS_DIR)."""
+    return Response(METRICS.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+if PROFILER:
+    def _profile_auth() -> bool:
+        return PROFILER.authorized(request.headers.get("X-Profile") or request.args.get("_profile"))
+
+    @app.get("/_profiles")
+    def profiles_list():
+        if not _profile_auth():
+            return "forbidden", 403
+        return jsonify({"pid": os.getpid(), "profiles": PROFILER.recent()})
+
+    @app.get("/_profiles/<profile_id>")
+    def profile_get(profile_id):
+        """?format=text (reporte, por defecto), collapsed (stacks para flamegraph, modo wall) o json."""
+        if not _profile_auth():
+            return "forbidden", 403
+        record = PROFILER.get(profile_id)
+        if record is None:
+            return "no encontrado (¿otro worker? usa PROFILE_DIR)", 404
+        fmt = request.args.get("format", "text")
+        if fmt == "json":
+            return jsonify(record)
+        if fmt == "collapsed":
+            return Response(record.get("collapsed") or "", mimetype="text/plain")
+        head = f"{record['kind']} {record['name']} — {record['ms']} ms ({record['mode']})\n\n"
+        return Response(head + record["report"], mimetype="text/plain")
+
 @app.get("/_routes")
 def list_routes():
     return jsonify(sorted([str(r) for r in app.url_map.iter_rules()]))
@@ -571,9 +1234,14 @@ RESULT_HTML = """
 </body></html>
 """
 
+# Plantillas compiladas una sola vez; /chat y /nuevo no dependen del request y se
+# pre-renderizan (con gzip y, si está instalado, brotli) al importar el módulo.
+FORM_TMPL = app.jinja_env.from_string(FORM_HTML)
+RESULT_TMPL = app.jinja_env.from_string(RESULT_HTML)
+
 @app.get("/nuevo")
 def nuevo():
-    return render_template_string(FORM_HTML, tz=TIMEZONE, cal=CALENDAR_ID)
+    return STATIC_PAGES["nuevo"].response()
 
 @app.post("/nuevo")
 def crear_cita_web():
@@ -591,8 +1259,7 @@ def crear_cita_web():
     if not created:
         return msg, 400
     pretty = json.dumps(created, ensure_ascii=False, indent=2)
-    return render_template_string(
-        RESULT_HTML,
+    return RESULT_TMPL.render(
         mensaje=msg,
         start_dt=created.get("start", {}).get("dateTime"),
         end_dt=created.get("end", {}).get("dateTime"),
@@ -604,23 +1271,121 @@ def crear_cita_web():
         pretty_event=pretty
     )
 
+CHAT_TMPL = app.jinja_env.from_string(CHAT_HTML)
+
+with app.app_context():
+    STATIC_PAGES = {
+        "chat": StaticPage(CHAT_TMPL.render(tz=TIMEZONE, cal=CALENDAR_ID, greeting=GREETING_TEXT),
+                           max_age=STATIC_PAGE_MAX_AGE),
+        "nuevo": StaticPage(FORM_TMPL.render(tz=TIMEZONE, cal=CALENDAR_ID), max_age=STATIC_PAGE_MAX_AGE),
+    }
+
 @app.get("/chat")
 def chat_ui():
-    return render_template_string(CHAT_HTML, tz=TIMEZONE, cal=CALENDAR_ID, greeting=GREETING_TEXT)
+    return STATIC_PAGES["chat"].response()
+
+@app.get("/disponibilidad")
+def disponibilidad():
+    """Horarios libres de 30 min entre ?desde=AAAA-MM-DD y ?hasta=AAAA-MM-DD (por defecto, 7 días)."""
+    hoy = datetime.now(ZoneInfo(TIMEZONE)).date()
+    try:
+        desde = date.fromisoformat(request.args.get("desde") or hoy.isoformat())
+        hasta = date.fromisoformat(request.args.get("hasta") or (desde + timedelta(days=6)).isoformat())
+    except ValueError:
+        return jsonify({"ok": False, "error": "Usa fechas AAAA-MM-DD en desde/hasta."}), 400
+    if hasta < desde or (hasta - desde).days >= AVAIL_MAX_DAYS:
+        return jsonify({"ok": False, "error": f"Rango inválido (máximo {AVAIL_MAX_DAYS} días)."}), 400
+    try:
+        dias = AVAILABILITY.free_slots(desde, hasta)
+    except HttpError as e:
+        return jsonify({"ok": False, "error": f"No pude consultar la agenda. {e.reason}"}), 502
+    return jsonify({
+        "ok": True,
+        "timezone": TIMEZONE,
+        "duracion_min": 30,
+        "dias": [{"fecha": d.isoformat(), "horarios": [s.strftime("%H:%M") for s in slots]}
+                 for d, slots in dias],
+    })
+
+_FEED_PROBE = {"at": 0.0, "updated": ""}
+
+def _feed_version() -> str:
+    """
+    Última modificación del calendario ('updated' de events.list con una página de 1 ítem),
+    cacheada ICS_FEED_PROBE_TTL segundos: basta para responder 304 sin recorrer el feed.
+    """
+    now = time.time()
+    if now - _FEED_PROBE["at"] > ICS_FEED_PROBE_TTL:
+        resp = _list_events(calendarId=CALENDAR_ID, maxResults=1, fields="updated")
+        _FEED_PROBE.update(at=now, updated=resp.get("updated") or "")
+    return _FEED_PROBE["updated"]
+
+def _feed_chunks(time_min: str):
+    yield "\r\n".join(ICS_HEADER) + "\r\n"
+    yield _ics_fold(f"X-WR-CALNAME:{_ics_escape(COMPANY_NAME)}") + "\r\n"
+    yield f"X-WR-TIMEZONE:{TIMEZONE}\r\n"
+    page_token = None
+    while True:
+        resp = _list_events(calendarId=CALENDAR_ID, timeMin=time_min, singleEvents=True,
+                            orderBy="startTime", maxResults=250, pageToken=page_token,
+                            fields="items(id,status,summary,description,start,end,updated),nextPageToken")
+        for ev in resp.get("items") or []:
+            if ev.get("status") != "cancelled" and ev.get("start") and ev.get("end"):
+                yield build_vevent(ev)
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            break
+    yield "END:VCALENDAR\r\n"
+
+@app.get("/ics/feed.ics")
+def ics_feed():
+    """Un VCALENDAR con las citas desde hace ICS_FEED_PAST_DAYS días, generado página a página."""
+    if not ICS_FEED_TOKEN:
+        return "No encontrado.", 404
+    token = request.args.get("token") or ""
+    if not hmac.compare_digest(token.encode("utf-8"), ICS_FEED_TOKEN.encode("utf-8")):
+        return "No autorizado.", 403
+    # La ventana empieza a medianoche: el contenido solo cambia con el calendario o con el día
+    today = datetime.now(ZoneInfo(TIMEZONE)).date()
+    start = datetime(today.year, today.month, today.day, tzinfo=ZoneInfo(TIMEZONE)) - timedelta(days=ICS_FEED_PAST_DAYS)
+    etag = hashlib.sha1(f"{_feed_version()}|{start.isoformat()}".encode("utf-8")).hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+    resp = Response((c.encode("utf-8") for c in _feed_chunks(start.isoformat())), headers={
+        "Content-Type": "text/calendar; charset=utf-8",
+        "Content-Disposition": 'inline; filename="citas.ics"',
+        "Cache-Control": "private, no-cache",
+    })
+    resp.set_etag(etag)
+    return resp
 
 @app.get("/ics/<event_id>.ics")
 def ics_download(event_id):
-    try:
-        ev = gc_service.events().get(calendarId=CALENDAR_ID, eventId=event_id).execute()
-    except HttpError:
-        return "No encontré la cita.", 404
-    ics = build_ics_from_event(ev)
+    entry = ICS_CACHE.get(event_id)
+    if entry and CAL_MIRROR_ENABLED:
+        # Si la copia local ya vio otra versión (cambio hecho fuera de la app), se re-renderiza
+        mirrored = CAL_MIRROR.get(event_id)
+        if mirrored and (mirrored.get("etag") or "").strip('"') not in ("", entry["etag"]):
+            entry = None
+    if entry is None:
+        try:
+            ev = gcal_execute(gc_service.events().get(calendarId=CALENDAR_ID, eventId=event_id))
+        except HttpError:
+            return "No encontré la cita.", 404
+        if ev.get("status") == "cancelled" or not (entry := cache_ics(ev)):
+            return "No encontré la cita.", 404
     filename = f"cita-{event_id}.ics"
     headers = {
         "Content-Disposition": f'attachment; filename="{filename}"',
         "Content-Type": "text/calendar; charset=utf-8",
+        "Cache-Control": "private, no-cache",
     }
-    return Response(ics, headers=headers)
+    resp = Response(entry["ics"], headers=headers)
+    resp.set_etag(entry["etag"])
+    resp.last_modified = entry["updated"]
+    return resp.make_conditional(request)
 
 # =========================
 # API JSON directa
@@ -654,6 +1419,65 @@ def crear_cita_api():
         "mensaje_para_cliente": msg
     }), 201
 
+@app.post("/citas/bulk")
+def crear_citas_bulk():
+    """
+    Crea muchas citas de una vez: {"citas": [{nombre, datetime_text | fecha+hora, telefono, email, comentario}, ...]}.
+    Valida cada una y envía las válidas por la API batch. Responde con el resultado por ítem.
+    """
+    data = request.get_json(silent=True)
+    citas = data.get("citas") if isinstance(data, dict) else data
+    if not isinstance(citas, list) or not citas:
+        return jsonify({"ok": False, "error": "Envía una lista en 'citas'."}), 400
+    if len(citas) > CAL_BULK_MAX:
+        return jsonify({"ok": False, "error": f"Máximo {CAL_BULK_MAX} citas por solicitud."}), 400
+
+    resultados = [None] * len(citas)
+    preps, taken = {}, IntervalIndex()
+    for i, c in enumerate(citas):
+        c = c if isinstance(c, dict) else {}
+        # Los campos que no son texto (números, listas, null) se tratan como vacíos
+        field = lambda key: c.get(key) if isinstance(c.get(key), str) else None
+        try:
+            prep, err = prepare_event(
+                nombre=(field("nombre") or "").strip() or "Cliente",
+                datetime_text=field("datetime_text"),
+                fecha=field("fecha"),
+                hora=field("hora"),
+                telefono=field("telefono"),
+                email=field("email"),
+                comentario=field("comentario"),
+            )
+        except (HttpError, UpstreamUnavailable, UpstreamBusy):
+            prep, err = None, "No se pudo revisar la agenda para esta cita. Reintenta más tarde."
+        # Los cruces dentro de la misma carga se revisan siempre; contra el calendario, solo con el espejo
+        if prep:
+            lo, hi = prep["start_dt"].timestamp(), prep["end_dt"].timestamp()
+            if taken.overlapping(lo, hi):
+                prep, err = None, "Se cruza con otra cita de esta misma carga."
+            else:
+                taken.add(str(i), lo, hi)
+        if prep:
+            preps[i] = prep
+        else:
+            resultados[i] = {"indice": i, "ok": False, "error": err}
+
+    batch = gcal_batch([(i, gc_service.events().insert(calendarId=CALENDAR_ID, body=p["body"], sendUpdates="none"))
+                        for i, p in preps.items()])
+    for i, prep in preps.items():
+        created, exc = batch.get(str(i), (None, None))
+        if exc is not None or not created:
+            reason = getattr(exc, "reason", None) or "sin respuesta"
+            resultados[i] = {"indice": i, "ok": False, "error": f"Calendar rechazó la cita. {reason}"}
+            continue
+        created, _msg = _finish_created(created, prep)
+        resultados[i] = {"indice": i, "ok": True, "id": created.get("id"), "htmlLink": created.get("htmlLink"),
+                         "start": created.get("start"), "icsUrl": created.get("icsUrl")}
+
+    creadas = sum(1 for r in resultados if r["ok"])
+    return jsonify({"ok": creadas > 0, "creadas": creadas, "errores": len(citas) - creadas,
+                    "resultados": resultados}), 200
+
 @app.patch("/cita/<event_id>")
 def editar_cita(event_id):
     data = request.get_json(silent=True) or {}
@@ -710,25 +1534,21 @@ def reprogramar_cita():
         old_event_id, cal_from_eid = extract_event_and_cal_from_eid(html_link or eid)
     cal_id = cal_from_eid or CALENDAR_ID
 
+    # Solo se lee la cita anterior si faltan datos para la nueva (ahorra un round-trip)
+    need_old = not all((data.get(k) or "").strip() for k in ("nombre", "telefono", "email"))
     old = None
-    if old_event_id:
+    if old_event_id and need_old:
         try:
-            old = gc_service.events().get(calendarId=cal_id, eventId=old_event_id).execute()
+            old = gcal_execute(gc_service.events().get(calendarId=cal_id, eventId=old_event_id))
         except HttpError:
             old = None
 
-    def pick_from_desc(label, desc):
-        if not desc:
-            return ""
-        m = re.search(fr"{label}:\s*(.+)", desc)
-        return m.group(1).strip() if m else ""
-
     nombre_old = telefono_old = email_old = ""
     if old:
         desc_prev = old.get("description") or ""
-        nombre_old = pick_from_desc("Nombre", desc_prev)
-        telefono_old = pick_from_desc("Teléfono", desc_prev)
-        email_old = pick_from_desc("Email", desc_prev)
+        nombre_old = _desc_field(desc_prev, "Nombre")
+        telefono_old = _desc_field(desc_prev, "Teléfono")
+        email_old = _desc_field(desc_prev, "Email")
         if not nombre_old:
             nombre_old = re.sub(r"^Llamada con\s*", "", old.get("summary","")).strip() or "Cliente"
 
@@ -752,7 +1572,7 @@ def reprogramar_cita():
     deleted = False
     del_error = None
     if old_event_id:
-        ok, _msg = delete_event_calendar(old_event_id, calendar_id=cal_id)
+        ok, _msg = delete_replaced_event(old_event_id, calendar_id=cal_id)
         deleted = ok
         if not ok:
             del_error = _msg
@@ -771,6 +1591,50 @@ def reprogramar_cita():
         "eliminacion_anterior": {"hecho": deleted, "calendarId": cal_id, "eventId": old_event_id, "error": del_error}
     }), 200
 
+# =========================
+# Importación masiva de citas
+# =========================
+def import_appointments(path: str, workers: int = IMPORT_WORKERS, checkpoint_path: str | None = None) -> dict:
+    """
+    Importa citas desde un CSV (con encabezados) o JSONL, fila a fila. Columnas:
+    nombre, datetime_text o fecha+hora, telefono, email, comentario.
+    Las filas ya importadas quedan en `<archivo>.checkpoint` y se saltan al reanudar.
+    """
+    if CAL_MIRROR_ENABLED:
+        CAL_MIRROR.ensure_fresh()
+
+    def prepare(row, event_id):
+        return prepare_event(
+            nombre=(row.get("nombre") or "Cliente").strip(),
+            datetime_text=row.get("datetime_text"),
+            fecha=row.get("fecha"),
+            hora=row.get("hora"),
+            telefono=row.get("telefono"),
+            email=row.get("email"),
+            comentario=row.get("comentario"),
+            event_id=event_id,
+        )
+
+    def insert(body):
+        return gcal_execute(gc_service.events().insert(calendarId=CALENDAR_ID, body=body, sendUpdates="none"),
+                            retry=False)
+
+    def on_created(created, _prep):
+        if CAL_MIRROR_ENABLED:
+            CAL_MIRROR.apply(created)
+
+    def on_error(n, msg):
+        print(f"fila {n}: {msg}")
+
+    checkpoint = Checkpoint(checkpoint_path or path + ".checkpoint")
+    try:
+        stats = Importer(prepare, insert, on_created=on_created, workers=workers,
+                         on_error=on_error).run(iter_rows(path), checkpoint)
+    finally:
+        checkpoint.close()
+    AVAILABILITY.invalidate()
+    return stats
+
 # =========================
 # Chatbot con GPT 3.5 — Orquestación + Cancelación
 # =========================
@@ -793,12 +1657,109 @@ SYSTEM_PROMPT = (
     "- No inventes datos."
 )
 
-def llm_orchestrate(history, slots, awaiting_confirm, candidate, user_message):
+# =========================
+# Historial con presupuesto de tokens
+# =========================
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1200"))
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "6"))
+HISTORY_SUMMARY_MAX_CHARS = int(os.getenv("HISTORY_SUMMARY_MAX_CHARS", "600"))
+
+LLM_STATS = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+             "recent_prompt_tokens": deque(maxlen=50)}
+
+def _estimate_tokens(messages) -> int:
+    """Aproximación barata (~4 caracteres por token + overhead por mensaje)."""
+    return sum(len(m.get("content") or "") // 4 + 4 for m in messages)
+
+def _fold_summary(summary: str, old_turns) -> str:
+    """
+    Pliega vueltas antiguas en un resumen corto. Los datos duros ya viajan en
+    `slots` ("Estado actual"), así que basta con un rastro de lo que pidió el usuario.
+    """
+    said = [(m.get("content") or "").strip().replace("\n", " ")[:80]
+            for m in old_turns if m.get("role") == "user"]
+    said = [t for t in said if t]
+    if said:
+        summary = (summary + " | " if summary else "") + " | ".join(said)
+    if len(summary) > HISTORY_SUMMARY_MAX_CHARS:
+        summary = "…" + summary[-HISTORY_SUMMARY_MAX_CHARS:]
+    return summary
+
+def compact_history(session: dict):
+    """
+    Deja en session["history"] como máximo HISTORY_KEEP_TURNS vueltas literales
+    dentro de HISTORY_TOKEN_BUDGET; lo anterior se pliega en session["summary"].
+    Modifica la lista en el lugar (process_chat mantiene la referencia).
+    """
+    history = session["history"]
+    keep = HISTORY_KEEP_TURNS * 2
+    cut = max(0, len(history) - keep)
+    while cut < len(history) - 2 and _estimate_tokens(history[cut:]) > HISTORY_TOKEN_BUDGET:
+        cut += 2
+    if cut:
+        session["summary"] = _fold_summary(session.get("summary", ""), history[:cut])
+        del history[:cut]
+
+class ReplyStream:
+    """
+    Extrae de forma incremental el valor de "reply" del JSON que el modelo va
+    generando, y entrega cada trozo ya decodificado a on_delta.
+    """
+    _KEY_RE = re.compile(r'"reply"\s*:\s*"')
+    _ESC = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self, on_delta):
+        self.on_delta = on_delta
+        self.raw = ""
+        self.pos = None
+        self.done = False
+
+    def feed(self, chunk: str):
+        self.raw += chunk
+        if self.done:
+            return
+        if self.pos is None:
+            m = self._KEY_RE.search(self.raw)
+            if not m:
+                return
+            self.pos = m.end()
+        out, b, i = [], self.raw, self.pos
+        while i < len(b):
+            ch = b[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch == "\\":
+                if i + 1 >= len(b):
+                    break
+                esc = b[i + 1]
+                if esc == "u":
+                    if i + 6 > len(b):
+                        break
+                    try:
+                        out.append(chr(int(b[i + 2:i + 6], 16)))
+                    except ValueError:
+                        pass
+                    i += 6
+                    continue
+                out.append(self._ESC.get(esc, esc))
+                i += 2
+                continue
+            out.append(ch)
+            i += 1
+        self.pos = i
+        if out:
+            self.on_delta("".join(out))
+
+def _llm_messages(history, slots, awaiting_confirm, candidate, user_message, summary: str = ""):
     state = {"slots": slots, "awaiting_confirm": awaiting_confirm, "candidate": candidate or {}}
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "system", "content": f"Estado actual: {json.dumps(state, ensure_ascii=False)}"},
     ]
+    if summary:
+        messages.append({"role": "system", "content": f"Resumen de la conversación previa: {summary}"})
     messages += history
     messages.append({"role": "user", "content": user_message})
     messages.append({"role": "system", "content":
@@ -810,8 +1771,18 @@ def llm_orchestrate(history, slots, awaiting_confirm, candidate, user_message):
         "} "
         "No agregues texto fuera del JSON."
     })
-    resp = oa_client.chat.completions.create(model=OPENAI_MODEL, temperature=0.3, messages=messages)
-    raw = resp.choices[0].message.content or "{}"
+    return messages
+
+def _llm_result(raw: str, usage, messages) -> dict:
+    """Registra el consumo de tokens y normaliza el JSON devuelto por el modelo."""
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or _estimate_tokens(messages)
+    LLM_STATS["calls"] += 1
+    LLM_STATS["prompt_tokens"] += prompt_tokens
+    LLM_STATS["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+    LLM_STATS["recent_prompt_tokens"].append(prompt_tokens)
+    LLM_TOKENS.inc(prompt_tokens, kind="prompt")
+    LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, kind="completion")
+    tracing.annotate(prompt_tokens=prompt_tokens, completion_tokens=getattr(usage, "completion_tokens", None))
     try:
         data = json.loads(raw)
     except Exception:
@@ -827,18 +1798,248 @@ def llm_orchestrate(history, slots, awaiting_confirm, candidate, user_message):
                 data["candidate"][k] = v.strip()
     return data
 
-def process_chat(session_id: str, user_msg: str, telefono: str = "", email: str = "", comentario: str = ""):
-    session = _get_session(session_id)
-    history = session["history"]
+def llm_orchestrate(history, slots, awaiting_confirm, candidate, user_message, summary: str = "",
+                    on_delta=None):
+    """Un llamado al LLM. Con on_delta se usa streaming y se emite el texto de "reply" a medida que llega."""
+    messages = _llm_messages(history, slots, awaiting_confirm, candidate, user_message, summary)
+    with _llm_observed("stream" if on_delta else "sync"):
+        if on_delta:
+            raw, usage = _llm_stream(messages, ReplyStream(on_delta))
+        else:
+            resp = OPENAI_UPSTREAM.call(lambda: oa_client.chat.completions.create(
+                model=OPENAI_MODEL, temperature=0.3, messages=messages))
+            raw = resp.choices[0].message.content or "{}"
+            usage = getattr(resp, "usage", None)
+    return _llm_result(raw, usage, messages)
+
+def _llm_stream(messages, stream: ReplyStream):
+    # Solo se reintenta la apertura del stream; una vez que llegan trozos, no
+    resp = OPENAI_UPSTREAM.call(lambda: oa_client.chat.completions.create(
+        model=OPENAI_MODEL, temperature=0.3, messages=messages,
+        stream=True, stream_options={"include_usage": True}))
+    usage = None
+    for chunk in resp:
+        if getattr(chunk, "usage", None):
+            usage = chunk.usage
+        if chunk.choices:
+            stream.feed(chunk.choices[0].delta.content or "")
+    return stream.raw or "{}", usage
+
+async def allm_orchestrate(history, slots, awaiting_confirm, candidate, user_message, summary: str = "",
+                           on_delta=None):
+    """Igual que llm_orchestrate, con AsyncOpenAI: no ocupa un hilo mientras el modelo responde."""
+    messages = _llm_messages(history, slots, awaiting_confirm, candidate, user_message, summary)
+    with _llm_observed("async_stream" if on_delta else "async"):
+        if on_delta:
+            stream = ReplyStream(on_delta)
+            resp = await OPENAI_UPSTREAM.acall(lambda: aoa_client.chat.completions.create(
+                model=OPENAI_MODEL, temperature=0.3, messages=messages,
+                stream=True, stream_options={"include_usage": True}))
+            usage = None
+            async for chunk in resp:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if chunk.choices:
+                    stream.feed(chunk.choices[0].delta.content or "")
+            raw = stream.raw or "{}"
+        else:
+            resp = await OPENAI_UPSTREAM.acall(lambda: aoa_client.chat.completions.create(
+                model=OPENAI_MODEL, temperature=0.3, messages=messages))
+            raw = resp.choices[0].message.content or "{}"
+            usage = getattr(resp, "usage", None)
+    return _llm_result(raw, usage, messages)
+
+# =========================
+# Camino rápido sin LLM (extracción determinista de slots)
+# =========================
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+PHONE_RE = re.compile(r"\+?\d[\d\s().-]{6,16}\d(?![/:\d])")  # sin comerse una fecha/hora pegada
+ISO_DATE_RE = re.compile(r"\b\d{4}-\d{1,2}-\d{1,2}\b")
+DATE_HINT_RE = re.compile(
+    r"\d{1,2}[/-]\d{1,2}|\d{1,2}:\d{2}|\b(hoy|ma[ñn]ana|lunes|martes|mi[ée]rcoles|jueves|viernes|"
+    r"s[áa]bado|domingo|mediod[ií]a)\b|\ba\s*las\s*\d|\b\d{1,2}\s*(h|hs|hrs|horas)\b", re.I)
+
+FASTPATH_STATS = {"turns": 0, "llm_calls": 0, "llm_avoided": 0}
+
+# Palabras que pueden acompañar a un dato sin aportar otro ("mi correo es ...", "mi número: ...").
+# Si sobra cualquier otra (un nombre, una fecha que no se entendió) el turno va al LLM.
+FILLER_WORDS = {
+    "mi", "mis", "el", "la", "los", "las", "es", "son", "y", "e", "de", "del", "a", "al", "para", "por",
+    "favor", "porfa", "pf", "ok", "okay", "oka", "vale", "listo", "bueno", "hola", "gracias", "sería",
+    "seria", "correo", "mail", "email", "e-mail", "electrónico", "electronico", "teléfono", "telefono",
+    "fono", "celular", "cel", "número", "numero", "nro", "n°", "whatsapp", "wsp", "contacto", "aquí",
+    "aqui", "ahí", "ahi", "va", "te", "dejo", "este", "ese",
+}
+_FILLER_STRIP = " .,;:!?¡¿()[]\"'-"
+
+def _only_filler(words) -> bool:
+    return all(w.lower().strip(_FILLER_STRIP) in FILLER_WORDS or not w.strip(_FILLER_STRIP) for w in words)
+
+ASK_SLOT = {
+    "nombre": "¿Me indicas tu nombre, por favor?",
+    "datetime": "¿Qué día y hora te acomoda para la llamada? (ej: 12/08 13:00)",
+    "telefono": "¿A qué número de teléfono te llamamos?",
+    "email": "¿Cuál es tu correo electrónico? (lo usamos solo para respaldo de contacto)",
+}
+
+def extract_slots_fast(user_msg: str):
+    """
+    Email, teléfono y fecha/hora por regex/parser.
+    Devuelve (slots_detectados, palabras_sobrantes).
+    """
+    found = {}
+    rest = user_msg
+    m = EMAIL_RE.search(rest)
+    if m:
+        found["email"] = m.group(0)
+        rest = rest.replace(m.group(0), " ")
+    for m in PHONE_RE.finditer(rest):
+        digits = re.sub(r"\D", "", m.group(0))
+        if len(digits) >= 8 and not ISO_DATE_RE.search(m.group(0)):
+            found["telefono"] = ("+" if m.group(0).startswith("+") else "") + digits
+            rest = rest.replace(m.group(0), " ")
+            break
+    rest = rest.strip(" .,;!")
+    if rest and len(rest.split()) <= 8 and DATE_HINT_RE.search(rest):
+        if parse_datetime_es({"datetime_text": rest}):
+            found["datetime_text"] = rest
+            rest = ""
+    return found, rest.split()
+
+def _missing_slots(slots: dict, telefono: str = "", email: str = ""):
+    missing = []
+    if not slots.get("nombre"):
+        missing.append("nombre")
+    if not (slots.get("datetime_text") or (slots.get("fecha") and slots.get("hora"))):
+        missing.append("datetime")
+    if not (slots.get("telefono") or telefono):
+        missing.append("telefono")
+    if not (slots.get("email") or email):
+        missing.append("email")
+    return missing
+
+def _suggest_slots_text() -> str:
+    """' Próximos horarios disponibles: ...' o '' si no se puede consultar."""
+    try:
+        slots = AVAILABILITY.next_slots(limit=3)
+    except (HttpError, UpstreamUnavailable, UpstreamBusy):
+        return ""
+    if not slots:
+        return ""
+    return " Próximos horarios disponibles: " + ", ".join(s.strftime("%d/%m %H:%M") for s in slots) + "."
+
+def _plain_yes(user_msg: str) -> bool:
+    """Un "sí" sin matices: "sí", "ok, gracias". "si no puedo" o "sí, el martes" van al LLM."""
+    m = YES_RE.match(user_msg)
+    return bool(m) and not NO_RE.match(user_msg) and _only_filler(user_msg[m.end():].split())
+
+def fast_plan(session: dict, user_msg: str, found: dict, residual, telefono: str = "", email: str = ""):
+    """
+    Decide next_action sin LLM cuando no hay ambigüedad:
+    - "sí" con awaiting_confirm y un candidato completo -> create_event
+    - el mensaje solo trae datos faltantes -> ask_missing (siguiente dato) o confirm_time
+    Devuelve un plan con el mismo esquema que llm_orchestrate, o None.
+    """
+    slots = session["slots"]
+    cand = session.get("candidate") or {}
+
+    if session.get("awaiting_confirm"):
+        if (_plain_yes(user_msg) and not found and len(user_msg.split()) <= 3
+                and not _missing_slots(cand) and parse_datetime_es(cand)):
+            return {"reply": "", "slots": {}, "next_action": "create_event", "candidate": cand}
+        return None
+
+    # Solo si lo que sobra es relleno: "Juan Pérez 987654321" trae un nombre que la regex no ve
+    if not found or not _only_filler(residual):
+        return None
+
+    missing = _missing_slots(slots, telefono, email)
+    if missing:
+        return {"reply": ASK_SLOT[missing[0]], "slots": {}, "next_action": "ask_missing"}
+
+    start_dt = parse_datetime_es(slots)
+    if not start_dt:
+        return None
+    cand = ({"datetime_text": slots["datetime_text"]} if slots.get("datetime_text")
+            else {"fecha": slots.get("fecha"), "hora": slots.get("hora")})
+    reply = (f"Perfecto, {slots.get('nombre')}. ¿Confirmas la llamada para el "
+             f"{start_dt.strftime('%d-%m-%Y %H:%M')} (hora {TIMEZONE})? Responde “sí” para agendar.")
+    return {"reply": reply, "slots": {}, "next_action": "confirm_time", "candidate": cand}
+
+def process_chat(session_id: str, user_msg: str, telefono: str = "", email: str = "", comentario: str = "",
+                 on_delta=None):
+    """
+    Un turno de conversación; la sesión se lee y guarda de forma atómica.
+    on_delta(texto) recibe la respuesta del LLM en streaming, si se indica.
+    """
+    if PROFILER and PROFILER.wanted(session_id=session_id):
+        with PROFILER.profile("turn", "process_chat", session_id=session_id) as record:
+            tracing.annotate(profile_id=record["id"])
+            return _process_chat(session_id, user_msg, telefono, email, comentario, on_delta)
+    return _process_chat(session_id, user_msg, telefono, email, comentario, on_delta)
+
+def _process_chat(session_id: str, user_msg: str, telefono: str, email: str, comentario: str, on_delta):
+    with tracing.trace("chat.turn", session_id=session_id):
+        load = tracing.start("session.load")
+        with SESSION_STORE.transaction(session_id) as session:
+            if load:
+                load.end()
+            try:
+                return _process_chat_turn(session, user_msg, telefono, email, comentario, on_delta)
+            except UpstreamUnavailable as e:
+                # Se responde dentro de la transacción para que el store guarde lo ya extraído
+                return _calendar_down(e)
+
+def _calendar_down(e: UpstreamUnavailable) -> dict:
+    tracing.annotate(unavailable=e.name)
+    return {"reply": CALENDAR_DOWN_REPLY, "done": False}
+
+def _process_chat_turn(session: dict, user_msg: str, telefono: str = "", email: str = "", comentario: str = "",
+                       on_delta=None):
+    result, plan = _turn_pre(session, user_msg, telefono, email)
+    if result is not None:
+        return result
+    tracing.annotate(path="fastpath" if plan is not None else "llm")
+    if plan is None:
+        plan = llm_orchestrate(**_llm_args(session, user_msg), on_delta=on_delta)
+    result, after = _turn_post(session, plan, user_msg, telefono, email, comentario)
+    for fn in after:
+        _run_after(fn)
+    return result
+
+def _run_after(fn):
+    """Paso posterior al turno (borrar la cita reprogramada): best-effort, pero un error se registra."""
+    try:
+        fn()
+    except Exception as e:
+        TURN_AFTER_ERRORS.inc()
+        with tracing.trace("turn.after_error", force=True, error=repr(e)):
+            pass
+
+# Un turno tiene tres fases: previa (cancelación, camino rápido), LLM y posterior
+# (aplicar el plan). Las fases previa y posterior hacen I/O bloqueante corto
+# (Calendar, sesión); el LLM es la espera larga y en aprocess_chat no ocupa un hilo.
+def _llm_args(session: dict, user_msg: str) -> dict:
+    compact_history(session)
+    return {"history": session["history"], "slots": session["slots"],
+            "awaiting_confirm": session.get("awaiting_confirm", False),
+            "candidate": session.get("candidate"), "user_message": user_msg,
+            "summary": session.get("summary", "")}
+
+def _turn_pre(session: dict, user_msg: str, telefono: str = "", email: str = ""):
+    """
+    Fase previa al LLM. Devuelve (resultado, None) si el turno ya terminó,
+    (None, plan) si el camino rápido resolvió sin LLM, o (None, None) si hace falta el LLM.
+    """
     slots = session["slots"]
-    awaiting_confirm = session.get("awaiting_confirm", False)
 
     if not user_msg:
-        return {"reply": GREETING_TEXT, "done": False}
+        return {"reply": GREETING_TEXT, "done": False}, None
 
     # --- CANCELACIÓN: confirmación y ejecución (antes del LLM) ---
     cp = session.get("cancel_pending")
     if cp:
+        tracing.annotate(path="cancel_confirm")
         if YES_RE.search(user_msg):
             ok, msg_del = delete_event_calendar(cp["event_id"], calendar_id=cp.get("calendar_id"))
             session["cancel_pending"] = None
@@ -846,23 +2047,24 @@ def process_chat(session_id: str, user_msg: str, telefono: str = "", email: str
                 if session.get("last_event_id") == cp["event_id"]:
                     session["last_event_id"] = None
                 reply = f"Listo, cancelé tu cita del {cp['when']}."
-                return {"reply": reply, "done": False}
+                return {"reply": reply, "done": False}, None
             else:
-                return {"reply": f"No pude cancelar la cita ({cp['event_id']}). {msg_del}", "done": False}
+                return {"reply": f"No pude cancelar la cita ({cp['event_id']}). {msg_del}", "done": False}, None
         elif NO_RE.search(user_msg):
             session["cancel_pending"] = None
-            return {"reply": "Perfecto, dejamos la cita tal como está.", "done": False}
-        return {"reply": f"¿Confirmas que deseas cancelar la cita del {cp['when']}? Responde “sí cancelar” o “no”.", "done": False}
+            return {"reply": "Perfecto, dejamos la cita tal como está.", "done": False}, None
+        return {"reply": f"¿Confirmas que deseas cancelar la cita del {cp['when']}? Responde “sí cancelar” o “no”.", "done": False}, None
 
     if CANCEL_RE.search(user_msg):
+        tracing.annotate(path="cancel")
         # 1) última cita de la sesión
         last_id = session.get("last_event_id")
         if last_id:
             try:
-                ev = gc_service.events().get(calendarId=CALENDAR_ID, eventId=last_id).execute()
+                ev = gcal_execute(gc_service.events().get(calendarId=CALENDAR_ID, eventId=last_id))
                 when = human_dt((ev.get("start") or {}).get("dateTime", ""))
                 session["cancel_pending"] = {"event_id": last_id, "calendar_id": CALENDAR_ID, "when": when}
-                return {"reply": f"¿Confirmas que quieres cancelar la cita del {when}? Responde “sí cancelar” o “no”.", "done": False}
+                return {"reply": f"¿Confirmas que quieres cancelar la cita del {when}? Responde “sí cancelar” o “no”.", "done": False}, None
             except HttpError:
                 pass
 
@@ -879,12 +2081,12 @@ def process_chat(session_id: str, user_msg: str, telefono: str = "", email: str
             ev_id, cal_id = extract_event_and_cal_from_eid(eid)
             if ev_id:
                 try:
-                    ev = gc_service.events().get(calendarId=(cal_id or CALENDAR_ID), eventId=ev_id).execute()
+                    ev = gcal_execute(gc_service.events().get(calendarId=(cal_id or CALENDAR_ID), eventId=ev_id))
                     when = human_dt((ev.get("start") or {}).get("dateTime", ""))
                     session["cancel_pending"] = {"event_id": ev_id, "calendar_id": cal_id or CALENDAR_ID, "when": when}
-                    return {"reply": f"¿Confirmas cancelar la cita del {when}? Responde “sí cancelar” o “no”.", "done": False}
+                    return {"reply": f"¿Confirmas cancelar la cita del {when}? Responde “sí cancelar” o “no”.", "done": False}, None
                 except HttpError:
-                    return {"reply": "No pude localizar esa cita con el enlace. ¿Puedes darme la fecha y hora exactas (ej: 12/08 13:00)?", "done": False}
+                    return {"reply": "No pude localizar esa cita con el enlace. ¿Puedes darme la fecha y hora exactas (ej: 12/08 13:00)?", "done": False}, None
 
         # 3) fecha/hora “cancela la del 12/08 13:00”
         dt = parse_datetime_es({"datetime_text": user_msg})
@@ -893,16 +2095,33 @@ def process_chat(session_id: str, user_msg: str, telefono: str = "", email: str
             if ev_id:
                 when = human_dt((ev.get("start") or {}).get("dateTime", ""))
                 session["cancel_pending"] = {"event_id": ev_id, "calendar_id": CALENDAR_ID, "when": when}
-                return {"reply": f"Voy a cancelar la cita del {when}. ¿Lo confirmas? (responde “sí cancelar” o “no”)", "done": False}
+                return {"reply": f"Voy a cancelar la cita del {when}. ¿Lo confirmas? (responde “sí cancelar” o “no”)", "done": False}, None
             else:
-                return {"reply": "No encontré una cita en ese horario. ¿Puedes confirmar fecha y hora exactas (ej: 12/08 13:00) o pegar el link del evento?", "done": False}
+                return {"reply": "No encontré una cita en ese horario. ¿Puedes confirmar fecha y hora exactas (ej: 12/08 13:00) o pegar el link del evento?", "done": False}, None
 
         # 4) pedir datos
-        return {"reply": "Para cancelar, indícame la fecha y hora de la cita (ej: 12/08 13:00) o pégame el link del evento.", "done": False}
+        return {"reply": "Para cancelar, indícame la fecha y hora de la cita (ej: 12/08 13:00) o pégame el link del evento.", "done": False}, None
+
+    # --- Camino rápido (sin LLM) ---
+    found, residual = extract_slots_fast(user_msg)
+    for k, v in found.items():
+        slots[k] = v
+    FASTPATH_STATS["turns"] += 1
+    plan = fast_plan(session, user_msg, found, residual, telefono, email)
+    if plan is not None:
+        FASTPATH_STATS["llm_avoided"] += 1
+    else:
+        FASTPATH_STATS["llm_calls"] += 1
+    return None, plan
 
-    # --- Orquestación normal con LLM ---
-    candidate = session.get("candidate")
-    plan = llm_orchestrate(history, slots, awaiting_confirm, candidate, user_msg)
+def _turn_post(session: dict, plan: dict, user_msg: str, telefono: str = "", email: str = "", comentario: str = ""):
+    """
+    Aplica el plan (del camino rápido o del LLM) a la sesión.
+    Devuelve (resultado, pendientes): `pendientes` son llamadas que no cambian la
+    respuesta (ej. borrar la cita anterior) y pueden correr después o en paralelo.
+    """
+    history = session["history"]
+    slots = session["slots"]
 
     # fusionar slots con lo detectado ahora
     new_slots = plan.get("slots", {})
@@ -912,6 +2131,9 @@ def process_chat(session_id: str, user_msg: str, telefono: str = "", email: str
 
     action = plan.get("next_action", "none")
     reply  = plan.get("reply") or GREETING_TEXT
+
+    if action == "ask_missing" and AVAIL_SUGGEST and "datetime" in _missing_slots(slots, telefono, email):
+        reply += _suggest_slots_text()
     cand   = plan.get("candidate") or {}
 
     if action == "confirm_time":
@@ -927,7 +2149,7 @@ def process_chat(session_id: str, user_msg: str, telefono: str = "", email: str
         }
         session["candidate"] = cand_payload
         history += [{"role":"user","content":user_msg},{"role":"assistant","content":reply}]
-        return {"reply": reply, "done": False}
+        return {"reply": reply, "done": False}, []
 
     if action == "create_event":
         cand_or_slots = {
@@ -951,37 +2173,206 @@ def process_chat(session_id: str, user_msg: str, telefono: str = "", email: str
         session["candidate"] = None
         if not created:
             history += [{"role":"user","content":user_msg},{"role":"assistant","content":msg}]
-            return {"reply": msg, "done": False}
+            return {"reply": msg, "done": False}, []
 
-        # auto-borrar último evento de la sesión (reprogramación)
+        # auto-borrar último evento de la sesión (reprogramación); no cambia la respuesta
+        after = []
         last_event_id = session.get("last_event_id")
         if last_event_id:
-            try:
-                gc_service.events().delete(calendarId=CALENDAR_ID, eventId=last_event_id, sendUpdates="none").execute()
-            except HttpError:
-                pass
+            after.append(lambda: delete_replaced_event(last_event_id))
         session["last_event_id"] = created.get("id")
 
         # limpiar slots para próxima cita
         session["slots"] = {"nombre":"", "datetime_text":"", "fecha":"", "hora":"", "telefono":"", "email":""}
         history += [{"role":"user","content":user_msg},{"role":"assistant","content":msg}]
-        return {"reply": msg, "done": True, "evento": created}
+        return {"reply": msg, "done": True, "evento": created}, after
 
     history += [{"role":"user","content":user_msg},{"role":"assistant","content":reply}]
-    return {"reply": reply, "done": False}
+    return {"reply": reply, "done": False}, []
+
+# =========================
+# Turno async (asgi.py)
+# =========================
+# Los hilos se crean en el primer submit, no al importar (seguro con --preload)
+ASYNC_IO_POOL = ThreadPoolExecutor(max_workers=ASYNC_IO_THREADS, thread_name_prefix="async-io")
+_ASYNC_LOCKS = {}
+_ASYNC_BACKGROUND = set()
+
+async def in_io_thread(fn, *args, **kwargs):
+    # Con el contexto actual: los spans del hilo cuelgan de la traza de la corrutina
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(ASYNC_IO_POOL, functools.partial(ctx.run, fn, *args, **kwargs))
+
+@asynccontextmanager
+async def _async_session_lock(session_id: str):
+    """asyncio.Lock por sesión, con conteo de usuarios para no acumular locks."""
+    entry = _ASYNC_LOCKS.get(session_id)
+    if entry is None:
+        entry = _ASYNC_LOCKS[session_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            _ASYNC_LOCKS.pop(session_id, None)
+
+def run_in_background(coro):
+    """Lanza una corrutina sin esperarla (guardando la referencia hasta que termine)."""
+    task = asyncio.ensure_future(coro)
+    _ASYNC_BACKGROUND.add(task)
+    task.add_done_callback(_ASYNC_BACKGROUND.discard)
+    return task
+
+async def aprocess_chat(session_id: str, user_msg: str, telefono: str = "", email: str = "", comentario: str = "",
+                        on_delta=None):
+    """
+    Versión async de process_chat. Las fases previa y posterior (sesión, Calendar)
+    corren en ASYNC_IO_POOL, cada una en su propia transacción de sesión; el LLM
+    va por AsyncOpenAI sin ocupar hilos. Los turnos de una misma sesión se
+    serializan con un asyncio.Lock, así que un proceso atiende muchas
+    conversaciones a la vez con pocos hilos.
+    """
+    with tracing.trace("chat.turn", session_id=session_id):
+        return await _aprocess_chat_turn(session_id, user_msg, telefono, email, comentario, on_delta)
+
+async def _aprocess_chat_turn(session_id: str, user_msg: str, telefono: str, email: str, comentario: str,
+                              on_delta):
+    async with _async_session_lock(session_id), _store_session_lock(session_id):
+        # El lock del store (entre procesos con SQLite) cubre pre, LLM y post: otro
+        # worker no puede escribir la sesión entre la lectura y la escritura
+        session = None
+
+        def pre():
+            nonlocal session
+            session = SESSION_STORE.get(session_id)
+            try:
+                result, plan = _turn_pre(session, user_msg, telefono, email)
+            except UpstreamUnavailable as e:
+                result, plan = _calendar_down(e), None
+            SESSION_STORE.put(session_id, session)
+            if result is None and plan is None:
+                tracing.annotate(path="llm")
+                return None, None, json.loads(json.dumps(_llm_args(session, user_msg)))
+            if result is None:
+                tracing.annotate(path="fastpath")
+            return result, plan, None
+
+        def post(plan):
+            try:
+                out = _turn_post(session, plan, user_msg, telefono, email, comentario)
+            except UpstreamUnavailable as e:
+                out = _calendar_down(e), []
+            SESSION_STORE.put(session_id, session)
+            return out
+
+        result, plan, llm_args = await in_io_thread(pre)
+        if result is None:
+            if plan is None:
+                plan = await allm_orchestrate(**llm_args, on_delta=on_delta)
+            result, after = await in_io_thread(post, plan)
+            # Lo que no cambia la respuesta (borrar la cita anterior) corre en paralelo
+            for fn in after:
+                run_in_background(in_io_thread(_run_after, fn))
+    return result
+
+@asynccontextmanager
+async def _store_session_lock(session_id: str):
+    """SESSION_STORE.acquire en un hilo (puede esperar a otro proceso) durante todo el bloque."""
+    acquiring = asyncio.ensure_future(in_io_thread(SESSION_STORE.acquire, session_id))
+    try:
+        await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        # El hilo termina de tomarlo igual: se suelta apenas lo tenga
+        acquiring.add_done_callback(lambda f: _release_acquired(f, session_id))
+        raise
+    try:
+        yield
+    finally:
+        SESSION_STORE.release(session_id)
+
+def _release_acquired(future, session_id: str):
+    if not future.cancelled() and future.exception() is None:
+        SESSION_STORE.release(session_id)
+
+def busy_response(retry_after: float = 1.0):
+    """503 con Retry-After: sin cupo local (admisión o límite de tasa de un upstream)."""
+    resp = jsonify({"ok": False, "busy": True, "reply": BUSY_REPLY})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return resp
+
+@app.errorhandler(UpstreamBusy)
+def upstream_busy(e):
+    return busy_response(e.retry_after)
+
+@app.errorhandler(UpstreamUnavailable)
+def upstream_unavailable(e):
+    resp = jsonify({"ok": False, "error": f"Servicio externo no disponible ({e.name}). Intenta nuevamente."})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+    return resp
 
 @app.post("/chatbot")
 def chatbot():
-    data = request.get_json(silent=True) or {}
-    res = process_chat(
-        session_id=(data.get("session_id") or "default"),
-        user_msg=(data.get("message") or "").strip(),
-        telefono=(data.get("telefono") or "").strip(),
-        email=(data.get("email") or "").strip(),
-        comentario=(data.get("comentario") or "").strip(),
-    )
+    if not CHAT_ADMISSION.try_enter():
+        return busy_response()
+    try:
+        data = request.get_json(silent=True) or {}
+        res = process_chat(
+            session_id=(data.get("session_id") or "default"),
+            user_msg=(data.get("message") or "").strip(),
+            telefono=(data.get("telefono") or "").strip(),
+            email=(data.get("email") or "").strip(),
+            comentario=(data.get("comentario") or "").strip(),
+        )
+    finally:
+        CHAT_ADMISSION.leave()
     return jsonify(res)
 
+@app.post("/chatbot/stream")
+def chatbot_stream():
+    """
+    Igual que /chatbot, pero responde por Server-Sent Events:
+    `delta` con cada trozo de texto del LLM y `done` con el resultado completo.
+    """
+    if not CHAT_ADMISSION.try_enter():
+        return busy_response()
+    data = request.get_json(silent=True) or {}
+    events = queue.SimpleQueue()
+
+    @copy_current_request_context
+    def run():
+        try:
+            res = process_chat(
+                session_id=(data.get("session_id") or "default"),
+                user_msg=(data.get("message") or "").strip(),
+                telefono=(data.get("telefono") or "").strip(),
+                email=(data.get("email") or "").strip(),
+                comentario=(data.get("comentario") or "").strip(),
+                on_delta=lambda t: events.put(("delta", {"text": t})),
+            )
+            events.put(("done", res))
+        except UpstreamBusy:
+            events.put(("error", {"error": BUSY_REPLY, "busy": True}))
+        except Exception:
+            events.put(("error", {"error": "No pude procesarlo ahora. Intenta nuevamente."}))
+        finally:
+            CHAT_ADMISSION.leave()
+
+    threading.Thread(target=run, daemon=True).start()
+
+    def stream():
+        while True:
+            kind, payload = events.get()
+            yield f"event: {kind}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+            if kind != "delta":
+                break
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # =========================
 # WhatsApp Cloud API (de-dup + phone_id dinámico + .ics/link)
 # =========================
@@ -994,88 +2385,174 @@ def wa_verify():
         return challenge, 200
     return "forbidden", 403
 
+WA_SENDER = WhatsAppSender(WA_TOKEN, workers=WA_SEND_WORKERS, pool_size=WA_HTTP_POOL,
+                           timeout=WA_SEND_TIMEOUT, max_queue=WA_QUEUE_MAX, debug=DEBUG_WA,
+                           upstream=GRAPH_UPSTREAM, on_send=_wa_send_observed)
+
+def _wa_text(msg: dict) -> str:
+    if msg.get("type") == "text":
+        return (msg.get("text", {}) or {}).get("body", "")
+    return ""
+
+def wa_reply_bodies(from_id: str, res: dict) -> list:
+    """Mensajes de salida para el resultado de un turno."""
+    # 1) Mensaje de texto
+    bodies = [{"messaging_product": "whatsapp", "to": from_id, "text": {"body": res.get("reply") or "..."}}]
+
+    # 2) Si se creó la cita, enviar .ics y link “Añadir a Google Calendar”
+    if res.get("done") and res.get("evento"):
+        ev = res["evento"]
+        if ev.get("icsUrl"):
+            bodies.append({
+              "messaging_product": "whatsapp",
+              "to": from_id,
+              "type": "document",
+              "document": {"link": ev["icsUrl"], "filename": "cita.ics"}
+            })
+        if ev.get("gcalAddUrl"):
+            bodies.append({
+              "messaging_product": "whatsapp",
+              "to": from_id,
+              "text": {"body": f"Para agregarla en tu Google Calendar: {ev['gcalAddUrl']}"}
+            })
+    return bodies
+
+def _wa_batch_text(items) -> tuple:
+    """[(phone_id, msg), ...] -> (phone_id del último, textos unidos en un solo mensaje)."""
+    texts = [t for t in (_wa_text(msg).strip() for _pid, msg in items) if t]
+    return items[-1][0], "\n".join(texts)
+
+def _wa_turn_trace(from_id: str, items: list):
+    """Traza del turno, muestreada con el primer wamid (la misma decisión que en el webhook)."""
+    wamids = [msg.get("id") or msg.get("wamid") for _pid, msg in items]
+    return tracing.trace("wa.turn", sample_key=wamids[0], from_id=from_id, wamids=wamids, messages=len(items))
+
+def wa_handle_batch(from_id: str, items: list):
+    """Un turno completo para uno o más mensajes seguidos: process_chat + respuestas por Graph API."""
+    with _wa_turn_trace(from_id, items):
+        phone_id, text = _wa_batch_text(items)
+        try:
+            res = process_chat(session_id=from_id, user_msg=text, telefono=from_id)
+        except UpstreamBusy:
+            tracing.annotate(busy=True)
+            res = {"reply": BUSY_REPLY}
+        # Salen en orden para este destinatario, sin bloquear el turno
+        WA_SENDER.send_all(phone_id, from_id, wa_reply_bodies(from_id, res))
+
+def wa_handle_message(from_id: str, phone_id: str, msg: dict):
+    wa_handle_batch(from_id, [(phone_id, msg)])
+
+async def awa_handle_batch(from_id: str, items: list):
+    """wa_handle_batch para asgi.py (aprocess_chat; el envío va a un hilo)."""
+    try:
+        with _wa_turn_trace(from_id, items):
+            phone_id, text = _wa_batch_text(items)
+            try:
+                res = await aprocess_chat(session_id=from_id, user_msg=text, telefono=from_id)
+            except UpstreamBusy:
+                tracing.annotate(busy=True)
+                res = {"reply": BUSY_REPLY}
+            await in_io_thread(WA_SENDER.send_all, phone_id, from_id, wa_reply_bodies(from_id, res))
+    except Exception as e:
+        _wa_job_error(from_id, e)
+
+def wa_extract(payload: dict):
+    """(phone_id, messages, statuses) del primer cambio de un webhook de WhatsApp."""
+    entry = (payload.get("entry") or [])[0]
+    changes = (entry.get("changes") or [])[0]
+    value = changes.get("value", {})
+    phone_id = (value.get("metadata") or {}).get("phone_number_id") or WA_PHONE_ID
+    return phone_id, value.get("messages", []), value.get("statuses", [])
+
+def _wa_job_error(from_id, e):
+    # Los errores se registran siempre, no solo en la muestra
+    with tracing.trace("wa.error", force=True, from_id=from_id, error=repr(e)):
+        pass
+
+# Buzón por remitente + un hilo por shard: los turnos de un remitente van en orden
+# y los mensajes que llegan en ráfaga se responden en un solo turno
+WA_MAILBOX = CoalescingMailbox(wa_handle_batch, window_ms=WA_COALESCE_MS, max_ms=WA_COALESCE_MAX_MS,
+                               workers=WA_WORKERS, max_queue=WA_QUEUE_MAX, on_error=_wa_job_error)
+
 @app.post("/whatsapp/webhook")
 def wa_incoming():
     if not WA_TOKEN:
         return "whatsapp not configured", 200
 
     payload = request.get_json(silent=True) or {}
-    if DEBUG_WA:
-        print("WA IN >>>", json.dumps(payload, ensure_ascii=False))
-
     try:
-        entry = (payload.get("entry") or [])[0]
-        changes = (entry.get("changes") or [])[0]
-        value = changes.get("value", {})
+        phone_id, messages, statuses = wa_extract(payload)
+    except Exception as e:
+        _wa_job_error(None, e)
+        return "ok", 200
 
-        phone_id = (value.get("metadata") or {}).get("phone_number_id") or WA_PHONE_ID
-        messages = value.get("messages", [])
-        statuses = value.get("statuses", [])
+    wamids = [m.get("id") or m.get("wamid") for m in messages]
+    with tracing.trace("wa.webhook", sample_key=(wamids[0] if wamids else None), phone_id=phone_id,
+                       wamids=wamids, statuses=len(statuses)):
+        if DEBUG_WA:
+            tracing.annotate(payload=payload)
+        return _wa_incoming(phone_id, messages)
 
+def _wa_incoming(phone_id: str, messages: list):
+    try:
         if not messages:
-            if DEBUG_WA and statuses:
-                print("WA STATUS >>>", json.dumps(statuses, ensure_ascii=False))
             return "ok", 200
 
+        if WA_ASYNC:
+            _public_base_url()  # recordar la URL pública para los links .ics del worker
+
         for msg in messages:
             message_id = msg.get("id") or msg.get("wamid")
-            if wa_is_dup(message_id):
-                if DEBUG_WA:
-                    print("WA DUP >>>", message_id)
+            with tracing.span("dedup", wamid=message_id) as sp:
+                dup = wa_is_dup(message_id)
+                if sp:
+                    sp.set(dup=dup)
+            if dup:
                 continue
 
             from_id = msg.get("from")
-            text = ""
-            if msg.get("type") == "text":
-                text = (msg.get("text", {}) or {}).get("body", "")
-
-            res = process_chat(session_id=from_id, user_msg=text, telefono=from_id)
+            if not WA_ASYNC:
+                if not CHAT_ADMISSION.try_enter():
+                    wa_forget(message_id)
+                    tracing.annotate(busy=message_id)
+                    return "busy", 503
+                try:
+                    wa_handle_message(from_id, phone_id, msg)
+                finally:
+                    CHAT_ADMISSION.leave()
+                continue
 
-            url = f"https://graph.facebook.com/v20.0/{phone_id}/messages"
-            headers = {"Authorization": f"Bearer {WA_TOKEN}", "Content-Type": "application/json"}
-
-            # 1) Mensaje de texto
-            body = {"messaging_product": "whatsapp", "to": from_id, "text": {"body": res.get("reply") or "..."}}
-            r = requests.post(url, headers=headers, json=body, timeout=30)
-            if DEBUG_WA:
-                print("WA OUT <<<", r.status_code, r.text)
-
-            # 2) Si se creó la cita, enviar .ics y link “Añadir a Google Calendar”
-            if res.get("done") and res.get("evento"):
-                ev = res["evento"]
-                if ev.get("icsUrl"):
-                    body_doc = {
-                      "messaging_product": "whatsapp",
-                      "to": from_id,
-                      "type": "document",
-                      "document": {"link": ev["icsUrl"], "filename": "cita.ics"}
-                    }
-                    rd = requests.post(url, headers=headers, json=body_doc, timeout=30)
-                    if DEBUG_WA:
-                        print("WA OUT DOC <<<", rd.status_code, rd.text)
-                if ev.get("gcalAddUrl"):
-                    body_link = {
-                      "messaging_product": "whatsapp",
-                      "to": from_id,
-                      "text": {"body": f"Para agregarla en tu Google Calendar: {ev['gcalAddUrl']}"}
-                    }
-                    rl = requests.post(url, headers=headers, json=body_link, timeout=30)
-                    if DEBUG_WA:
-                        print("WA OUT LINK <<<", rl.status_code, rl.text)
+            if not WA_MAILBOX.submit(from_id, (phone_id, msg)):
+                # Cola llena: no lo marcamos como procesado y Meta lo reintentará
+                wa_forget(message_id)
+                tracing.annotate(busy=message_id)
+                return "busy", 503
 
         return "ok", 200
     except Exception as e:
-        if DEBUG_WA:
-            print("WA ERROR !!!", repr(e))
+        _wa_job_error(None, e)
         return "ok", 200
 
 # =========================
 # Main dev
 # =========================
+STARTUP.booted()
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--runserver", action="store_true")
+    parser.add_argument("--import", dest="import_file", metavar="ARCHIVO",
+                        help="importa citas desde un CSV o JSONL (reanuda con ARCHIVO.checkpoint)")
+    parser.add_argument("--import-workers", type=int, default=IMPORT_WORKERS)
+    parser.add_argument("--calendar-watch", action="store_true",
+                        help="registra el canal events.watch hacia PUBLIC_BASE_URL/calendar/notify")
     args = parser.parse_args()
+    if args.import_file:
+        print(json.dumps(import_appointments(args.import_file, workers=args.import_workers), indent=2))
+    if args.calendar_watch:
+        if not PUBLIC_BASE_URL:
+            raise SystemExit("Falta PUBLIC_BASE_URL para registrar el canal.")
+        print(json.dumps(CAL_MIRROR.watch(f"{PUBLIC_BASE_URL}/calendar/notify", CAL_WATCH_TOKEN), indent=2))
     if args.runserver:
         app.run(host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
@@ -0,0 +1,166 @@
+"""
+Entrada ASGI. /chatbot y el webhook de WhatsApp se atienden de forma nativa
+con aprocess_chat (el LLM no ocupa un hilo mientras responde); el resto de la
+app Flask pasa por WsgiToAsgi.
+
+    uvicorn asgi:application --host 0.0.0.0 --port $PORT
+"""
+import json
+import math
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as agendador
+import tracing
+from wa_worker import AsyncMailbox
+
+flask_asgi = WsgiToAsgi(agendador.app)
+
+# Mensajes en ráfaga de un mismo remitente -> un turno (WA_COALESCE_MS)
+WA_MAILBOX = AsyncMailbox(agendador.awa_handle_batch, window_ms=agendador.WA_COALESCE_MS,
+                          max_ms=agendador.WA_COALESCE_MAX_MS, spawn=agendador.run_in_background)
+
+
+async def _read_json(receive) -> dict:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def _respond(send, status: int, body, content_type: str = "application/json", headers=()):
+    if not isinstance(body, (bytes, str)):
+        body = json.dumps(body, ensure_ascii=False)
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type.encode("latin-1")),
+                            (b"content-length", str(len(body)).encode("latin-1")), *headers]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _busy(send, retry_after: float = 1.0):
+    await _respond(send, 503, {"ok": False, "busy": True, "reply": agendador.BUSY_REPLY},
+                   headers=[(b"retry-after", str(max(1, math.ceil(retry_after))).encode("latin-1"))])
+
+
+def _base_url(scope) -> str:
+    headers = dict(scope.get("headers") or [])
+    host = headers.get(b"x-forwarded-host") or headers.get(b"host") or b""
+    scheme = headers.get(b"x-forwarded-proto") or scope.get("scheme", "http").encode("latin-1")
+    return f"{scheme.decode('latin-1')}://{host.decode('latin-1')}" if host else ""
+
+
+async def chatbot(scope, receive, send):
+    data = await _read_json(receive)
+    admission = agendador.ASYNC_CHAT_ADMISSION
+    if not admission.try_enter():
+        return await _busy(send)
+    agendador.remember_base_url(_base_url(scope))
+    try:
+        res = await agendador.aprocess_chat(
+            session_id=(data.get("session_id") or "default"),
+            user_msg=(data.get("message") or "").strip(),
+            telefono=(data.get("telefono") or "").strip(),
+            email=(data.get("email") or "").strip(),
+            comentario=(data.get("comentario") or "").strip(),
+        )
+    except agendador.UpstreamBusy as e:
+        return await _busy(send, e.retry_after)
+    finally:
+        admission.leave()
+    await _respond(send, 200, res)
+
+
+async def wa_incoming(scope, receive, send):
+    if not agendador.WA_TOKEN:
+        return await _respond(send, 200, "whatsapp not configured", "text/plain")
+    payload = await _read_json(receive)
+    try:
+        phone_id, messages, statuses = agendador.wa_extract(payload)
+    except Exception as e:
+        agendador._wa_job_error(None, e)
+        return await _respond(send, 200, "ok", "text/plain")
+
+    wamids = [m.get("id") or m.get("wamid") for m in messages]
+    with tracing.trace("wa.webhook", sample_key=(wamids[0] if wamids else None), phone_id=phone_id,
+                       wamids=wamids, statuses=len(statuses)):
+        if agendador.DEBUG_WA:
+            tracing.annotate(payload=payload)
+        if not messages:
+            return await _respond(send, 200, "ok", "text/plain")
+
+        agendador.remember_base_url(_base_url(scope))
+        for msg in messages:
+            message_id = msg.get("id") or msg.get("wamid")
+            with tracing.span("dedup", wamid=message_id) as sp:
+                dup = await agendador.in_io_thread(agendador.wa_is_dup, message_id)
+                if sp:
+                    sp.set(dup=dup)
+            if dup:
+                continue
+            # Mensajes en buzones o en turnos en curso (una tarea por buzón: no se suman aparte)
+            if len(WA_MAILBOX) >= agendador.WA_QUEUE_MAX:
+                # Saturado: no lo marcamos como procesado y Meta lo reintentará
+                agendador.wa_forget(message_id)
+                tracing.annotate(busy=message_id)
+                return await _respond(send, 503, "busy", "text/plain")
+            # Se responde a Meta de inmediato; el turno sigue en el loop al cerrar el buzón
+            WA_MAILBOX.submit(msg.get("from"), (phone_id, msg))
+        await _respond(send, 200, "ok", "text/plain")
+
+
+async def _observed(handler, scope, receive, send):
+    """Las mismas métricas HTTP que los hooks de Flask, para las rutas nativas."""
+    status = 500
+
+    async def send_observed(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        await send(message)
+
+    agendador.METRICS.start()
+    agendador.HTTP_INFLIGHT.inc()
+    t0 = time.perf_counter()
+    try:
+        await handler(scope, receive, send_observed)
+    finally:
+        agendador.HTTP_INFLIGHT.dec()
+        agendador.observe_request(scope["path"], scope["method"], status, time.perf_counter() - t0)
+
+
+ROUTES = {
+    ("POST", "/chatbot"): chatbot,
+    ("POST", "/whatsapp/webhook"): wa_incoming,
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] == "http":
+        handler = ROUTES.get((scope["method"], scope["path"]))
+        if handler:
+            if agendador.LAZY_INIT:
+                agendador.WARMUP.start()
+            return await _observed(handler, scope, receive, send)
+    await flask_asgi(scope, receive, send)
@@ -0,0 +1,138 @@
+import threading
+import time
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+# Un día = 48 celdas de 30 minutos; cada día es un entero de 48 bits (bit i = celda i).
+# Horario hábil, ocupado y márgenes se combinan con operaciones de bits sobre el día entero.
+CELL_MIN = 30
+CELLS = 24 * 60 // CELL_MIN
+FULL_DAY = (1 << CELLS) - 1
+
+
+def range_mask(first: int, last: int) -> int:
+    """Celdas [first, last)."""
+    first, last = max(0, first), min(CELLS, last)
+    return ((1 << (last - first)) - 1) << first if last > first else 0
+
+
+def minutes_mask(start_min: int, end_min: int) -> int:
+    """Celdas que toca el intervalo [start_min, end_min) en minutos desde medianoche."""
+    return range_mask(start_min // CELL_MIN, -(-end_min // CELL_MIN))
+
+
+def dilate(mask: int, cells: int) -> int:
+    """Extiende cada celda ocupada `cells` celdas hacia ambos lados (margen entre llamadas)."""
+    out = mask
+    for i in range(1, cells + 1):
+        out |= (mask << i) | (mask >> i)
+    return out & FULL_DAY
+
+
+def iter_cells(mask: int):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _hhmm(txt: str) -> int:
+    h, m = txt.strip().split(":")
+    return int(h) * 60 + int(m)
+
+
+class Availability:
+    """
+    Horarios libres de 30 minutos a partir de freebusy.query, cacheado por día.
+    `query_busy(time_min, time_max, calendar_ids)` devuelve la respuesta de freebusy.
+    Un horario se ofrece solo si está libre en todos los calendarios indicados.
+    """
+
+    def __init__(self, query_busy, calendar_ids, timezone: str, hours: str = "09:00-18:00",
+                 days: str = "0,1,2,3,4", buffer_min: int = 0, min_notice_min: int = 60,
+                 ttl_sec: float = 60):
+        self.query_busy = query_busy
+        self.calendar_ids = list(calendar_ids)
+        self.tz = ZoneInfo(timezone)
+        start, end = hours.split("-")
+        self.hours_mask = minutes_mask(_hhmm(start), _hhmm(end))
+        self.days = {int(d) for d in days.split(",") if d.strip()}
+        self.buffer_cells = -(-int(buffer_min) // CELL_MIN)
+        self.min_notice = timedelta(minutes=int(min_notice_min))
+        self.ttl = ttl_sec
+        self._lock = threading.Lock()
+        self._busy = {}  # {date: (fetched_at, mask)}
+        self.queries = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._busy.clear()
+
+    def _day_start(self, d: date) -> datetime:
+        return datetime(d.year, d.month, d.day, tzinfo=self.tz)
+
+    def _busy_masks(self, d0: date, d1: date) -> dict:
+        """{fecha: máscara ocupada} para [d0, d1]; una sola consulta para los días vencidos."""
+        now = time.time()
+        n = (d1 - d0).days + 1
+        wanted = [d0 + timedelta(days=i) for i in range(n)]
+        with self._lock:
+            stale = [d for d in wanted if d not in self._busy or now - self._busy[d][0] > self.ttl]
+        if stale:
+            lo, hi = stale[0], stale[-1]
+            resp = self.query_busy(self._day_start(lo).isoformat(),
+                                   self._day_start(hi + timedelta(days=1)).isoformat(),
+                                   self.calendar_ids)
+            self.queries += 1
+            masks = {lo + timedelta(days=i): 0 for i in range((hi - lo).days + 1)}
+            for cal in (resp.get("calendars") or {}).values():
+                for b in cal.get("busy") or []:
+                    self._add_busy(masks, b["start"], b["end"])
+            with self._lock:
+                for d, m in masks.items():
+                    self._busy[d] = (now, m)
+        with self._lock:
+            return {d: self._busy[d][1] for d in wanted}
+
+    def _add_busy(self, masks: dict, start_iso: str, end_iso: str):
+        s = datetime.fromisoformat(start_iso.replace("Z", "+00:00")).astimezone(self.tz)
+        e = datetime.fromisoformat(end_iso.replace("Z", "+00:00")).astimezone(self.tz)
+        d = s.date()
+        while d <= e.date():
+            if d in masks:
+                first = s.hour * 60 + s.minute if d == s.date() else 0
+                last = e.hour * 60 + e.minute if d == e.date() else 24 * 60
+                masks[d] |= minutes_mask(first, last)
+            d += timedelta(days=1)
+
+    def free_masks(self, d0: date, d1: date, now: datetime | None = None) -> dict:
+        now = (now or datetime.now(self.tz)).astimezone(self.tz)
+        earliest = now + self.min_notice
+        busy = self._busy_masks(d0, d1)
+        out = {}
+        for d, b in busy.items():
+            if d.weekday() not in self.days or d < earliest.date():
+                out[d] = 0
+                continue
+            free = self.hours_mask & ~dilate(b, self.buffer_cells)
+            if d == earliest.date():
+                free &= ~minutes_mask(0, earliest.hour * 60 + earliest.minute)
+            out[d] = free
+        return out
+
+    def free_slots(self, d0: date, d1: date, now: datetime | None = None) -> list:
+        """[(fecha, [datetime de inicio, ...]), ...] con los horarios libres."""
+        out = []
+        for d, mask in sorted(self.free_masks(d0, d1, now).items()):
+            start = self._day_start(d)
+            out.append((d, [start + timedelta(minutes=i * CELL_MIN) for i in iter_cells(mask)]))
+        return out
+
+    def next_slots(self, limit: int = 3, horizon_days: int = 14, now: datetime | None = None) -> list:
+        now = (now or datetime.now(self.tz)).astimezone(self.tz)
+        slots = []
+        for _d, day_slots in self.free_slots(now.date(), now.date() + timedelta(days=horizon_days), now):
+            slots += day_slots
+            if len(slots) >= limit:
+                break
+        return slots[:limit]
@@ -0,0 +1,58 @@
+"""
+Microbenchmark de parse_datetime_es: sin caché vs. con caché, y costo del
+primer parseo en español de un proceso nuevo (lo que evita dates.prewarm()).
+
+    python bench/bench_dates.py
+"""
+import os
+import sys
+import time
+import subprocess
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dates  # noqa: E402
+
+CORPUS = [
+    "12/08 13:00", "12-08 a las 13", "mañana a las 10", "el lunes 15 hrs", "hoy a las 18",
+    "pasado mañana 9:30", "15/09 a las 11", "el viernes a las 16 horas", "mediodía",
+    "3 de octubre 10:00", "el martes 12", "20/12 17:30",
+]
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "20"))
+
+
+def cold_first_parse_ms() -> float:
+    code = ("import time;t=time.perf_counter();import dateparser;"
+            "dateparser.parse('12/08 13:00',languages=['es']);print((time.perf_counter()-t)*1000)")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return float(out.stdout.strip())
+
+
+def per_call_us(fn) -> float:
+    n = 0
+    t0 = time.perf_counter()
+    for _ in range(ROUNDS):
+        for txt in CORPUS:
+            fn({"datetime_text": txt})
+            n += 1
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main():
+    print(f"import + primer parseo en proceso nuevo: {cold_first_parse_ms():.0f} ms")
+    dates.prewarm()
+    tz = ZoneInfo(dates.TIMEZONE)
+    before = per_call_us(lambda p: dates._parse_uncached(p, datetime.now(tz)))
+    dates._CACHE.clear()
+    for txt in CORPUS:
+        dates.parse_datetime_es({"datetime_text": txt})
+    after = per_call_us(dates.parse_datetime_es)
+    print(f"sin caché: {before:9.1f} us/parseo")
+    print(f"con caché: {after:9.1f} us/parseo  ({before / after:.0f}x)  {dates.cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()
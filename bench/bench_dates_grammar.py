@@ -0,0 +1,59 @@
+"""
+Throughput de la gramática rápida de fechas (dates._fast_parse) vs. dateparser
+sobre un corpus de formas comunes. Que ambos den el mismo resultado (y dónde
+difieren a propósito) se prueba en tests/test_dates_grammar.py, que usa este
+mismo corpus.
+
+    python bench/bench_dates_grammar.py
+"""
+import os
+import sys
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dateparser  # noqa: E402
+import dates  # noqa: E402
+
+TZ = ZoneInfo(dates.TIMEZONE)
+BASE = datetime(2026, 10, 17, 9, 30, tzinfo=TZ)  # fija: los textos relativos resuelven igual en cada corrida
+
+
+def corpus():
+    out = []
+    for d, m in [(12, 8), (1, 1), (31, 12), (5, 3), (29, 2), (31, 4), (17, 10), (18, 10)]:
+        out += [f"{d}/{m:02d} 13:00", f"{d}-{m:02d} a las 13", f"{d}/{m} a las 9 hrs", f"{d}/{m}/2027 10:30"]
+    for rel in ["hoy", "mañana", "manana", "pasado mañana"]:
+        out += [f"{rel} a las 10", f"{rel} 18:30", f"{rel} a las 15 hrs", f"{rel} a mediodía"]
+    for wd in ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]:
+        out += [f"{wd} 15 hrs", f"el {wd} a las 9", f"{wd} a las 17:30"]
+    out += ["2027-08-12 13:00", "12/08 25:00", "mañana 24:00", "3 de octubre 10:00", "el próximo lunes 10:00"]
+    return out
+
+
+def dp_parse(txt, now):
+    return dateparser.parse(txt, languages=["es"], settings=dates._settings(now))
+
+
+def throughput(fn, texts, rounds=20):
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for txt in texts:
+            fn(txt, BASE)
+    dt = time.perf_counter() - t0
+    return rounds * len(texts) / dt
+
+
+def main():
+    texts = [t for t in (dates._normalize_text(r) for r in corpus()) if dates._fast_parse(t, BASE)]
+    fast = throughput(dates._fast_parse, texts, rounds=200)
+    slow = throughput(dp_parse, texts, rounds=3)
+    print(f"throughput: gramática {fast:,.0f} parseos/s, dateparser {slow:,.0f} parseos/s ({fast / slow:.0f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Requests por segundo de /chat, /nuevo y la página de resultado: render_template_string
+en cada request (antes) vs. plantillas compiladas / páginas pre-renderizadas (ahora).
+Usa el cliente de pruebas de Flask, así que mide solo el costo de la app.
+
+Requiere las mismas variables de entorno que app.py:
+
+    python bench/bench_templates.py
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import render_template_string  # noqa: E402
+
+import app as agendador  # noqa: E402
+
+SECONDS = float(os.getenv("BENCH_SECONDS", "2"))
+RESULT_CTX = dict(
+    mensaje="Listo Juan, agendé tu llamada.", start_dt="2027-01-12T10:00:00-03:00",
+    end_dt="2027-01-12T10:30:00-03:00", html_link="https://www.google.com/calendar/event?eid=x",
+    telefono="+56911111111", email="juan@example.com", gcal_add="https://calendar.google.com/x",
+    ics_url="https://example.com/ics/x.ics", pretty_event="{}" * 200,
+)
+
+app = agendador.app
+
+
+# Rutas equivalentes al comportamiento anterior (plantilla recompilada/renderizada por request)
+@app.get("/_bench/chat_old")
+def chat_old():
+    return render_template_string(agendador.CHAT_HTML, tz=agendador.TIMEZONE, cal=agendador.CALENDAR_ID,
+                                  greeting=agendador.GREETING_TEXT)
+
+
+@app.get("/_bench/nuevo_old")
+def nuevo_old():
+    return render_template_string(agendador.FORM_HTML, tz=agendador.TIMEZONE, cal=agendador.CALENDAR_ID)
+
+
+@app.get("/_bench/result_old")
+def result_old():
+    return render_template_string(agendador.RESULT_HTML, **RESULT_CTX)
+
+
+@app.get("/_bench/result_new")
+def result_new():
+    return agendador.RESULT_TMPL.render(**RESULT_CTX)
+
+
+def rps(client, path: str, headers=None) -> tuple:
+    n, size = 0, 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < SECONDS:
+        r = client.get(path, headers=headers or {})
+        size = len(r.data)
+        n += 1
+    return n / (time.perf_counter() - t0), size
+
+
+def main():
+    client = app.test_client()
+    gz = {"Accept-Encoding": "gzip, br"}
+    cases = [
+        ("/chat", "/_bench/chat_old", "/chat", gz),
+        ("/nuevo", "/_bench/nuevo_old", "/nuevo", gz),
+        ("resultado", "/_bench/result_old", "/_bench/result_new", None),
+    ]
+    print(f"{'ruta':<12}{'antes req/s':>14}{'ahora req/s':>14}{'x':>7}{'bytes antes':>13}{'bytes ahora':>13}")
+    for name, old, new, headers in cases:
+        before, size_before = rps(client, old)
+        after, size_after = rps(client, new, headers)
+        print(f"{name:<12}{before:>14.0f}{after:>14.0f}{after / before:>7.1f}{size_before:>13}{size_after:>13}")
+    etag = client.get("/chat", headers=gz).headers.get("ETag")
+    cond, _ = rps(client, "/chat", {**gz, "If-None-Match": etag})
+    print(f"{'/chat 304':<12}{'':>14}{cond:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Microbenchmarks sin red de los caminos de CPU de app.py: parseo de fechas,
+de-dup de webhooks, .ics, links de Google Calendar, eid, descripción de la
+cita y la plantilla de /chat. Importa app.py con LAZY_INIT=1 y credenciales
+de prueba, así que no se conecta a Google ni a OpenAI.
+
+    python bench/run.py                         # todos los casos; tabla en stderr
+    python bench/run.py -o base.json            # además guarda los resultados en JSON
+    python bench/run.py -k dedup -k ics         # solo los casos cuyo nombre contiene esos textos
+    python bench/run.py --compare base.json nuevo.json [--threshold 0.1]
+
+Con --compare el código de salida es 1 si algún caso empeoró más que el umbral
+(mediana del tiempo por operación).
+"""
+import os
+import sys
+import json
+import time
+import base64
+import timeit
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Sin red: clientes perezosos que nunca se construyen, sin trazas ni espejo de Calendar
+for key, value in {
+    "LAZY_INIT": "1",
+    "GOOGLE_SERVICE_ACCOUNT_JSON": json.dumps({"client_email": "bench@example.iam.gserviceaccount.com"}),
+    "GOOGLE_CALENDAR_ID": "bench@group.calendar.google.com",
+    "OPENAI_API_KEY": "sk-bench",
+    "TRACE_SAMPLE_RATE": "0",
+    "CAL_MIRROR": "0",
+    "WA_DEDUP_BACKEND": "memory",
+    "SESSION_BACKEND": "memory",
+}.items():
+    os.environ.setdefault(key, value)
+
+import app as agendador  # noqa: E402
+import dates  # noqa: E402
+from storage import TTLDedup, SQLiteDedup  # noqa: E402
+
+REPEAT = int(os.getenv("BENCH_REPEAT", "5"))
+TZ = ZoneInfo(agendador.TIMEZONE)
+
+# Lo que escriben los clientes por WhatsApp y el chat web (gramática rápida y fallback a dateparser)
+DATE_CORPUS = [
+    "12/08 13:00", "12-08 a las 13", "el 12/08 a las 13 hrs", "15/09/2027 10:30", "2027-08-12 13:00",
+    "mañana a las 10", "manana 18:30", "pasado mañana a mediodía", "hoy a las 18", "mañana a las 15 hrs",
+    "el lunes 15 hrs", "el viernes a las 16:30", "martes a las 9", "sábado 11:00",
+    "3 de octubre 10:00", "el próximo lunes 10:00", "20 de diciembre a las 17:30", "1 de marzo 9:00",
+    "quiero agendar para el 12/08 a las 13:00 por favor", "mañana en la tarde a las 4",
+]
+
+CASES = {}
+
+
+def case(name: str, unit: str = "op"):
+    """Registra setup() -> (fn, ops_por_llamada)."""
+    def register(setup):
+        CASES[name] = (setup, unit)
+        return setup
+    return register
+
+
+# =========================
+# Casos
+# =========================
+@case("parse_datetime_es.uncached", "texto")
+def _parse_uncached():
+    payloads = [{"datetime_text": t} for t in DATE_CORPUS]
+    dates.prewarm()
+
+    def fn():
+        now = datetime.now(TZ)
+        for p in payloads:
+            dates._parse_uncached(p, now)
+    return fn, len(payloads)
+
+
+@case("parse_datetime_es.cached", "texto")
+def _parse_cached():
+    payloads = [{"datetime_text": t} for t in DATE_CORPUS]
+    for p in payloads:
+        agendador.parse_datetime_es(p)
+
+    def fn():
+        for p in payloads:
+            agendador.parse_datetime_es(p)
+    return fn, len(payloads)
+
+
+def _dedup_case(size: int, backend: str):
+    def setup():
+        if backend == "sqlite":
+            path = os.path.join(tempfile.mkdtemp(prefix="bench-dedup-"), "dedup.db")
+            store = SQLiteDedup(path, ttl_sec=3600)
+        else:
+            store = TTLDedup(ttl_sec=3600)
+        for i in range(size):
+            store.check_and_add(f"wamid.HBgL{i:012d}")
+        agendador.WA_DEDUP = store
+        # Mitad reintentos de Meta (ya vistos), mitad mensajes nuevos
+        seen = [f"wamid.HBgL{i:012d}" for i in range(0, size, max(1, size // 500))][:500]
+        counter = iter(range(size, size + 10 ** 9))
+
+        def fn():
+            for mid in seen:
+                agendador.wa_is_dup(mid)
+                agendador.wa_is_dup(f"wamid.HBgL{next(counter):012d}")
+        return fn, 2 * len(seen)
+    return setup
+
+
+for _size, _label in ((10_000, "10k"), (100_000, "100k"), (1_000_000, "1M")):
+    case(f"wa_is_dup.memory.{_label}", "id")(_dedup_case(_size, "memory"))
+for _size, _label in ((10_000, "10k"), (100_000, "100k")):
+    case(f"wa_is_dup.sqlite.{_label}", "id")(_dedup_case(_size, "sqlite"))
+
+
+def _sample_event() -> dict:
+    start = datetime(2027, 1, 13, 10, 0, tzinfo=TZ)
+    ev = agendador.build_event_payload("María José Pérez-Ñúñez", start, start + timedelta(minutes=30),
+                                       telefono="+56 9 1234 5678", email="maria.jose@example.cl",
+                                       comentario="Prefiere que la llamen al celular; consulta sobre "
+                                                  "reprogramación, facturación y el plan anual, ¿es posible?")
+    ev.update(id="b9c4k2m0q1r2s3t4u5v6", status="confirmed", updated="2026-10-17T12:00:00.000Z",
+              etag='"3312345678901234"', htmlLink="https://www.google.com/calendar/event?eid=Yjlj")
+    return ev
+
+
+@case("build_ics_from_event")
+def _ics():
+    ev = _sample_event()
+    return (lambda: agendador.build_ics_from_event(ev)), 1
+
+
+@case("make_gcal_template_link")
+def _gcal_link():
+    ev = _sample_event()
+    start = datetime(2027, 1, 13, 10, 0, tzinfo=TZ)
+    end = start + timedelta(minutes=30)
+    return (lambda: agendador.make_gcal_template_link(ev["summary"], start, end, ev["description"])), 1
+
+
+@case("extract_event_and_cal_from_eid", "eid")
+def _eid():
+    raw = f"b9c4k2m0q1r2s3t4u5v6 {agendador.CALENDAR_ID}".encode("utf-8")
+    eid = base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+    inputs = [eid, f"https://www.google.com/calendar/event?eid={eid}", "no-es-un-eid", ""]
+
+    def fn():
+        for x in inputs:
+            agendador.extract_event_and_cal_from_eid(x)
+    return fn, len(inputs)
+
+
+@case("desc_field", "descripción")
+def _desc():
+    desc = _sample_event()["description"]
+    labels = ("Nombre", "Teléfono", "Email", "Comentario")
+
+    def fn():
+        for label in labels:
+            agendador._desc_field(desc, label)
+    return fn, 1
+
+
+@case("chat_template.render")
+def _chat_render():
+    tmpl = agendador.CHAT_TMPL
+    ctx = dict(tz=agendador.TIMEZONE, cal=agendador.CALENDAR_ID, greeting=agendador.GREETING_TEXT)
+    return (lambda: tmpl.render(**ctx)), 1
+
+
+@case("chat_page.get", "request")
+def _chat_get():
+    client = agendador.app.test_client()
+    headers = {"Accept-Encoding": "gzip, br"}
+    return (lambda: client.get("/chat", headers=headers)), 1
+
+
+# =========================
+# Medición
+# =========================
+def measure(setup) -> dict:
+    fn, per_call = setup()
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    runs = [t / (number * per_call) * 1e6 for t in timer.repeat(repeat=REPEAT, number=number)]
+    return {"median_us": round(statistics.median(runs), 4), "min_us": round(min(runs), 4),
+            "ops_per_sec": round(1e6 / statistics.median(runs), 1), "number": number * per_call,
+            "repeat": REPEAT}
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                             text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(filters) -> dict:
+    results = {}
+    for name, (setup, unit) in CASES.items():
+        if filters and not any(f in name for f in filters):
+            continue
+        t0 = time.perf_counter()
+        results[name] = {"unit": unit, **measure(setup)}
+        r = results[name]
+        print(f"{name:<34}{r['median_us']:>12.3f} µs/{unit:<12}{r['ops_per_sec']:>14,.0f}/s"
+              f"   ({time.perf_counter() - t0:.1f} s)", file=sys.stderr)
+    return {
+        "meta": {"commit": _git_commit(), "python": platform.python_version(),
+                 "platform": platform.platform(), "date": datetime.now().isoformat(timespec="seconds"),
+                 "repeat": REPEAT},
+        "results": results,
+    }
+
+
+def compare(old_path: str, new_path: str, threshold: float) -> int:
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{'caso':<34}{'antes µs':>12}{'ahora µs':>12}{'x':>8}")
+    regressions = 0
+    for name, r in new["results"].items():
+        before = old["results"].get(name)
+        if not before:
+            print(f"{name:<34}{'—':>12}{r['median_us']:>12.3f}{'nuevo':>8}")
+            continue
+        ratio = r["median_us"] / before["median_us"] if before["median_us"] else float("inf")
+        mark = ""
+        if ratio > 1 + threshold:
+            mark = "  REGRESIÓN"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            mark = "  mejora"
+        print(f"{name:<34}{before['median_us']:>12.3f}{r['median_us']:>12.3f}{ratio:>8.2f}{mark}")
+    print(f"\n{old['meta'].get('commit')} -> {new['meta'].get('commit')}: "
+          f"{regressions} regresiones (umbral {threshold:.0%})")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", help="archivo JSON de resultados (por defecto, stdout)")
+    parser.add_argument("-k", dest="filters", action="append", default=[], help="filtrar casos por nombre")
+    parser.add_argument("--list", action="store_true", help="listar los casos y salir")
+    parser.add_argument("--compare", nargs=2, metavar=("ANTES", "AHORA"))
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(CASES))
+        return 0
+    if args.compare:
+        return compare(*args.compare, args.threshold)
+    data = json.dumps(run(args.filters), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(data + "\n")
+    else:
+        print(data)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
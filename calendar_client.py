@@ -2,9 +2,6 @@ import os
 import json
 from typing import List, Dict, Any, Optional
 
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 
 class CalendarClient:
@@ -13,10 +10,25 @@ class CalendarClient:
         if not raw:
             raise Exception("Falta GOOGLE_SERVICE_ACCOUNT_JSON")
 
-        info = json.loads(raw)
-        self.creds = Credentials.from_service_account_info(info, scopes=SCOPES)
-        # cache_discovery=False evita warnings en server sin cache
-        self.service = build("calendar", "v3", credentials=self.creds, cache_discovery=False)
+        self.info = json.loads(raw)
+        # google-auth y el discovery de googleapiclient se cargan en el primer uso
+        self._creds = None
+        self._service = None
+
+    @property
+    def creds(self):
+        if self._creds is None:
+            from google.oauth2.service_account import Credentials
+            self._creds = Credentials.from_service_account_info(self.info, scopes=SCOPES)
+        return self._creds
+
+    @property
+    def service(self):
+        if self._service is None:
+            from googleapiclient.discovery import build
+            # cache_discovery=False evita warnings en server sin cache
+            self._service = build("calendar", "v3", credentials=self.creds, cache_discovery=False)
+        return self._service
 
     def insert_event(
         self,
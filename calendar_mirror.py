@@ -0,0 +1,287 @@
+import os
+import bisect
+import threading
+import time
+import uuid
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from googleapiclient.errors import HttpError
+
+
+def _ts(when: dict, tz) -> float | None:
+    """start/end de la API ({dateTime} o {date} para todo el día) -> epoch."""
+    if not when:
+        return None
+    if when.get("dateTime"):
+        return datetime.fromisoformat(when["dateTime"].replace("Z", "+00:00")).timestamp()
+    if when.get("date"):
+        return datetime.fromisoformat(when["date"]).replace(tzinfo=tz).timestamp()
+    return None
+
+
+class IntervalIndex:
+    """
+    Intervalos [inicio, fin) ordenados por inicio. Guarda la duración máxima
+    vista para acotar la búsqueda de solapamientos: ambas consultas son un
+    bisect más un recorrido corto.
+    """
+
+    def __init__(self):
+        self._starts = []
+        self._items = []   # (inicio, fin, id), mismo orden que _starts
+        self._by_id = {}   # id -> inicio
+        self._max_len = 0.0
+
+    def add(self, key: str, start: float, end: float):
+        self.remove(key)
+        i = bisect.bisect_right(self._starts, start)
+        self._starts.insert(i, start)
+        self._items.insert(i, (start, end, key))
+        self._by_id[key] = start
+        self._max_len = max(self._max_len, end - start)
+
+    def remove(self, key: str):
+        start = self._by_id.pop(key, None)
+        if start is None:
+            return
+        i = bisect.bisect_left(self._starts, start)
+        while i < len(self._items) and self._items[i][0] == start:
+            if self._items[i][2] == key:
+                del self._starts[i]
+                del self._items[i]
+                return
+            i += 1
+
+    def starting_between(self, lo: float, hi: float):
+        """Ids cuyo inicio está en [lo, hi], ordenados por inicio."""
+        i = bisect.bisect_left(self._starts, lo)
+        j = bisect.bisect_right(self._starts, hi)
+        return [it[2] for it in self._items[i:j]]
+
+    def overlapping(self, lo: float, hi: float):
+        """Ids de intervalos que se cruzan con [lo, hi)."""
+        j = bisect.bisect_left(self._starts, hi)
+        i = bisect.bisect_left(self._starts, lo - self._max_len)
+        return [key for s, e, key in self._items[i:j] if e > lo]
+
+    def clear(self):
+        self.__init__()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class CalendarMirror:
+    """
+    Copia local de un calendario: carga completa una vez y luego sincronización
+    incremental con syncToken. `list_events(**kwargs)` y `watch_events(**kwargs)`
+    ejecutan events.list / events.watch (se inyectan para usar el mismo cliente
+    y capa de ejecución que el resto de la app).
+
+    Solo se guardan los eventos que terminan después de hoy - `past_days`; las
+    consultas anteriores a esa ventana (covers() == False) van a la API.
+    Los eventos "transparent" (Disponible) no ocupan horario; uno de todo el
+    día marcado como Ocupado bloquea el día completo en overlapping(), igual
+    que en freebusy.
+    """
+
+    def __init__(self, list_events, calendar_id: str, timezone: str, max_age_sec: float = 60,
+                 watch_events=None, past_days: float = 30, max_stale_sec: float | None = None):
+        self.list_events = list_events
+        self.watch_events = watch_events
+        self.calendar_id = calendar_id
+        self.tz = ZoneInfo(timezone)
+        self.max_age = max_age_sec
+        # Más vieja que esto la copia ya no se usa mientras se refresca: se sincroniza en línea
+        self.max_stale = max_stale_sec if max_stale_sec is not None else max(600.0, 10 * max_age_sec)
+        self.past_days = past_days
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._events = {}
+        self._index = IntervalIndex()
+        self._sync_token = None
+        self._synced_at = 0.0
+        self._refreshing = None  # pid con un refresco en segundo plano en curso
+        self._local = None       # cambios propios durante una sincronización en curso
+        self.full_syncs = 0
+        self.incremental_syncs = 0
+        self.failed_syncs = 0
+        self.last_error = None
+
+    # --- sincronización ---
+    def window_start(self) -> float:
+        return time.time() - self.past_days * 86400
+
+    def sync(self):
+        """Trae los cambios desde la última sincronización (o la ventana completa, la primera vez)."""
+        with self._sync_lock:
+            # Las páginas se piden sin tomar _lock: las consultas siguen respondiendo con la
+            # copia anterior, y los apply()/remove() propios de mientras se anotan en _local
+            # para volver a aplicarlos encima de lo traído (son más nuevos que la respuesta)
+            with self._lock:
+                self._local = []
+            try:
+                self._sync_locked()
+            finally:
+                with self._lock:
+                    self._local = None
+
+    def _sync_locked(self):
+        if self._sync_token:
+            try:
+                items, token = self._fetch(syncToken=self._sync_token)
+            except HttpError as e:
+                if getattr(e, "resp", None) is None or e.resp.status != 410:
+                    raise
+                # 410 Gone: el token expiró, hay que recargar todo
+            else:
+                with self._lock:
+                    for ev in items:
+                        self._apply(self._events, self._index, ev)
+                    self._replay_local(self._events, self._index)
+                self._synced(token)
+                self.incremental_syncs += 1
+                return
+        time_min = datetime.fromtimestamp(self.window_start(), self.tz).isoformat()
+        items, token = self._fetch(showDeleted=False, timeMin=time_min)
+        # La copia nueva se arma aparte y se reemplaza de una vez
+        events, index = {}, IntervalIndex()
+        for ev in items:
+            self._apply(events, index, ev)
+        with self._lock:
+            self._replay_local(events, index)
+            self._events, self._index = events, index
+        self._synced(token)
+        self.full_syncs += 1
+
+    def _replay_local(self, events, index):
+        for ev in self._local or ():
+            self._apply(events, index, ev)
+
+    def _fetch(self, **params):
+        items, page_token = [], None
+        while True:
+            resp = self.list_events(calendarId=self.calendar_id, singleEvents=True, maxResults=2500,
+                                    pageToken=page_token, **params)
+            items.extend(resp.get("items") or [])
+            page_token = resp.get("nextPageToken")
+            if not page_token:
+                return items, resp.get("nextSyncToken")
+
+    def _synced(self, token):
+        self._sync_token = token or self._sync_token
+        self._synced_at = time.time()
+        self.last_error = None
+
+    def ensure_fresh(self) -> bool:
+        """
+        True si la copia sirve para consultar. Vieja (más de max_age) se refresca
+        en segundo plano y se sigue usando; sin cargar o más vieja que max_stale
+        se sincroniza en línea. False si esa sincronización falla: el llamador
+        consulta la API directamente.
+        """
+        age = time.time() - self._synced_at
+        if age <= self.max_age:
+            return True
+        if age <= self.max_stale:
+            self.refresh_async()
+            return True
+        try:
+            self.sync()
+            return True
+        except Exception as e:
+            self._failed(e)
+            return False
+
+    def refresh_async(self):
+        """Un refresco a la vez por proceso, en un hilo."""
+        pid = os.getpid()
+        with self._lock:
+            if self._refreshing == pid:
+                return
+            self._refreshing = pid
+        threading.Thread(target=self._refresh, name="calendar-mirror", daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self.sync()
+        except Exception as e:
+            self._failed(e)
+        finally:
+            self._refreshing = None
+
+    def _failed(self, e: Exception):
+        self.failed_syncs += 1
+        self.last_error = repr(e)
+
+    def covers(self, dt) -> bool:
+        """dt cae dentro de la ventana que guarda la copia."""
+        return dt.timestamp() >= self.window_start()
+
+    def watch(self, address: str, token: str = "", ttl_sec: int = 7 * 86400) -> dict:
+        """Registra un canal de notificaciones (web_hook) que apunta a `address`."""
+        body = {"id": str(uuid.uuid4()), "type": "web_hook", "address": address,
+                "params": {"ttl": str(ttl_sec)}}
+        if token:
+            body["token"] = token
+        return self.watch_events(calendarId=self.calendar_id, body=body)
+
+    # --- cambios locales (tras insert/update/delete propios) ---
+    def apply(self, ev: dict):
+        if not ev.get("id"):
+            return
+        with self._lock:
+            self._apply(self._events, self._index, ev)
+            if self._local is not None:
+                self._local.append(ev)
+
+    def remove(self, event_id: str):
+        self.apply({"id": event_id, "status": "cancelled"})
+
+    def _apply(self, events: dict, index: IntervalIndex, ev: dict):
+        ev_id = ev.get("id")
+        if not ev_id:
+            return
+        start, end = _ts(ev.get("start"), self.tz), _ts(ev.get("end"), self.tz)
+        if ev.get("status") == "cancelled" or start is None or end is None or end < self.window_start():
+            # Cancelado, o un cambio incremental de un evento antiguo (fuera de la ventana)
+            events.pop(ev_id, None)
+            index.remove(ev_id)
+            return
+        events[ev_id] = {k: ev.get(k) for k in ("id", "summary", "start", "end", "status", "htmlLink", "etag",
+                                                  "transparency")}
+        if ev.get("transparency") == "transparent":
+            # "Disponible" en Calendar: no ocupa el horario (los de todo el día suelen serlo)
+            index.remove(ev_id)
+        else:
+            index.add(ev_id, start, end)
+
+    # --- consultas ---
+    def get(self, event_id: str) -> dict | None:
+        with self._lock:
+            return self._events.get(event_id)
+
+    def find_near(self, dt, tolerance_min: float = 15):
+        """Eventos que empiezan en dt ± tolerance_min, ordenados por inicio."""
+        t = dt.timestamp()
+        with self._lock:
+            ids = self._index.starting_between(t - tolerance_min * 60, t + tolerance_min * 60)
+            return [self._events[i] for i in ids]
+
+    def overlapping(self, start_dt, end_dt, exclude_id: str | None = None):
+        with self._lock:
+            ids = self._index.overlapping(start_dt.timestamp(), end_dt.timestamp())
+            return [self._events[i] for i in ids if i != exclude_id]
+
+    def stats(self) -> dict:
+        return {
+            "events": len(self._events),
+            "synced_at": self._synced_at,
+            "has_sync_token": bool(self._sync_token),
+            "full_syncs": self.full_syncs,
+            "incremental_syncs": self.incremental_syncs,
+            "failed_syncs": self.failed_syncs,
+            "last_error": self.last_error,
+            "past_days": self.past_days,
+        }
@@ -0,0 +1,206 @@
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from storage import LRUCache
+
+TIMEZONE = os.getenv("TIMEZONE", "America/Santiago")
+
+# Caché de parseos: clave = texto normalizado + día actual en TIMEZONE
+DATE_CACHE_SIZE = int(os.getenv("DATE_CACHE_SIZE", "4096"))
+_CACHE = LRUCache(DATE_CACHE_SIZE)
+_MISS = object()
+
+# Expresiones que dependen de la hora exacta ("en 2 horas", "ahora"): no se cachean
+_NOW_RELATIVE_RE = re.compile(r"\b(ahora|en\s+\d+|dentro\s+de)\b")
+_SPACES_RE = re.compile(r"\s+")
+
+PARSE_STATS = {"fast": 0, "dateparser": 0}
+
+# dateparser tarda ~300 ms en importarse y su primer parseo carga los datos de
+# español: se hace en el primer uso (la gramática rápida cubre la mayoría de los
+# casos sin necesitarlo). Import y calentamiento van bajo un lock: un parseo que
+# llega mientras el hilo de LAZY_INIT calienta espera a que termine en vez de
+# cargar los datos en paralelo.
+_dateparser = None
+_DP_LOCK = threading.Lock()
+
+def _dp():
+    global _dateparser
+    if _dateparser is None:
+        with _DP_LOCK:
+            if _dateparser is None:
+                import dateparser
+                now = datetime.now(ZoneInfo(TIMEZONE))
+                for txt in ("12/08 13:00", "mañana 10:00", "el lunes 15:00"):
+                    dateparser.parse(txt, languages=["es"], settings=_settings(now))
+                _dateparser = dateparser
+    return _dateparser
+
+# =========================
+# Gramática rápida para las formas más comunes
+# =========================
+# "12/08 13:00", "12-08-2025 13:00", "2025-08-12 13:00", "mañana 10:00",
+# "pasado mañana a mediodía", "el lunes 15:00" (ya normalizadas: "a las 13" -> "13:00")
+_WEEKDAYS = {"lunes": 0, "martes": 1, "miercoles": 2, "miércoles": 2, "jueves": 3,
+             "viernes": 4, "sabado": 5, "sábado": 5, "domingo": 6}
+_REL_DAYS = {"hoy": 0, "mañana": 1, "manana": 1, "pasado mañana": 2, "pasado manana": 2}
+_TIME = r"(?:a\s+las\s+|a\s+)?(?:(?P<h>\d{1,2}):(?P<mi>\d{2})(?::\d{2})?|(?P<named>mediod[ií]a|medianoche))"
+_FAST_DM_RE = re.compile(rf"^(?P<d>\d{{1,2}})[/-](?P<m>\d{{1,2}})(?:[/-](?P<y>\d{{4}}|\d{{2}}))?\s+{_TIME}$")
+_FAST_ISO_RE = re.compile(rf"^(?P<y>\d{{4}})-(?P<m>\d{{1,2}})-(?P<d>\d{{1,2}})\s+{_TIME}$")
+_FAST_REL_RE = re.compile(rf"^(?P<rel>hoy|pasado\s+ma[ñn]ana|ma[ñn]ana)\s+{_TIME}$")
+_FAST_WD_RE = re.compile(rf"^(?:el\s+)?(?P<wd>lunes|martes|mi[ée]rcoles|jueves|viernes|s[áa]bado|domingo)\s+{_TIME}$")
+
+def _fast_time(m):
+    named = m.group("named")
+    if named:
+        return (0, 0) if named == "medianoche" else (12, 0)
+    h, mi = int(m.group("h")), int(m.group("mi"))
+    if h > 23 or mi > 59:
+        raise ValueError("hora fuera de rango")
+    return h, mi
+
+def _fast_parse(txt: str, now):
+    """
+    Resuelve las formas comunes contra `now` (TZ) con las mismas reglas que
+    dateparser: DMY, año faltante -> próxima ocurrencia, día de semana -> el
+    próximo (nunca hoy). Devuelve None si no reconoce el texto.
+    A diferencia de dateparser, entiende "el lunes ...", "pasado mañana ..." y
+    "... a mediodía" (dateparser devuelve None) y lee AAAA-MM-DD como año-mes-día aunque el
+    orden sea DMY (dateparser lo lee como año-día-mes).
+    """
+    tz = now.tzinfo
+    try:
+        m = _FAST_DM_RE.match(txt)
+        if m:
+            h, mi = _fast_time(m)
+            d, mo = int(m.group("d")), int(m.group("m"))
+            if m.group("y"):
+                y = int(m.group("y"))
+                return datetime(y + 2000 if y < 100 else y, mo, d, h, mi, tzinfo=tz)
+            dt = datetime(now.year, mo, d, h, mi, tzinfo=tz)
+            return dt if dt >= now else datetime(now.year + 1, mo, d, h, mi, tzinfo=tz)
+
+        m = _FAST_ISO_RE.match(txt)
+        if m:
+            h, mi = _fast_time(m)
+            return datetime(int(m.group("y")), int(m.group("m")), int(m.group("d")), h, mi, tzinfo=tz)
+
+        m = _FAST_REL_RE.match(txt)
+        if m:
+            h, mi = _fast_time(m)
+            day = now.date() + timedelta(days=_REL_DAYS[_SPACES_RE.sub(" ", m.group("rel"))])
+            return datetime(day.year, day.month, day.day, h, mi, tzinfo=tz)
+
+        m = _FAST_WD_RE.match(txt)
+        if m:
+            h, mi = _fast_time(m)
+            ahead = (_WEEKDAYS[m.group("wd")] - now.weekday()) % 7 or 7
+            day = now.date() + timedelta(days=ahead)
+            return datetime(day.year, day.month, day.day, h, mi, tzinfo=tz)
+    except ValueError:  # 31/02, 25:00, ...
+        return None
+    return None
+
+def _parse_text(txt: str, settings: dict):
+    dt = _fast_parse(txt, settings["RELATIVE_BASE"])
+    if dt:
+        PARSE_STATS["fast"] += 1
+        return dt
+    PARSE_STATS["dateparser"] += 1
+    return _dp().parse(txt, languages=["es"], settings=settings)
+
+# =========================
+# Fechas: parser robusto
+# =========================
+def _has_time_token(text: str) -> bool:
+    if not text:
+        return False
+    t = text.lower()
+    if re.search(r"\b(mediod[ií]a|medianoche)\b", t):
+        return True
+    return bool(re.search(r"\b\d{1,2}(:\d{2})?\s*(am|pm)?\b", t))
+
+def _settings(now):
+    return {
+        "PREFER_DATES_FROM": "future",
+        "RETURN_AS_TIMEZONE_AWARE": True,
+        "TIMEZONE": TIMEZONE,
+        "RELATIVE_BASE": now,
+        "DATE_ORDER": "DMY",
+    }
+
+def _norm(value) -> str:
+    return _SPACES_RE.sub(" ", (value or "").strip().lower())
+
+def parse_datetime_es(payload: dict):
+    """
+    Convierte texto o (fecha+hora) a datetime con tz.
+    - DATE_ORDER=DMY (12/08 = 12 de agosto)
+    - Normaliza '13 horas/hrs', 'a las 13' y '13' (al final) -> '13:00'
+    - Requiere hora cuando viene por texto natural
+    - Prefiere futuro; RELATIVE_BASE ahora en TZ
+    Los resultados se cachean por día; un resultado cacheado que ya quedó en
+    el pasado se recalcula (ej. "a las 10" pasa a ser mañana después de las 10).
+    """
+    now = datetime.now(ZoneInfo(TIMEZONE))
+    dt_text = _norm(payload.get("datetime_text"))
+    key = (dt_text, _norm(payload.get("fecha")), _norm(payload.get("hora")),
+           bool(payload.get("_allow_date_only")), now.date())
+    cacheable = not _NOW_RELATIVE_RE.search(dt_text)
+    if cacheable:
+        hit = _CACHE.get(key, _MISS)
+        if hit is not _MISS and (hit is None or hit > now):
+            return hit
+    dt = _parse_uncached(payload, now)
+    if cacheable:
+        _CACHE.set(key, dt)
+    return dt
+
+def _normalize_text(dt_text: str) -> str:
+    """'13 horas/hrs', 'a las 13' y '13' (al final) -> '13:00'."""
+    txt = dt_text.lower()
+    txt = re.sub(r"\b(a\s*las\s*)?(\d{1,2})\s*(h|hs|hrs|horas)\b", r"\2:00", txt)
+    txt = re.sub(r"\b(a\s*las\s*)?(\d{1,2})\b(?=\s*$)", r"\2:00", txt)
+    return txt
+
+def _parse_uncached(payload: dict, now):
+    settings = _settings(now)
+
+    dt_text = (payload.get("datetime_text") or "").strip()
+    if dt_text:
+        txt = _normalize_text(dt_text)
+        if not _has_time_token(txt):
+            return None
+        dt = _parse_text(txt, settings)
+        if dt:
+            return dt
+
+    fecha = (payload.get("fecha") or "").strip()
+    hora = (payload.get("hora") or "").strip()
+    if fecha and hora:
+        if re.fullmatch(r"\d{1,2}", hora):
+            hora = f"{hora}:00"
+        dt = _parse_text(f"{fecha} {hora}".lower(), settings)
+        if dt:
+            return dt
+
+    if fecha and not hora and payload.get("_allow_date_only"):
+        dt = _parse_text(f"{fecha} 10:00".lower(), settings)
+        if dt:
+            return dt
+
+    return None
+
+def prewarm():
+    """
+    Importa dateparser y carga sus datos de español (el primer parseo de un
+    proceso es muy lento). Con `gunicorn --preload` corre una vez en el master
+    y los workers lo heredan; con LAZY_INIT, en el hilo de calentamiento.
+    """
+    _dp()
+
+def cache_stats() -> dict:
+    return {**_CACHE.stats(), "parsed_fast": PARSE_STATS["fast"], "parsed_dateparser": PARSE_STATS["dateparser"]}
@@ -0,0 +1,218 @@
+import os
+import csv
+import json
+import time
+import random
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from googleapiclient.errors import HttpError
+
+
+# =========================
+# Lectura en streaming (CSV / JSONL)
+# =========================
+def iter_rows(path: str):
+    """Genera (n_fila, dict) sin cargar el archivo completo. CSV con encabezados o JSONL."""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            for n, line in enumerate(f, 1):
+                line = line.strip()
+                if line:
+                    try:
+                        yield n, json.loads(line)
+                    except ValueError:
+                        yield n, None
+        else:
+            for n, row in enumerate(csv.DictReader(f), 2):
+                yield n, {(k or "").strip().lower(): (v or "").strip() for k, v in row.items()}
+
+
+def row_event_id(row: dict) -> str:
+    """
+    Id de evento determinista para la fila (base32hex, alfabeto válido para Calendar):
+    reimportar la misma fila choca con 409 en vez de duplicar la cita.
+    """
+    raw = json.dumps(row, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return base64.b32hexencode(hashlib.sha1(raw).digest()).decode("ascii").lower().rstrip("=")
+
+
+# =========================
+# Checkpoint (ids ya importados)
+# =========================
+class Checkpoint:
+    """Archivo append-only con un id de evento por línea; se relee al reanudar."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done = {line.strip() for line in f if line.strip()}
+        self._f = open(path, "a", encoding="utf-8")
+
+    def __contains__(self, event_id: str):
+        return event_id in self.done
+
+    def mark(self, event_id: str):
+        with self._lock:
+            self.done.add(event_id)
+            self._f.write(event_id + "\n")
+            self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+# =========================
+# Concurrencia adaptativa (AIMD)
+# =========================
+class AIMDLimiter:
+    """
+    Límite de inserts en vuelo: sube de a uno tras `limit` éxitos seguidos y
+    se divide por dos ante cada respuesta de cuota (403 rateLimitExceeded / 429).
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.limit = float(self.max_limit)
+        self.inflight = 0
+        self.throttled = 0
+        self._ok = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.inflight += 1
+
+    def release(self):
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify_all()
+
+    def success(self):
+        with self._cond:
+            self._ok += 1
+            if self._ok >= self.limit and self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1)
+                self._ok = 0
+                self._cond.notify_all()
+
+    def backoff(self):
+        with self._cond:
+            self.limit = max(self.min_limit, self.limit / 2)
+            self._ok = 0
+            self.throttled += 1
+
+
+def is_rate_limited(e: HttpError) -> bool:
+    status = getattr(getattr(e, "resp", None), "status", None)
+    if status == 429:
+        return True
+    content = getattr(e, "content", b"") or b""
+    return status == 403 and (b"rateLimitExceeded" in content or b"RateLimitExceeded" in content)
+
+
+def _status(e: HttpError):
+    return getattr(getattr(e, "resp", None), "status", None)
+
+
+# =========================
+# Importador
+# =========================
+class Importer:
+    """
+    Importa citas fila a fila. `prepare(row, event_id)` valida y devuelve
+    (datos, None) o (None, error) con datos["body"] listo para insertar;
+    `insert(body)` ejecuta events.insert; `on_created(evento, datos)` es opcional.
+    """
+
+    def __init__(self, prepare, insert, on_created=None, workers: int = 4,
+                 max_attempts: int = 6, backoff_base: float = 1.0, backoff_cap: float = 32.0,
+                 on_error=None):
+        self.prepare = prepare
+        self.insert = insert
+        self.on_created = on_created
+        self.on_error = on_error
+        self.workers = max(1, int(workers))
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.limiter = AIMDLimiter(self.workers)
+        self._lock = threading.Lock()
+        self.counts = {"read": 0, "created": 0, "existing": 0, "skipped": 0, "invalid": 0, "failed": 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self.counts[key] += 1
+
+    def _fail(self, key: str, n: int, msg: str):
+        self._count(key)
+        if self.on_error:
+            self.on_error(n, msg)
+
+    def _insert_with_backoff(self, body: dict):
+        for attempt in range(self.max_attempts):
+            try:
+                created = self.insert(body)
+                self.limiter.success()
+                return created
+            except HttpError as e:
+                if not is_rate_limited(e) or attempt == self.max_attempts - 1:
+                    raise
+                self.limiter.backoff()
+                # Backoff exponencial con jitter completo
+                time.sleep(random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt)))
+
+    def _process(self, n: int, event_id: str, prep: dict, checkpoint: Checkpoint):
+        try:
+            created = self._insert_with_backoff(prep["body"])
+        except HttpError as e:
+            if _status(e) == 409:
+                # Ya existe con este id: una corrida anterior la insertó antes de caerse
+                checkpoint.mark(event_id)
+                self._count("existing")
+                return
+            self._fail("failed", n, f"HTTP {_status(e)}: {getattr(e, 'reason', '') or e}")
+            return
+        except Exception as e:
+            self._fail("failed", n, repr(e))
+            return
+        finally:
+            self.limiter.release()
+        checkpoint.mark(event_id)
+        self._count("created")
+        if self.on_created:
+            self.on_created(created, prep)
+
+    def run(self, rows, checkpoint: Checkpoint) -> dict:
+        """Consume `rows` ((n, dict), ...) con a lo sumo `workers` inserts en vuelo."""
+        t0 = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="import") as pool:
+            for n, row in rows:
+                self._count("read")
+                if not isinstance(row, dict):
+                    self._fail("invalid", n, "Fila ilegible.")
+                    continue
+                event_id = row_event_id(row)
+                if event_id in checkpoint:
+                    self._count("skipped")
+                    continue
+                prep, err = self.prepare(row, event_id)
+                if not prep:
+                    self._fail("invalid", n, err)
+                    continue
+                # Bloquea la lectura mientras no haya cupo: memoria acotada
+                self.limiter.acquire()
+                pool.submit(self._process, n, event_id, prep, checkpoint)
+        out = dict(self.counts)
+        out["seconds"] = round(time.time() - t0, 1)
+        out["final_limit"] = int(self.limiter.limit)
+        out["throttled"] = self.limiter.throttled
+        return out
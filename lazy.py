@@ -0,0 +1,124 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+
+class StartupReport:
+    """Tiempos de arranque por componente (import e inicialización), en ms."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.imports = {}
+        self.inits = {}
+        self.boot_ms = None
+        self.warmup = {"pid": None, "started_after_ms": None, "ms": None, "error": None}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timed(self, name: str, kind: str = "imports"):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                getattr(self, kind)[name] = round((time.perf_counter() - t) * 1000, 1)
+
+    def booted(self):
+        self.boot_ms = round((time.perf_counter() - self.t0) * 1000, 1)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {"boot_ms": self.boot_ms, "imports_ms": dict(self.imports),
+                    "init_ms": dict(self.inits), "warmup": dict(self.warmup)}
+
+
+class LazyObject:
+    """
+    Proxy que construye el objeto real con `factory()` en el primer acceso
+    (thread-safe) y desde ahí delega atributos, índices e iteración.
+    """
+
+    def __init__(self, name: str, factory, report: StartupReport | None = None):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_report", report)
+        object.__setattr__(self, "_obj", None)
+        object.__setattr__(self, "_ready", False)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _resolve(self):
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    if self._report:
+                        with self._report.timed(self._name, "inits"):
+                            obj = self._factory()
+                    else:
+                        obj = self._factory()
+                    object.__setattr__(self, "_obj", obj)
+                    object.__setattr__(self, "_ready", True)
+        return self._obj
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._resolve(), attr, value)
+
+    def __getitem__(self, key):
+        return self._resolve()[key]
+
+    def __iter__(self):
+        return iter(self._resolve())
+
+    def __repr__(self):
+        state = "listo" if self._ready else "pendiente"
+        return f"<LazyObject {self._name} ({state})>"
+
+
+def unwrap(obj):
+    """El objeto real detrás de un LazyObject (o el mismo objeto si no lo es)."""
+    return obj._resolve() if isinstance(obj, LazyObject) else obj
+
+
+def build(name: str, factory, lazy: bool, report: StartupReport):
+    """LazyObject si `lazy`; si no, construye ahora y registra el tiempo."""
+    if lazy:
+        return LazyObject(name, factory, report)
+    with report.timed(name, "inits"):
+        return factory()
+
+
+class WarmUp:
+    """Ejecuta `steps` [(nombre, fn), ...] una vez por proceso, en un hilo de fondo."""
+
+    def __init__(self, steps, report: StartupReport):
+        self.steps = steps
+        self.report = report
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Con `gunicorn --preload` no se arranca antes del fork: se dispara en el
+        # primer request de cada worker.
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+        threading.Thread(target=self._run, name="warmup", daemon=True).start()
+
+    def _run(self):
+        r = self.report
+        r.warmup.update(pid=os.getpid(), started_after_ms=round((time.perf_counter() - r.t0) * 1000, 1))
+        t = time.perf_counter()
+        for name, fn in self.steps:
+            try:
+                with r.timed(name, "inits"):
+                    fn()
+            except Exception as e:
+                r.warmup["error"] = f"{name}: {e!r}"
+        r.warmup["ms"] = round((time.perf_counter() - t) * 1000, 1)
@@ -0,0 +1,258 @@
+"""
+Contadores, gauges e histogramas en memoria con salida en formato de texto de
+Prometheus. Con varios workers de gunicorn cada proceso guarda una foto JSON
+en METRICS_DIR (cada `flush_sec` y al pedir /_metrics) y el endpoint suma las
+de todos: contadores e histogramas de todos los pids (también de los que ya
+terminaron, para que no retrocedan), gauges solo de los pids vivos.
+"""
+import os
+import json
+import time
+import bisect
+import atexit
+import threading
+from contextlib import contextmanager
+
+# Segundos: desde una lectura en caché hasta un turno largo del LLM
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(k, "")) for k in self.labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = [[list(k), v if not isinstance(v, list) else list(v)] for k, v in self._values.items()]
+        return {"type": self.kind, "help": self.help, "labels": list(self.labels), "values": values}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """Valor por etiquetas: [conteo por bucket..., +Inf, suma] (buckets no acumulados)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [0] * (len(self.buckets) + 2)
+            v[i] += 1
+            v[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def snapshot(self) -> dict:
+        snap = super().snapshot()
+        snap["buckets"] = list(self.buckets)
+        return snap
+
+
+class Registry:
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics = {}
+        self._pid = None
+        self._dir = None
+        self._flush_sec = 10.0
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        metric.name = self.prefix + metric.name
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels=()) -> Counter:
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels=()) -> Gauge:
+        return self._add(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def snapshot(self) -> dict:
+        return {name: m.snapshot() for name, m in self._metrics.items()}
+
+    # --- varios procesos ---
+    def use_dir(self, path: str | None, flush_sec: float = 10.0):
+        """Activa las fotos por proceso en `path` (None = un solo proceso)."""
+        self._dir = path or None
+        self._flush_sec = flush_sec
+        if self._dir:
+            os.makedirs(self._dir, exist_ok=True)
+
+    def start(self):
+        """Hilo que guarda la foto de este proceso; una vez por pid (tras el fork)."""
+        pid = os.getpid()
+        if not self._dir or self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self._flush_sec)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def flush(self):
+        if not self._dir:
+            return
+        pid = os.getpid()
+        path = os.path.join(self._dir, f"metrics-{pid}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"pid": pid, "metrics": self.snapshot()}, f)
+        os.replace(tmp, path)
+
+    def collect(self) -> dict:
+        """Fotos de todos los procesos sumadas (o solo la propia, sin METRICS_DIR)."""
+        if not self._dir:
+            return self.snapshot()
+        self.flush()
+        merged = {}
+        for fname in sorted(os.listdir(self._dir)):
+            if not (fname.startswith("metrics-") and fname.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(self._dir, fname), encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _pid_alive(data.get("pid"))
+            for name, snap in (data.get("metrics") or {}).items():
+                if snap["type"] == "gauge" and not alive:
+                    continue
+                _merge(merged, name, snap)
+        return merged
+
+    def render(self) -> str:
+        return render(self.collect())
+
+
+def _pid_alive(pid) -> bool:
+    if not isinstance(pid, int):
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(merged: dict, name: str, snap: dict):
+    target = merged.get(name)
+    if target is None:
+        merged[name] = {**snap, "values": [[list(k), v if not isinstance(v, list) else list(v)]
+                                           for k, v in snap["values"]]}
+        return
+    index = {tuple(k): v for k, v in target["values"]}
+    for k, v in snap["values"]:
+        k = tuple(k)
+        cur = index.get(k)
+        if cur is None:
+            index[k] = v if not isinstance(v, list) else list(v)
+        elif isinstance(cur, list):
+            index[k] = [a + b for a, b in zip(cur, v)]
+        else:
+            index[k] = cur + v
+    target["values"] = [[list(k), v] for k, v in index.items()]
+
+
+# =========================
+# Formato de texto de Prometheus
+# =========================
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(v) -> str:
+    if isinstance(v, float):
+        return repr(v) if v != int(v) or abs(v) >= 1e15 else str(int(v))
+    return str(v)
+
+
+def render(snapshot: dict) -> str:
+    lines = []
+    for name, snap in sorted(snapshot.items()):
+        kind, names = snap["type"], snap["labels"]
+        lines.append(f"# HELP {name} {snap['help']}")
+        lines.append(f"# TYPE {name} {kind}")
+        for values, v in sorted(snap["values"], key=lambda kv: kv[0]):
+            if kind != "histogram":
+                lines.append(f"{name}{_labels(names, values)} {_num(v)}")
+                continue
+            acc = 0
+            for le, n in zip(snap["buckets"] + ["+Inf"], v[:-1]):
+                acc += n
+                lines.append(f"{name}_bucket{_labels(names, values, ('le', _num(le) if le != '+Inf' else le))} {acc}")
+            lines.append(f"{name}_sum{_labels(names, values)} {_num(v[-1])}")
+            lines.append(f"{name}_count{_labels(names, values)} {acc}")
+    return "\n".join(lines) + "\n"
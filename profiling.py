@@ -0,0 +1,227 @@
+"""
+Perfiles bajo demanda de un request o de un turno de conversación.
+
+Dos modos:
+  - "cprofile": determinista (cProfile) del hilo que atiende; tiempo de CPU
+    por función. Uno a la vez por proceso: si ya hay otro en curso, ese
+    request se perfila con el muestreador.
+  - "wall": un hilo toma el stack del hilo perfilado cada `interval_ms`
+    (sys._current_frames) y cuenta stacks colapsados; incluye la espera de
+    I/O (Calendar, OpenAI), que cProfile casi no ve.
+
+Los resultados quedan en memoria por id (los `keep` más recientes) y, con
+`directory`, también en disco para que cualquier worker los pueda servir.
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import hmac
+import random
+import pstats
+import cProfile
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+
+class WallSampler:
+    """Muestreo periódico del stack de un hilo."""
+
+    def __init__(self, thread_id: int, interval_ms: float = 5.0, max_depth: int = 60):
+        self.thread_id = thread_id
+        self.interval = max(0.001, interval_ms / 1000)
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def collapsed(self) -> str:
+        """Formato de flamegraph.pl / speedscope: `a;b;c N` por línea."""
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def report(self, top: int = 40) -> str:
+        leaf, total = Counter(), Counter()
+        for stack, n in self.stacks.items():
+            frames = stack.split(";")
+            leaf[frames[-1]] += n
+            for f in set(frames):
+                total[f] += n
+        ms = self.interval * 1000
+        lines = [f"{self.samples} muestras cada {ms:g} ms", "", "propio (ms)   total (ms)   función"]
+        for f, n in leaf.most_common(top):
+            lines.append(f"{n * ms:>11.0f}  {total[f] * ms:>11.0f}   {f}")
+        return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    def __init__(self, token: str, sample_rate: float = 0.0, mode: str = "cprofile", keep: int = 50,
+                 interval_ms: float = 5.0, sessions=(), directory: str = ""):
+        self.token = token
+        self.sample_rate = sample_rate
+        self.mode = mode if mode in ("cprofile", "wall") else "cprofile"
+        self.keep = max(1, int(keep))
+        self.interval_ms = interval_ms
+        self.sessions = set(sessions)
+        self.directory = directory or None
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+        self._cprofile = threading.Lock()  # cProfile no admite dos perfiles activos a la vez
+        self._active = threading.local()
+        self.taken = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    # --- cuándo perfilar ---
+    def authorized(self, value: str | None) -> bool:
+        return bool(value) and hmac.compare_digest(value.encode("utf-8"), self.token.encode("utf-8"))
+
+    def wanted(self, header: str | None = None, query: str | None = None, session_id: str | None = None) -> bool:
+        if getattr(self._active, "on", False):
+            return False  # ya dentro de un perfil (p. ej. el turno dentro del request perfilado)
+        if self.authorized(header) or self.authorized(query):
+            return True
+        if session_id is not None and session_id in self.sessions:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    # --- captura ---
+    @contextmanager
+    def profile(self, kind: str, name: str, mode: str | None = None, **meta):
+        """Perfila el bloque; entrega el registro (con su id) antes de ejecutarlo."""
+        mode = mode or self.mode
+        record = {"id": uuid.uuid4().hex[:16], "kind": kind, "name": name, "pid": os.getpid(),
+                  "started": round(time.time(), 3), **meta}
+        prof = sampler = None
+        if mode == "cprofile" and self._cprofile.acquire(blocking=False):
+            prof = cProfile.Profile()
+        else:
+            mode = "wall"
+            sampler = WallSampler(threading.get_ident(), self.interval_ms)
+        record["mode"] = mode
+        self._active.on = True
+        t0 = time.perf_counter()
+        try:
+            if prof:
+                prof.enable()
+            else:
+                sampler.start()
+            yield record
+        finally:
+            if prof:
+                prof.disable()
+                self._cprofile.release()
+            else:
+                sampler.stop()
+            self._active.on = False
+            record["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            if prof:
+                out = io.StringIO()
+                pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(60)
+                record["report"] = out.getvalue()
+            else:
+                record["report"] = sampler.report()
+                record["collapsed"] = sampler.collapsed()
+            self._store(record)
+
+    def _store(self, record: dict):
+        with self._lock:
+            self._profiles[record["id"]] = record
+            while len(self._profiles) > self.keep:
+                self._profiles.popitem(last=False)
+            self.taken += 1
+        if self.directory:
+            path = os.path.join(self.directory, f"{record['id']}.json")
+            try:
+                with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                    json.dump(record, f)
+                os.replace(f"{path}.tmp", path)
+            except OSError:
+                pass
+
+    # --- consulta ---
+    def get(self, profile_id: str) -> dict | None:
+        with self._lock:
+            record = self._profiles.get(profile_id)
+        if record is None and self.directory and profile_id.isalnum():
+            try:
+                with open(os.path.join(self.directory, f"{profile_id}.json"), encoding="utf-8") as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                return None
+        return record
+
+    def recent(self) -> list:
+        """Resumen de los perfiles de este proceso, del más reciente al más antiguo."""
+        with self._lock:
+            records = list(self._profiles.values())
+        keys = ("id", "kind", "name", "mode", "ms", "started", "pid", "session_id", "path", "status")
+        return [{k: r[k] for k in keys if k in r} for r in reversed(records)]
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "sample_rate": self.sample_rate, "stored": len(self._profiles),
+                "taken": self.taken, "sessions": len(self.sessions), "directory": self.directory}
+
+
+class ProfilerMiddleware:
+    """
+    WSGI: perfila el request completo si trae `header` o `?query=` con el
+    token (o cae en la muestra). Responde con X-Profile-Id.
+    """
+
+    def __init__(self, wsgi_app, profiler: Profiler, header: str = "X-Profile", query: str = "_profile",
+                 skip_prefix: str = "/_profiles"):
+        self.wsgi_app = wsgi_app
+        self.profiler = profiler
+        self.skip_prefix = skip_prefix
+        self.environ_key = "HTTP_" + header.upper().replace("-", "_")
+        self.query = query
+
+    def _query_value(self, environ) -> str | None:
+        qs = environ.get("QUERY_STRING") or ""
+        if self.query not in qs:
+            return None
+        from urllib.parse import parse_qs
+        return (parse_qs(qs).get(self.query) or [None])[0]
+
+    def __call__(self, environ, start_response):
+        if (environ.get("PATH_INFO") or "").startswith(self.skip_prefix) or \
+                not self.profiler.wanted(environ.get(self.environ_key), self._query_value(environ)):
+            return self.wsgi_app(environ, start_response)
+        mode = "wall" if "wall" in (environ.get("HTTP_X_PROFILE_MODE") or "") else None
+        name = f"{environ.get('REQUEST_METHOD')} {environ.get('PATH_INFO')}"
+        with self.profiler.profile("request", name, mode=mode) as record:
+            def start_profiled(status, headers, exc_info=None):
+                record["status"] = int(status.split(" ", 1)[0])
+                return start_response(status, headers + [("X-Profile-Id", record["id"])], exc_info)
+
+            # El cuerpo se consume dentro del perfil (incluye respuestas en streaming)
+            result = self.wsgi_app(environ, start_profiled)
+            try:
+                body = list(result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+        return body
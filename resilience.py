@@ -0,0 +1,271 @@
+import time
+import random
+import asyncio
+import threading
+
+
+class UpstreamBusy(Exception):
+    """No hay cupo en el limitador del upstream dentro del tiempo máximo de espera."""
+
+    def __init__(self, name: str, retry_after: float = 1.0):
+        super().__init__(f"{name}: límite de tasa local alcanzado")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class UpstreamUnavailable(Exception):
+    """El upstream está caído o lento (circuito abierto, timeouts o 5xx tras los reintentos)."""
+
+    def __init__(self, name: str, retry_after: float = 1.0):
+        super().__init__(f"{name}: no disponible")
+        self.name = name
+        self.retry_after = retry_after
+
+
+# =========================
+# Token bucket
+# =========================
+class TokenBucket:
+    """
+    `rate` solicitudes por segundo con ráfagas de hasta `burst`. reserve() toma
+    un token (o lo deja en deuda) y devuelve cuánto hay que esperar para usarlo;
+    así el mismo bucket sirve a hilos (time.sleep) y a corrutinas (asyncio.sleep).
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = max(0.001, float(rate))
+        self.burst = max(1.0, float(burst))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> float | None:
+        """Segundos a esperar antes de llamar, o None si serían más de max_wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = max(self._paused_until - now, -self._tokens / self.rate if self._tokens < 0 else 0.0)
+            if wait > max_wait:
+                self._tokens += 1
+                return None
+            return wait
+
+    def pause(self, seconds: float):
+        """El upstream pidió esperar (429 + Retry-After): nadie sale antes de ese momento."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+# =========================
+# Upstream: limitador + reintentos
+# =========================
+def _retry_after_seconds(value) -> float | None:
+    if value in (None, ""):
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None  # formato fecha HTTP: se usa el backoff normal
+
+
+class Upstream:
+    """
+    Un servicio externo (OpenAI, Calendar, Graph) con su token bucket y su
+    política de reintentos. `classify(exc)` devuelve (status, retry_after):
+    status 429 o >= 500 para errores HTTP, 0 para errores de red/timeout y
+    None si el error no es del upstream. `response_status(resultado)` hace lo
+    mismo para clientes que no lanzan excepciones (requests).
+
+    429 se reintenta siempre (el upstream no procesó la solicitud); 5xx y
+    errores de red solo si la operación es idempotente. Un Retry-After mayor
+    que `backoff_cap` no se reintenta: lanza UpstreamBusy con ese retry_after.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, classify, response_status=None,
+                 max_attempts: int = 4, backoff_base: float = 0.5, backoff_cap: float = 20.0,
+                 max_wait: float = 10.0):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.classify = classify
+        self.response_status = response_status
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self.counts = {"calls": 0, "retries": 0, "throttled": 0, "shed": 0, "failures": 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self.counts[key] += 1
+
+    def _take(self) -> float:
+        wait = self.bucket.reserve(self.max_wait)
+        if wait is None:
+            self._count("shed")
+            raise UpstreamBusy(self.name, retry_after=max(1.0, 1 / self.bucket.rate))
+        return wait
+
+    def _retry_delay(self, status, retry_after, idempotent: bool, attempt: int) -> float | None:
+        """Segundos antes del siguiente intento, o None si no se reintenta."""
+        if status is None or attempt >= self.max_attempts - 1:
+            return None
+        if status == 429:
+            self._count("throttled")
+        elif not idempotent:
+            return None
+        elif not (status == 0 or status >= 500):
+            return None
+        # Backoff exponencial con jitter completo; Retry-After manda si viene
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        retry_after = _retry_after_seconds(retry_after)
+        if retry_after is not None:
+            if status == 429:
+                self.bucket.pause(retry_after)
+            if retry_after > self.backoff_cap:
+                # Reintentar antes de lo que pidió el servidor solo trae otro error de cuota
+                self._count("failures")
+                raise UpstreamBusy(self.name, retry_after=retry_after)
+            delay = max(delay, retry_after)
+        self._count("retries")
+        return delay
+
+    def call(self, fn, idempotent: bool = True):
+        """fn() con cupo del bucket y reintentos."""
+        self._count("calls")
+        attempt = 0
+        while True:
+            wait = self._take()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                result = fn()
+            except Exception as e:
+                delay = self._retry_delay(*self.classify(e), idempotent, attempt)
+                if delay is None:
+                    self._count("failures")
+                    raise
+            else:
+                if not self.response_status:
+                    return result
+                delay = self._retry_delay(*self.response_status(result), idempotent, attempt)
+                if delay is None:
+                    return result
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, coro_fn, idempotent: bool = True):
+        """Igual que call(), para `await coro_fn()`; las esperas no bloquean el loop."""
+        self._count("calls")
+        attempt = 0
+        while True:
+            wait = self._take()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                return await coro_fn()
+            except Exception as e:
+                delay = self._retry_delay(*self.classify(e), idempotent, attempt)
+                if delay is None:
+                    self._count("failures")
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> dict:
+        return {"rate": self.bucket.rate, "burst": self.bucket.burst, **self.counts}
+
+
+# =========================
+# Circuit breaker
+# =========================
+class CircuitBreaker:
+    """
+    closed -> open tras `failure_threshold` fallas seguidas; mientras está
+    abierto allow() es False y se falla de inmediato. Pasados `reset_timeout`
+    segundos queda half_open: deja pasar una sola llamada de prueba, que lo
+    cierra si sale bien o lo vuelve a abrir si falla.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe_at = 0.0
+            # Una prueba a la vez; si la prueba no reporta (p. ej. UpstreamBusy), se libera sola
+            if self.state == "half_open" and now - self._probe_at >= self.reset_timeout:
+                self._probe_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = "closed"
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self.trips += 1
+
+    def retry_after(self) -> float:
+        """Segundos hasta la próxima prueba (para Retry-After)."""
+        with self._lock:
+            if self.state != "open":
+                return 1.0
+            return max(1.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "trips": self.trips,
+                "rejected": self.rejected, "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout}
+
+
+# =========================
+# Control de admisión
+# =========================
+class Admission:
+    """Máximo de requests en curso; el resto se rechaza de inmediato (503) en vez de hacer cola."""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, int(limit))
+        self.inflight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_enter(self) -> bool:
+        with self._lock:
+            if self.inflight >= self.limit:
+                self.rejected += 1
+                return False
+            self.inflight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.inflight -= 1
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "inflight": self.inflight, "rejected": self.rejected}
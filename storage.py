@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import zlib
+import fcntl
+import sqlite3
+import threading
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
+
+# =========================
+# Caché LRU en memoria
+# =========================
+class LRUCache:
+    """Caché acotado por número de entradas (expulsa la menos usada), thread-safe."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = max(1, int(maxsize))
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+# =========================
+# SQLite local (compartido entre workers de gunicorn)
+# =========================
+class SQLiteBase:
+    """Conexión SQLite en modo WAL, una por hilo y por proceso (no se heredan por fork)."""
+
+    SCHEMA = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        pid = os.getpid()
+        c = getattr(self._local, "conn", None)
+        if c is None or getattr(self._local, "pid", None) != pid:
+            c = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.executescript(self.SCHEMA)
+            self._local.conn = c
+            self._local.pid = pid
+        return c
+
+
+# =========================
+# Anti-duplicados con TTL
+# =========================
+class TTLDedup:
+    """
+    Ids vistos con expiración, en memoria del proceso.
+    El TTL es fijo, así que el orden de inserción es el orden de expiración:
+    expirar es sacar por la izquierda de una cola (O(1) amortizado).
+    """
+
+    def __init__(self, ttl_sec: float):
+        self.ttl = ttl_sec
+        self._exp = {}          # {id: expire_ts}
+        self._order = deque()   # (expire_ts, id) en orden de inserción
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        order, exp = self._order, self._exp
+        while order and order[0][0] <= now:
+            ts, key = order.popleft()
+            if exp.get(key) == ts:
+                del exp[key]
+
+    def check_and_add(self, key: str) -> bool:
+        """True si `key` ya estaba vigente; si no, la registra y devuelve False."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if key in self._exp:
+                return True
+            ts = now + self.ttl
+            self._exp[key] = ts
+            self._order.append((ts, key))
+            return False
+
+    def forget(self, key: str):
+        with self._lock:
+            self._exp.pop(key, None)
+
+    def __len__(self):
+        return len(self._exp)
+
+
+class SQLiteDedup(SQLiteBase):
+    """Mismo contrato que TTLDedup, pero compartido por todos los procesos que usen el mismo archivo."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS wa_dedup (id TEXT PRIMARY KEY, exp REAL NOT NULL) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS wa_dedup_exp ON wa_dedup(exp);
+    """
+    PURGE_EVERY = 256
+
+    def __init__(self, path: str, ttl_sec: float):
+        super().__init__(path)
+        self.ttl = ttl_sec
+        self._ops = 0
+
+    def check_and_add(self, key: str) -> bool:
+        now = time.time()
+        c = self._conn()
+        # Un solo statement atómico: inserta, o renueva si la fila ya expiró
+        cur = c.execute(
+            "INSERT INTO wa_dedup(id, exp) VALUES (?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET exp = excluded.exp WHERE wa_dedup.exp <= ?",
+            (key, now + self.ttl, now),
+        )
+        self._ops += 1
+        if self._ops % self.PURGE_EVERY == 0:
+            c.execute("DELETE FROM wa_dedup WHERE exp <= ?", (now,))
+        return cur.rowcount == 0
+
+    def forget(self, key: str):
+        self._conn().execute("DELETE FROM wa_dedup WHERE id = ?", (key,))
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM wa_dedup WHERE exp > ?", (time.time(),)).fetchone()[0]
+
+
+# =========================
+# Sesiones de conversación
+# =========================
+class KeyedLocks:
+    """
+    Un threading.Lock por clave, con conteo de usuarios para no acumular locks.
+    Un turno retiene el lock de su sesión durante la llamada al LLM: con locks
+    por franja (hash % N) bloqueaba también a otras sesiones de la franja.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def acquire(self, key: str):
+        with self._guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            entry[0].acquire()
+        except BaseException:
+            self._forget(key, entry)
+            raise
+
+    def release(self, key: str):
+        """Puede llamarse desde otro hilo que el que tomó el lock."""
+        with self._guard:
+            entry = self._locks[key]
+        entry[0].release()
+        self._forget(key, entry)
+
+    def _forget(self, key: str, entry):
+        with self._guard:
+            entry[1] -= 1
+            if not entry[1]:
+                self._locks.pop(key, None)
+
+    @contextmanager
+    def hold(self, key: str):
+        self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class MemorySessionStore:
+    """
+    Sesiones en un dict del proceso (comportamiento histórico).
+    transaction() = acquire + get + put + release; el turno async usa esas
+    piezas por separado para retener el lock mientras espera al LLM.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._data = {}
+        self._locks = KeyedLocks()
+
+    def get(self, session_id: str) -> dict:
+        s = self._data.get(session_id)
+        if s is None:
+            s = self._data.setdefault(session_id, self.factory())
+        return s
+
+    def put(self, session_id: str, session: dict):
+        self._data[session_id] = session
+
+    def acquire(self, session_id: str):
+        self._locks.acquire(session_id)
+
+    def release(self, session_id: str):
+        self._locks.release(session_id)
+
+    @contextmanager
+    def transaction(self, session_id: str):
+        """Lectura-modificación-escritura exclusiva de una sesión."""
+        with self._locks.hold(session_id):
+            yield self.get(session_id)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteSessionStore(SQLiteBase):
+    """
+    Sesiones serializadas en SQLite (WAL): sobreviven reinicios y se comparten
+    entre workers. transaction() toma un lock por sesión válido entre hilos
+    (KeyedLocks) y procesos (lockf sobre el byte crc32(id) del archivo .lock;
+    dos sesiones solo chocan si coincide el crc32), lee, entrega el dict y lo
+    guarda al salir sin error.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated);
+    """
+    PURGE_EVERY = 512
+
+    def __init__(self, path: str, factory, ttl_sec: float = 30 * 86400):
+        super().__init__(path)
+        self.factory = factory
+        self.ttl = ttl_sec
+        self._thread_locks = KeyedLocks()
+        self._fd_lock = threading.Lock()
+        self._lock_fd = None
+        self._lock_pid = None
+        self._ops = 0
+
+    def _lockfile(self):
+        pid = os.getpid()
+        if self._lock_pid != pid:
+            with self._fd_lock:
+                if self._lock_pid != pid:
+                    self._lock_fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+                    self._lock_pid = pid
+        return self._lock_fd
+
+    def get(self, session_id: str) -> dict:
+        row = self._conn().execute("SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else self.factory()
+
+    def put(self, session_id: str, session: dict):
+        now = time.time()
+        c = self._conn()
+        c.execute(
+            "INSERT INTO sessions(id, data, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+            (session_id, json.dumps(session, ensure_ascii=False), now),
+        )
+        self._ops += 1
+        if self.ttl and self._ops % self.PURGE_EVERY == 0:
+            c.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+
+    def acquire(self, session_id: str):
+        """Lock exclusivo de la sesión entre hilos y procesos (bloquea hasta tenerlo)."""
+        self._thread_locks.acquire(session_id)
+        try:
+            fcntl.lockf(self._lockfile(), fcntl.LOCK_EX, 1, zlib.crc32(session_id.encode("utf-8")))
+        except BaseException:
+            self._thread_locks.release(session_id)
+            raise
+
+    def release(self, session_id: str):
+        try:
+            fcntl.lockf(self._lockfile(), fcntl.LOCK_UN, 1, zlib.crc32(session_id.encode("utf-8")))
+        finally:
+            self._thread_locks.release(session_id)
+
+    @contextmanager
+    def transaction(self, session_id: str):
+        self.acquire(session_id)
+        try:
+            session = self.get(session_id)
+            yield session
+            self.put(session_id, session)
+        finally:
+            self.release(session_id)
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
@@ -0,0 +1,289 @@
+import time
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from calendar_mirror import CalendarMirror, IntervalIndex
+
+TZ = ZoneInfo("America/Santiago")
+
+
+def event(ev_id, start, minutes=30, summary="Llamada con Ana", status="confirmed"):
+    end = start + timedelta(minutes=minutes)
+    return {"id": ev_id, "summary": summary, "status": status,
+            "start": {"dateTime": start.isoformat()}, "end": {"dateTime": end.isoformat()}}
+
+
+class _Resp(dict):
+    def __init__(self, status):
+        super().__init__()
+        self.status = status
+        self.reason = "Gone"
+
+
+class FakeCalendar:
+    """events.list / events.watch en memoria: páginas, syncToken y errores a pedido."""
+
+    def __init__(self, events=(), page_size=2500):
+        self.events = {ev["id"]: ev for ev in events}
+        self.changes = []
+        self.page_size = page_size
+        self.calls = []
+        self.fail = None
+        self.expired = False
+        self.watched = []
+        self.gate = None
+        self.gate_full = None
+
+    def list(self, **kw):
+        self.calls.append(kw)
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.gate_full is not None and not kw.get("syncToken"):
+            self.gate_full.wait(5)
+        if self.fail is not None:
+            raise self.fail
+        if kw.get("syncToken"):
+            if self.expired:
+                raise HttpError(_Resp(410), b"sync token expired")
+            items, self.changes = self.changes, []
+        else:
+            time_min = datetime.fromisoformat(kw["timeMin"])
+            items = [ev for ev in self.events.values()
+                     if datetime.fromisoformat(ev["end"]["dateTime"]) > time_min]
+        offset = int(kw.get("pageToken") or 0)
+        page = items[offset:offset + self.page_size]
+        resp = {"items": page}
+        if offset + self.page_size < len(items):
+            resp["nextPageToken"] = str(offset + self.page_size)
+        else:
+            resp["nextSyncToken"] = f"tok{len(self.calls)}"
+        return resp
+
+    def watch(self, **kw):
+        self.watched.append(kw)
+        return {"id": kw["body"]["id"], "resourceId": "r1"}
+
+    def change(self, ev):
+        if ev.get("status") != "cancelled":
+            self.events[ev["id"]] = ev
+        else:
+            self.events.pop(ev["id"], None)
+        self.changes.append(ev)
+
+
+def mirror(cal, **kw):
+    kw.setdefault("max_age_sec", 60)
+    return CalendarMirror(cal.list, "cal@test", "America/Santiago", watch_events=cal.watch, **kw)
+
+
+def now():
+    return datetime.now(TZ).replace(second=0, microsecond=0)
+
+
+def wait_refresh(m):
+    for _ in range(500):
+        if m._refreshing is None:
+            return
+        time.sleep(0.01)
+    raise AssertionError("el refresco en segundo plano no terminó")
+
+
+def test_full_sync_is_bounded_to_the_window():
+    base = now()
+    cal = FakeCalendar([event("old", base - timedelta(days=90)), event("recent", base - timedelta(days=2)),
+                        event("next", base + timedelta(days=1))])
+    m = mirror(cal, past_days=30)
+    m.sync()
+    assert "timeMin" in cal.calls[0]
+    time_min = datetime.fromisoformat(cal.calls[0]["timeMin"])
+    assert base - timedelta(days=31) < time_min < base - timedelta(days=29)
+    assert m.get("old") is None
+    assert m.get("recent") and m.get("next")
+    assert m.stats()["full_syncs"] == 1
+
+
+def test_pages_and_queries():
+    base = now() + timedelta(days=1)
+    cal = FakeCalendar([event(f"e{i}", base + timedelta(hours=i)) for i in range(5)], page_size=2)
+    m = mirror(cal)
+    m.sync()
+    assert len(cal.calls) == 3
+    assert m.stats()["events"] == 5
+    assert [e["id"] for e in m.overlapping(base + timedelta(minutes=15), base + timedelta(hours=1, minutes=15))] \
+        == ["e0", "e1"]
+    assert m.overlapping(base, base + timedelta(minutes=30), exclude_id="e0") == []
+    assert [e["id"] for e in m.find_near(base + timedelta(hours=2, minutes=10))] == ["e2"]
+
+
+def test_incremental_sync_applies_changes_and_cancellations():
+    base = now() + timedelta(days=1)
+    cal = FakeCalendar([event("a", base), event("b", base + timedelta(hours=1))])
+    m = mirror(cal)
+    m.sync()
+    cal.change(event("b", base + timedelta(hours=3)))
+    cal.change({"id": "a", "status": "cancelled"})
+    cal.change(event("c", base + timedelta(hours=5)))
+    m.sync()
+    assert cal.calls[-1]["syncToken"] == "tok1"
+    assert "timeMin" not in cal.calls[-1]
+    assert m.get("a") is None
+    assert m.find_near(base + timedelta(hours=3))[0]["id"] == "b"
+    assert m.get("c")
+    assert m.stats()["incremental_syncs"] == 1
+
+
+def test_incremental_change_outside_the_window_is_dropped():
+    base = now()
+    cal = FakeCalendar([event("a", base + timedelta(days=1))])
+    m = mirror(cal, past_days=30)
+    m.sync()
+    cal.change(event("a", base - timedelta(days=60)))
+    m.sync()
+    assert m.get("a") is None
+    assert not m.covers(base - timedelta(days=60))
+    assert m.covers(base - timedelta(days=1))
+
+
+def test_expired_sync_token_reloads_everything():
+    base = now() + timedelta(days=1)
+    cal = FakeCalendar([event("a", base)])
+    m = mirror(cal)
+    m.sync()
+    cal.expired = True
+    cal.events = {"z": event("z", base + timedelta(hours=2))}
+    m.sync()
+    assert "timeMin" in cal.calls[-1]
+    assert m.get("a") is None and m.get("z")
+    assert m.stats()["full_syncs"] == 2
+
+
+def test_ensure_fresh_does_not_call_the_api_while_fresh():
+    cal = FakeCalendar([event("a", now() + timedelta(days=1))])
+    m = mirror(cal)
+    assert m.ensure_fresh()
+    assert m.ensure_fresh()
+    assert len(cal.calls) == 1
+
+
+def test_stale_copy_is_refreshed_in_the_background():
+    base = now() + timedelta(days=1)
+    cal = FakeCalendar([event("a", base)])
+    m = mirror(cal, max_age_sec=60, max_stale_sec=600)
+    m.sync()
+    m._synced_at -= 120
+    cal.change(event("b", base + timedelta(hours=1)))
+    cal.gate = threading.Event()
+    assert m.ensure_fresh()            # no espera al API: responde con la copia que hay
+    assert m.get("b") is None
+    assert m.ensure_fresh()            # un solo refresco en curso
+    cal.gate.set()
+    wait_refresh(m)
+    assert m.get("b")
+    assert len(cal.calls) == 2
+
+
+def test_failed_sync_falls_back_to_the_caller():
+    cal = FakeCalendar([event("a", now() + timedelta(days=1))])
+    cal.fail = TimeoutError("timed out")
+    m = mirror(cal)
+    assert m.ensure_fresh() is False
+    assert m.stats()["failed_syncs"] == 1
+    assert "TimeoutError" in m.stats()["last_error"]
+    cal.fail = None
+    assert m.ensure_fresh()
+    assert m.get("a") and m.stats()["last_error"] is None
+
+
+def test_failed_background_refresh_keeps_the_copy():
+    cal = FakeCalendar([event("a", now() + timedelta(days=1))])
+    m = mirror(cal, max_age_sec=60, max_stale_sec=600)
+    m.sync()
+    m._synced_at -= 120
+    cal.fail = TimeoutError("timed out")
+    assert m.ensure_fresh()
+    wait_refresh(m)
+    assert m.get("a")
+    assert m.stats()["failed_syncs"] == 1
+    m._synced_at -= 1000               # ya demasiado vieja para usarla
+    assert m.ensure_fresh() is False
+
+
+def test_sync_error_other_than_410_propagates():
+    cal = FakeCalendar([event("a", now() + timedelta(days=1))])
+    m = mirror(cal)
+    m.sync()
+    cal.fail = HttpError(_Resp(500), b"backend error")
+    with pytest.raises(HttpError):
+        m.sync()
+
+
+def test_watch_registers_a_web_hook():
+    cal = FakeCalendar()
+    m = mirror(cal)
+    out = m.watch("https://example.cl/calendar/notify", token="t0k", ttl_sec=3600)
+    body = cal.watched[0]["body"]
+    assert cal.watched[0]["calendarId"] == "cal@test"
+    assert body["type"] == "web_hook" and body["token"] == "t0k" and body["params"] == {"ttl": "3600"}
+    assert out["id"] == body["id"]
+
+
+def test_interval_index():
+    idx = IntervalIndex()
+    idx.add("a", 0, 100)
+    idx.add("b", 50, 60)
+    idx.add("c", 200, 210)
+    assert sorted(idx.overlapping(55, 56)) == ["a", "b"]
+    assert idx.overlapping(100, 200) == []
+    assert idx.starting_between(40, 200) == ["b", "c"]
+    idx.add("a", 300, 310)
+    assert idx.overlapping(0, 40) == []
+    idx.remove("c")
+    assert len(idx) == 2
+
+
+def test_local_writes_during_a_full_resync_are_kept():
+    base = now() + timedelta(days=1)
+    cal = FakeCalendar([event("a", base)])
+    m = mirror(cal)
+    m.sync()
+    cal.expired = True
+    cal.gate_full = threading.Event()
+    t = threading.Thread(target=m.sync)
+    t.start()
+    assert wait_for_calls(cal, 3)      # incremental (410) + recarga completa, en vuelo
+    m.apply(event("mine", base + timedelta(hours=2)))
+    m.remove("a")
+    assert m.get("mine")               # la copia anterior sigue respondiendo
+    cal.gate_full.set()
+    t.join()
+    assert m.stats()["full_syncs"] == 2
+    assert m.get("mine") and m.overlapping(base + timedelta(hours=2), base + timedelta(hours=2, minutes=30))
+    assert m.get("a") is None          # la respuesta (anterior al borrado) no lo revive
+
+
+def test_all_day_events_block_the_day_unless_marked_free():
+    day = (now() + timedelta(days=3)).date()
+    busy = {"id": "viaje", "summary": "Viaje", "start": {"date": day.isoformat()},
+            "end": {"date": (day + timedelta(days=1)).isoformat()}}
+    free = {**busy, "id": "feriado", "summary": "Feriado", "transparency": "transparent"}
+    cal = FakeCalendar()
+    m = mirror(cal)
+    m.apply(free)
+    at_ten = datetime(day.year, day.month, day.day, 10, 0, tzinfo=TZ)
+    assert m.get("feriado") and m.overlapping(at_ten, at_ten + timedelta(minutes=30)) == []
+    m.apply(busy)
+    assert [e["id"] for e in m.overlapping(at_ten, at_ten + timedelta(minutes=30))] == ["viaje"]
+    m.apply({**busy, "transparency": "transparent"})
+    assert m.overlapping(at_ten, at_ten + timedelta(minutes=30)) == []
+
+
+def wait_for_calls(cal, n):
+    for _ in range(500):
+        if len(cal.calls) >= n:
+            return True
+        time.sleep(0.01)
+    return False
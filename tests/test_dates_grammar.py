@@ -0,0 +1,96 @@
+"""
+La gramática rápida (dates._fast_parse) debe dar lo mismo que dateparser
+donde dateparser entiende el texto. Diferencias buscadas:
+  - "el lunes ...", "pasado mañana ..." y "... a mediodía": dateparser
+    devuelve None; la gramática los resuelve (día de semana -> el próximo,
+    nunca hoy).
+  - AAAA-MM-DD: con DATE_ORDER=DMY dateparser lo lee como año-día-mes.
+Las horas base son fijas para que el resultado no dependa del día en que corre.
+"""
+import re
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import dates
+from bench.bench_dates_grammar import corpus, dp_parse
+
+TZ = ZoneInfo(dates.TIMEZONE)
+
+BASES = [datetime(2026, 10, 17, h, mi, tzinfo=TZ) for h, mi in [(0, 0), (2, 0), (9, 30), (23, 59)]] + [
+    datetime(2026, 10, 19, 10, 0, tzinfo=TZ),   # lunes
+    datetime(2026, 12, 31, 22, 0, tzinfo=TZ),   # cambio de año
+    datetime(2028, 2, 28, 10, 0, tzinfo=TZ),    # año bisiesto
+]
+
+GRAMMAR_ONLY_RE = re.compile(r"^(el\s+\w+|pasado\s+ma[ñn]ana)\s|\bmediod[ií]a$")
+
+
+@pytest.mark.parametrize("now", BASES, ids=lambda d: d.strftime("%Y-%m-%d_%H%M"))
+def test_fast_grammar_matches_dateparser(now):
+    checked = 0
+    for raw in corpus():
+        txt = dates._normalize_text(raw)
+        fast = dates._fast_parse(txt, now)
+        if fast is None or dates._FAST_ISO_RE.match(txt):
+            continue
+        dp = dp_parse(txt, now)
+        if dp is None:
+            assert GRAMMAR_ONLY_RE.search(txt), f"solo la gramática entiende {raw!r}"
+            continue
+        assert fast == dp, raw
+        checked += 1
+    assert checked > 30
+
+
+@pytest.mark.parametrize("raw, now, expected", [
+    ("el lunes a las 9", datetime(2026, 10, 17, 9, 30, tzinfo=TZ), datetime(2026, 10, 19, 9, 0, tzinfo=TZ)),
+    ("el lunes a las 9", datetime(2026, 10, 19, 8, 0, tzinfo=TZ), datetime(2026, 10, 26, 9, 0, tzinfo=TZ)),
+    ("el viernes 16:30", datetime(2026, 12, 31, 22, 0, tzinfo=TZ), datetime(2027, 1, 1, 16, 30, tzinfo=TZ)),
+    ("pasado mañana a las 10", datetime(2026, 10, 17, 9, 30, tzinfo=TZ), datetime(2026, 10, 19, 10, 0, tzinfo=TZ)),
+    ("pasado manana a mediodía", datetime(2026, 12, 31, 22, 0, tzinfo=TZ), datetime(2027, 1, 2, 12, 0, tzinfo=TZ)),
+    ("mañana a mediodía", datetime(2028, 2, 28, 10, 0, tzinfo=TZ), datetime(2028, 2, 29, 12, 0, tzinfo=TZ)),
+])
+def test_forms_dateparser_does_not_understand(raw, now, expected):
+    txt = dates._normalize_text(raw)
+    assert dp_parse(txt, now) is None
+    assert dates._fast_parse(txt, now) == expected
+    assert dates._parse_uncached({"datetime_text": raw}, now) == expected
+
+
+def test_iso_dates_are_year_month_day():
+    now = datetime(2026, 10, 17, 9, 30, tzinfo=TZ)
+    txt = "2027-08-12 13:00"
+    assert dates._fast_parse(txt, now) == datetime(2027, 8, 12, 13, 0, tzinfo=TZ)
+    assert dp_parse(txt, now) != datetime(2027, 8, 12, 13, 0, tzinfo=TZ)
+
+
+def test_unknown_forms_fall_back_to_dateparser():
+    now = datetime(2026, 10, 17, 9, 30, tzinfo=TZ)
+    for txt in ("3 de octubre 10:00", "12/08 25:00", "mañana 24:00"):
+        assert dates._fast_parse(txt, now) is None
+
+
+def test_dateparser_warms_up_once_and_concurrent_callers_wait(monkeypatch):
+    import threading
+    import dateparser
+
+    calls = []
+    real_parse = dateparser.parse
+
+    def counting_parse(*args, **kwargs):
+        calls.append(threading.get_ident())
+        return real_parse(*args, **kwargs)
+
+    monkeypatch.setattr(dateparser, "parse", counting_parse)
+    monkeypatch.setattr(dates, "_dateparser", None)
+    got = []
+    threads = [threading.Thread(target=lambda: got.append(dates._dp())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # Los tres parseos de calentamiento, en un solo hilo; nadie recibió el módulo sin calentar
+    assert len(calls) == 3 and len(set(calls)) == 1
+    assert got == [dateparser] * 8
@@ -0,0 +1,54 @@
+import os
+import json
+
+import pytest
+
+# Sin red: clientes perezosos que nunca se construyen (igual que bench/run.py)
+for key, value in {
+    "LAZY_INIT": "1",
+    "GOOGLE_SERVICE_ACCOUNT_JSON": json.dumps({"client_email": "test@example.iam.gserviceaccount.com"}),
+    "GOOGLE_CALENDAR_ID": "test@group.calendar.google.com",
+    "OPENAI_API_KEY": "sk-test",
+    "TRACE_SAMPLE_RATE": "0",
+    "CAL_MIRROR": "0",
+    "WA_DEDUP_BACKEND": "memory",
+    "SESSION_BACKEND": "memory",
+}.items():
+    os.environ.setdefault(key, value)
+
+import app as agendador  # noqa: E402
+
+
+def confirming_session():
+    cand = {"nombre": "Ana", "datetime_text": "12/01/2031 10:00", "telefono": "+56911112222",
+            "email": "ana@example.cl"}
+    return {"slots": dict(cand), "awaiting_confirm": True, "candidate": cand}
+
+
+def plan_for(msg, session):
+    found, residual = agendador.extract_slots_fast(msg)
+    return agendador.fast_plan(session, msg, found, residual)
+
+
+@pytest.mark.parametrize("msg", ["sí", "Si", "ok", "sí, gracias", "ok por favor", "confirmo"])
+def test_plain_yes_books_without_llm(msg):
+    plan = plan_for(msg, confirming_session())
+    assert plan and plan["next_action"] == "create_event"
+
+
+@pytest.mark.parametrize("msg", ["si no puedo", "ok espera", "sí, pero mejor", "si, el martes", "no", "mejor no"])
+def test_yes_with_a_catch_goes_to_the_llm(msg):
+    assert plan_for(msg, confirming_session()) is None
+
+
+@pytest.mark.parametrize("msg", ["Juan Pérez 987654321", "Pedro +56911112222 13/01/2027 10:00"])
+def test_leftover_words_go_to_the_llm(msg):
+    session = {"slots": {}, "awaiting_confirm": False}
+    assert plan_for(msg, session) is None
+
+
+@pytest.mark.parametrize("msg", ["mi correo es ana@example.cl", "mi número es el +56911112222, gracias"])
+def test_only_filler_takes_the_fast_path(msg):
+    session = {"slots": {"nombre": "Ana"}, "awaiting_confirm": False}
+    plan = plan_for(msg, session)
+    assert plan and plan["next_action"] == "ask_missing"
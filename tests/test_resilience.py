@@ -0,0 +1,44 @@
+import pytest
+
+import resilience
+from resilience import Upstream, UpstreamBusy
+
+
+class QuotaError(Exception):
+    def __init__(self, retry_after):
+        super().__init__("429")
+        self.retry_after = retry_after
+
+
+def upstream(**kw):
+    return Upstream("test", rate=1000, burst=1000, classify=lambda e: (429, e.retry_after), **kw)
+
+
+def failing(retry_after, times=1):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= times:
+            raise QuotaError(retry_after)
+        return "ok"
+    return fn, calls
+
+
+def test_retry_after_longer_than_the_cap_is_not_retried_early(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(resilience.time, "sleep", sleeps.append)
+    fn, calls = failing("120")
+    with pytest.raises(UpstreamBusy) as exc:
+        upstream(backoff_cap=20).call(fn)
+    assert exc.value.retry_after == 120
+    assert len(calls) == 1 and sleeps == []
+
+
+def test_short_retry_after_is_honored(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(resilience.time, "sleep", sleeps.append)
+    fn, calls = failing("3")
+    assert upstream(backoff_cap=20).call(fn) == "ok"
+    assert len(calls) == 2
+    assert max(sleeps) >= 3
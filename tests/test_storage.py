@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+
+from storage import KeyedLocks, MemorySessionStore, SQLiteSessionStore
+
+
+def new_session():
+    return {"slots": {}, "turns": 0}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteSessionStore(str(tmp_path / "state.db"), new_session)
+    return MemorySessionStore(new_session)
+
+
+def test_other_sessions_are_not_blocked_by_a_long_turn(store):
+    inside, release = threading.Event(), threading.Event()
+
+    def long_turn():
+        with store.transaction("a") as s:
+            inside.set()
+            release.wait(5)
+            s["turns"] += 1
+
+    t = threading.Thread(target=long_turn)
+    t.start()
+    assert inside.wait(5)
+    done = threading.Event()
+
+    def other():
+        with store.transaction("b") as s:
+            s["turns"] += 1
+        done.set()
+
+    threading.Thread(target=other).start()
+    # Con locks por franja, "b" esperaba a "a" si caían en la misma franja
+    assert done.wait(2)
+    release.set()
+    t.join()
+    assert store.get("a")["turns"] == 1 and store.get("b")["turns"] == 1
+
+
+def test_same_session_is_serialized(store):
+    def turn():
+        for _ in range(50):
+            with store.transaction("a") as s:
+                s["turns"] += 1
+
+    threads = [threading.Thread(target=turn) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert store.get("a")["turns"] == 200
+
+
+def test_sqlite_session_is_not_saved_when_the_turn_fails(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "state.db"), new_session)
+    with store.transaction("a") as s:
+        s["turns"] = 1
+    with pytest.raises(RuntimeError):
+        with store.transaction("a") as s:
+            s["turns"] = 2
+            raise RuntimeError("boom")
+    assert store.get("a")["turns"] == 1
+
+
+def test_keyed_locks_are_released():
+    locks = KeyedLocks()
+    with locks.hold("a"):
+        with locks.hold("b"):
+            assert len(locks) == 2
+    assert len(locks) == 0
+
+
+def test_held_session_blocks_transactions_until_released(store):
+    # El turno async toma el lock en un hilo de I/O y lo suelta desde el loop
+    t = threading.Thread(target=store.acquire, args=("a",))
+    t.start()
+    t.join()
+    session = store.get("a")
+    entered = threading.Event()
+
+    def other_turn():
+        with store.transaction("a") as s:
+            entered.set()
+            s["turns"] += 1
+
+    threading.Thread(target=other_turn).start()
+    assert not entered.wait(0.2)
+    session["turns"] = 10
+    store.put("a", session)
+    store.release("a")
+    assert entered.wait(5)
+    assert wait_turns(store, "a", 11)
+
+
+def wait_turns(store, session_id, expected):
+    for _ in range(500):
+        if store.get(session_id)["turns"] == expected:
+            return True
+        threading.Event().wait(0.01)
+    return False
@@ -0,0 +1,49 @@
+import threading
+
+from wa_sender import WhatsAppSender
+
+
+class RecordingSender(WhatsAppSender):
+    def __init__(self, **kw):
+        super().__init__("token", **kw)
+        self.gate = threading.Event()
+        self.log = []
+
+    def send(self, phone_id, body):
+        self.gate.wait(5)
+        self.log.append((body["to"], body["text"], threading.current_thread().name))
+        return {"status": 200, "latency_ms": 1.0}
+
+
+def msg(to, text):
+    return {"to": to, "text": text}
+
+
+def wait_for(cond):
+    for _ in range(500):
+        if cond():
+            return True
+        threading.Event().wait(0.01)
+    return False
+
+
+def test_full_queue_keeps_per_recipient_order():
+    s = RecordingSender(workers=1, max_queue=1)
+    s.send_all("p", "569", [msg("569", "confirmación")])   # ocupa la cola
+    s.send_all("p", "569", [msg("569", ".ics")])           # cola llena: va detrás, no en línea
+    assert s._pool.pending_for("569") == 2
+    s.gate.set()
+    assert wait_for(lambda: len(s.log) == 2)
+    assert [text for _to, text, _t in s.log] == ["confirmación", ".ics"]
+
+
+def test_full_queue_sends_inline_for_a_recipient_with_nothing_pending():
+    s = RecordingSender(workers=1, max_queue=1)
+    s.send_all("p", "569", [msg("569", "uno")])
+    t = threading.Thread(target=s.send_all, args=("p", "570", [msg("570", "otro")]), name="turno-570")
+    t.start()
+    s.gate.set()
+    t.join()
+    assert wait_for(lambda: len(s.log) == 2)
+    assert ("570", "otro", "turno-570") in s.log
+    assert s._pool.pending_for("570") == 0
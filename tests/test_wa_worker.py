@@ -0,0 +1,94 @@
+import time
+import asyncio
+import threading
+
+from wa_worker import AsyncMailbox, CoalescingMailbox
+
+
+def wait_for(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if cond():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def test_burst_from_one_sender_is_one_turn():
+    turns = []
+    box = CoalescingMailbox(lambda key, items: turns.append((key, items)), window_ms=30, max_ms=200)
+    for i in range(3):
+        assert box.submit("569", i)
+    assert box.submit("570", "x")
+    assert wait_for(lambda: len(turns) == 2)
+    assert sorted(turns) == [("569", [0, 1, 2]), ("570", ["x"])]
+    assert box.stats()["turns_saved"] == 2
+
+
+def test_rejected_dispatch_is_requeued_not_lost():
+    turns = []
+    box = CoalescingMailbox(lambda key, items: turns.append((key, items)), window_ms=20, max_ms=100)
+    real_submit, refusals = box.pool.submit, [2]
+
+    def flaky_submit(key, *args):
+        if refusals[0]:
+            refusals[0] -= 1
+            return False
+        return real_submit(key, *args)
+
+    box.pool.submit = flaky_submit
+    box.submit("569", "a")
+    box.submit("569", "b")
+    assert wait_for(lambda: turns)
+    assert turns == [("569", ["a", "b"])]
+    stats = box.stats()
+    assert stats["requeued"] == 2 and stats["turns"] == 1 and stats["buffered"] == 0
+
+
+def test_requeued_messages_stay_ahead_of_newer_ones():
+    turns, gate = [], threading.Event()
+    box = CoalescingMailbox(lambda key, items: turns.append(items), window_ms=20, max_ms=100)
+    real_submit = box.pool.submit
+
+    def blocked_submit(key, *args):
+        if not gate.is_set():
+            gate.set()
+            box.submit(key, "c")   # llega mientras el despacho de ["a", "b"] se rechaza
+            return False
+        return real_submit(key, *args)
+
+    box.pool.submit = blocked_submit
+    box.submit("569", "a")
+    box.submit("569", "b")
+    assert wait_for(lambda: turns)
+    assert turns == [["a", "b", "c"]]
+
+
+def test_async_mailbox_counts_each_pending_message_once():
+    async def scenario():
+        release = asyncio.Event()
+        seen = []
+
+        async def handler(key, items):
+            seen.append(len(box))
+            await release.wait()
+
+        tasks = set()
+
+        def spawn(coro):
+            task = asyncio.ensure_future(coro)
+            tasks.add(task)
+
+        box = AsyncMailbox(handler, window_ms=10, max_ms=50, spawn=spawn)
+        for i in range(3):
+            box.submit("569", i)
+        assert len(box) == 3
+        await asyncio.sleep(0.05)
+        assert seen == [3]          # en el turno: siguen contando, una vez
+        box.submit("569", 3)
+        assert len(box) == 4
+        release.set()
+        await asyncio.gather(*tasks)
+        assert len(box) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,236 @@
+"""
+Trazas por turno: un árbol de spans (nombre, duración, atributos) por webhook
+o turno de conversación, escrito como una línea JSON al terminar la raíz.
+
+    with tracing.trace("wa.turn", sample_key=wamid, session_id=sid):
+        with tracing.span("calendar.events.insert"):
+            ...
+        tracing.annotate(event_id=ev_id)
+
+El span actual vive en un ContextVar, así que sigue solo a las corrutinas;
+para pasar a otro hilo se usa contextvars.copy_context() o attach(span).
+Fuera de una traza muestreada span() y annotate() no hacen nada. Si un hijo
+termina después que su raíz (p. ej. un envío encolado), se escribe aparte
+con el mismo trace_id y su parent_id.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import queue
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar("tracing_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent", "root", "attrs", "children",
+                 "t0", "start", "ms", "error", "_done", "_emitted")
+
+    def __init__(self, name: str, parent=None, attrs=None, trace_id: str | None = None):
+        self.name = name
+        self.parent = parent
+        self.root = parent.root if parent else self
+        self.trace_id = parent.trace_id if parent else (trace_id or f"{random.getrandbits(64):016x}")
+        self.span_id = f"{random.getrandbits(32):08x}"
+        self.attrs = dict(attrs or {})
+        self.children = []
+        self.t0 = time.perf_counter()
+        self.start = time.time()
+        self.ms = None
+        self.error = None
+        self._done = False
+        self._emitted = False
+        if parent:
+            parent.children.append(self)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self, error: BaseException | None = None):
+        if self._done:
+            return
+        self._done = True
+        self.ms = round((time.perf_counter() - self.t0) * 1000, 2)
+        if error is not None:
+            self.error = repr(error)
+        if self.parent is None:
+            self._emitted = True
+            _write(self.as_dict())
+        elif self.root._emitted:
+            # La raíz ya se escribió: este span sale solo, enlazado por ids
+            _write({**self.as_dict(), "trace_id": self.trace_id, "parent_id": self.parent.span_id})
+
+    def as_dict(self) -> dict:
+        d = {"name": self.name, "span_id": self.span_id, "ms": self.ms,
+             "start": round(self.start, 3)}
+        if self.parent is None:
+            d = {"trace_id": self.trace_id, "pid": os.getpid(), **d}
+        if self.attrs:
+            d["attrs"] = self.attrs
+        if self.error:
+            d["error"] = self.error
+        done = [c.as_dict() for c in self.children if c._done]
+        if done:
+            d["spans"] = done
+        return d
+
+
+# =========================
+# Configuración y escritura
+# =========================
+class JsonLineWriter:
+    """
+    Cola acotada + un hilo por proceso que escribe en `path` (o stdout). write()
+    nunca bloquea: con la cola llena el registro se descarta y se cuenta.
+    """
+
+    def __init__(self, path: str = "", max_queue: int = 10000, flush_sec: float = 1.0):
+        self.path = path
+        self.flush_sec = flush_sec
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pid = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+
+    def _ensure_started(self):
+        # Tras el fork de gunicorn el hilo del padre no existe en el hijo
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            threading.Thread(target=self._run, name="trace-writer", daemon=True).start()
+
+    def write(self, record: dict):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        out = open(self.path, "a", encoding="utf-8") if self.path else sys.stdout
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_sec
+            while len(batch) < 500:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                out.write("".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in batch))
+                out.flush()
+                self.written += len(batch)
+            except (OSError, ValueError):
+                self.dropped += len(batch)
+
+    def stats(self) -> dict:
+        return {"path": self.path or "stdout", "pending": self._queue.qsize(),
+                "written": self.written, "dropped": self.dropped}
+
+
+_config = {"sample_rate": 0.0, "writer": None}
+
+
+def configure(sample_rate: float, writer: JsonLineWriter):
+    _config["sample_rate"] = max(0.0, min(1.0, float(sample_rate)))
+    _config["writer"] = writer
+
+
+def _write(record: dict):
+    writer = _config["writer"]
+    if writer is not None:
+        writer.write(record)
+
+
+def sampled(sample_key=None) -> bool:
+    """Con `sample_key` la decisión es determinista (el mismo wamid se muestrea en el webhook y en el turno)."""
+    rate = _config["sample_rate"]
+    if rate >= 1.0:
+        return True
+    if rate <= 0.0:
+        return False
+    if sample_key is None:
+        return random.random() < rate
+    return zlib.crc32(str(sample_key).encode("utf-8")) / 0xFFFFFFFF < rate
+
+
+# =========================
+# API
+# =========================
+@contextmanager
+def _activate(span: Span):
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.end(error=e)
+        raise
+    finally:
+        _current.reset(token)
+        span.end()
+
+
+@contextmanager
+def _noop():
+    yield None
+
+
+def trace(name: str, sample_key=None, force: bool = False, **attrs):
+    """
+    Span raíz de una traza nueva (o hijo, si ya hay una en curso). Se registra
+    si `force` o si cae en la muestra; si no, el bloque corre sin trazas.
+    """
+    parent = _current.get()
+    if parent is not None:
+        return _activate(Span(name, parent, attrs))
+    if not (force or sampled(sample_key)):
+        return _noop()
+    return _activate(Span(name, None, attrs))
+
+
+def span(name: str, **attrs):
+    """Span hijo del actual; no hace nada fuera de una traza."""
+    parent = _current.get()
+    if parent is None:
+        return _noop()
+    return _activate(Span(name, parent, attrs))
+
+
+def start(name: str, **attrs) -> Span | None:
+    """Span hijo que se cierra a mano con .end() (no pasa a ser el actual)."""
+    parent = _current.get()
+    return Span(name, parent, attrs) if parent is not None else None
+
+
+def annotate(**attrs):
+    """Agrega atributos (ids de correlación, resultados) al span actual."""
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def current() -> Span | None:
+    return _current.get()
+
+
+@contextmanager
+def attach(parent: Span | None):
+    """Continúa en este hilo la traza de `parent` (capturado con current() en otro hilo)."""
+    if parent is None:
+        yield None
+        return
+    token = _current.set(parent)
+    try:
+        yield parent
+    finally:
+        _current.reset(token)
@@ -0,0 +1,131 @@
+import os
+import time
+import threading
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import tracing
+from wa_worker import KeyedWorkerPool
+
+GRAPH_URL = "https://graph.facebook.com/v20.0"
+
+
+class WhatsAppSender:
+    """
+    Envíos a la Graph API de WhatsApp con una Session compartida (keep-alive y
+    pool de conexiones). Los mensajes de un mismo destinatario salen en orden;
+    los de destinatarios distintos, en paralelo.
+    """
+
+    def __init__(self, token: str, workers: int = 4, pool_size: int = 10,
+                 timeout: float = 30, max_queue: int = 1000, debug: bool = False, upstream=None,
+                 on_send=None):
+        self.token = token
+        self.upstream = upstream  # resilience.Upstream opcional (límite de tasa + reintentos en 429)
+        self.on_send = on_send    # on_send(status | None, segundos) tras cada envío (métricas)
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.debug = debug
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._lat_ms = deque(maxlen=500)
+        self.sent = 0
+        self.errors = 0
+        self.max_ms = 0.0
+        self._pool = None
+        if workers > 0:
+            self._pool = KeyedWorkerPool(self._send_all_now, workers=workers, max_queue=max_queue,
+                                         name="wa-sender", on_error=self._on_error)
+
+    def _get_session(self):
+        # Una Session por proceso (no se comparten sockets a través del fork de gunicorn)
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    s = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size)
+                    s.mount("https://", adapter)
+                    s.headers.update({"Authorization": f"Bearer {self.token}",
+                                      "Content-Type": "application/json"})
+                    self._session = s
+                    self._pid = pid
+        return self._session
+
+    def send(self, phone_id: str, body: dict) -> dict:
+        """POST síncrono de un mensaje. Devuelve {status, latency_ms}."""
+        url = f"{GRAPH_URL}/{phone_id}/messages"
+        t0 = time.perf_counter()
+        sp = tracing.start("wa.send", to=body.get("to"), type=body.get("type", "text"))
+
+        def post():
+            return self._get_session().post(url, json=body, timeout=self.timeout)
+
+        try:
+            # Un envío no es idempotente: solo se reintenta ante 429
+            r = self.upstream.call(post, idempotent=False) if self.upstream else post()
+        except Exception as e:  # red, o sin cupo en el limitador (UpstreamBusy)
+            self._record((time.perf_counter() - t0) * 1000, ok=False)
+            if self.on_send:
+                self.on_send(None, time.perf_counter() - t0)
+            if sp:
+                sp.end(error=e)
+            return {"status": None, "latency_ms": None}
+        ms = (time.perf_counter() - t0) * 1000
+        self._record(ms, ok=r.ok)
+        if self.on_send:
+            self.on_send(r.status_code, ms / 1000)
+        if sp:
+            sp.set(status=r.status_code)
+            if self.debug or not r.ok:
+                sp.set(response=r.text[:500])
+            sp.end()
+        return {"status": r.status_code, "latency_ms": round(ms, 1)}
+
+    def _send_all_now(self, to: str, phone_id: str, bodies: list, parent=None):
+        # `parent`: span del turno que encoló el envío (los envíos salen en otro hilo)
+        with tracing.attach(parent):
+            return [self.send(phone_id, b) for b in bodies]
+
+    def send_all(self, phone_id: str, to: str, bodies: list):
+        """
+        Envía `bodies` a `to` en orden. Con workers > 0 se encola y vuelve de
+        inmediato; si la cola está llena (o workers = 0) se envía en línea,
+        salvo que `to` tenga envíos pendientes: entonces se encola detrás de
+        ellos aunque se pase del límite (el .ics no puede llegar antes que la
+        confirmación).
+        """
+        if self._pool:
+            args = (to, phone_id, bodies, tracing.current())
+            if self._pool.submit(*args) or (self._pool.pending_for(to) and self._pool.submit(*args, force=True)):
+                return None
+        return self._send_all_now(to, phone_id, bodies)
+
+    def _on_error(self, to, e):
+        with tracing.trace("wa.send_error", force=True, to=to, error=repr(e)):
+            pass
+
+    def _record(self, ms: float, ok: bool):
+        with self._lock:
+            self.sent += 1
+            if not ok:
+                self.errors += 1
+            self.max_ms = max(self.max_ms, ms)
+            self._lat_ms.append(ms)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lat = sorted(self._lat_ms)
+
+        def pct(p):
+            return round(lat[min(len(lat) - 1, int(p * len(lat)))], 1) if lat else None
+
+        return {
+            "sent": self.sent,
+            "errors": self.errors,
+            "latency_ms": {"p50": pct(0.50), "p95": pct(0.95), "max": round(self.max_ms, 1)},
+            "queue": self._pool.stats() if self._pool else None,
+        }
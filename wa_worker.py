@@ -0,0 +1,282 @@
+import os
+import time
+import heapq
+import queue
+import asyncio
+import threading
+import zlib
+
+
+class KeyedWorkerPool:
+    """
+    Pool acotado de hilos para procesar trabajos fuera del request.
+    Los trabajos con la misma clave (ej. el 'from' de WhatsApp) caen siempre
+    en el mismo hilo, así que se ejecutan en orden de llegada.
+    """
+
+    def __init__(self, handler, workers: int = 4, max_queue: int = 1000,
+                 name: str = "wa-worker", on_error=None):
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.max_queue = max(1, int(max_queue))
+        self.name = name
+        self.on_error = on_error
+        self._lock = threading.Lock()
+        self._queues = []
+        self._pid = None
+        self._pending = 0
+        self._by_key = {}  # clave -> trabajos encolados o en curso
+        self.processed = 0
+        self.rejected = 0
+        self.errors = 0
+
+    def _ensure_started(self):
+        # Con `gunicorn --preload` el módulo se importa antes del fork y los hilos
+        # no sobreviven: se arrancan en el primer uso dentro de cada proceso.
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._queues = [queue.SimpleQueue() for _ in range(self.workers)]
+            for i, q in enumerate(self._queues):
+                t = threading.Thread(target=self._run, args=(q,), name=f"{self.name}-{i}", daemon=True)
+                t.start()
+            self._pending = 0
+            self._by_key = {}
+            self._pid = pid
+
+    def submit(self, key, *args, force: bool = False) -> bool:
+        """
+        Encola handler(key, *args). Devuelve False si la cola está llena; con
+        `force` encola igual (para no adelantar a trabajos de la misma clave).
+        """
+        self._ensure_started()
+        with self._lock:
+            if self._pending >= self.max_queue and not force:
+                self.rejected += 1
+                return False
+            self._pending += 1
+            self._by_key[key] = self._by_key.get(key, 0) + 1
+        shard = zlib.crc32(str(key).encode("utf-8")) % self.workers
+        self._queues[shard].put((key, args))
+        return True
+
+    def _run(self, q):
+        while True:
+            key, args = q.get()
+            try:
+                self.handler(key, *args)
+            except Exception as e:
+                self.errors += 1
+                if self.on_error:
+                    self.on_error(key, e)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    self.processed += 1
+                    left = self._by_key.get(key, 0) - 1
+                    if left > 0:
+                        self._by_key[key] = left
+                    else:
+                        self._by_key.pop(key, None)
+
+    def pending_for(self, key) -> int:
+        """Trabajos de `key` encolados o en curso."""
+        with self._lock:
+            return self._by_key.get(key, 0)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self._pending,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "errors": self.errors,
+        }
+
+
+class CoalescingMailbox:
+    """
+    Buzón por clave delante de un KeyedWorkerPool: los mensajes de un mismo
+    remitente que llegan con menos de `window_ms` entre sí se juntan en un solo
+    trabajo handler(key, [items]) (un turno, una respuesta). La ventana se
+    extiende con cada mensaje, hasta `max_ms` desde el primero. Un hilo
+    planificador con un heap de vencimientos despacha los buzones al pool,
+    que mantiene el orden por clave. Si el pool no acepta un buzón (cola
+    llena), sus mensajes vuelven a esperar: ya se le respondió 200 a Meta y no
+    los va a reenviar.
+    """
+
+    def __init__(self, handler, window_ms: int = 1500, max_ms: int = 5000, workers: int = 4,
+                 max_queue: int = 1000, name: str = "wa-mailbox", on_error=None):
+        self.window = max(0, window_ms) / 1000
+        self.max_wait = max(self.window, max_ms / 1000)
+        self.max_queue = max(1, int(max_queue))
+        self.name = name
+        self.pool = KeyedWorkerPool(handler, workers=workers, max_queue=max_queue, name=name,
+                                    on_error=on_error)
+        self._cond = threading.Condition()
+        self._boxes = {}   # key -> {"items": [...], "first": ts, "deadline": ts}
+        self._heap = []    # (deadline, seq, key); entradas viejas se descartan al sacarlas
+        self._seq = 0
+        self._buffered = 0
+        self._pid = None
+        self.received = 0
+        self.batches = 0
+        self.rejected = 0
+        self.requeued = 0
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._cond:
+            if self._pid == pid:
+                return
+            self._boxes, self._heap, self._buffered = {}, [], 0
+            threading.Thread(target=self._run, name=f"{self.name}-sched", daemon=True).start()
+            self._pid = pid
+
+    def submit(self, key, item) -> bool:
+        """Agrega `item` al buzón de `key`. Devuelve False si se superó max_queue."""
+        if not self.window:
+            ok = self.pool.submit(key, [item])
+            with self._cond:
+                self.received += ok
+                self.batches += ok
+                self.rejected += not ok
+            return ok
+        self._ensure_started()
+        now = time.monotonic()
+        with self._cond:
+            if self._buffered + self.pool.stats()["pending"] >= self.max_queue:
+                self.rejected += 1
+                return False
+            box = self._boxes.get(key)
+            if box is None:
+                box = self._boxes[key] = {"items": [], "first": now}
+            box["items"].append(item)
+            box["deadline"] = min(now + self.window, box["first"] + self.max_wait)
+            self._seq += 1
+            heapq.heappush(self._heap, (box["deadline"], self._seq, key))
+            self._buffered += 1
+            self.received += 1
+            self._cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    deadline, _seq, key = self._heap[0]
+                    delay = deadline - time.monotonic()
+                    if delay > 0:
+                        self._cond.wait(delay)
+                        continue
+                    heapq.heappop(self._heap)
+                    box = self._boxes.get(key)
+                    if box is None or box["deadline"] != deadline:
+                        continue  # vencimiento reemplazado por uno posterior
+                    del self._boxes[key]
+                    self._buffered -= len(box["items"])
+                    self.batches += 1
+                    break
+            if not self.pool.submit(key, box["items"]):
+                self._requeue(key, box["items"])
+
+    def _requeue(self, key, items):
+        """Devuelve al buzón (delante de lo llegado mientras tanto) un despacho rechazado."""
+        now = time.monotonic()
+        with self._cond:
+            box = self._boxes.get(key)
+            if box is None:
+                box = self._boxes[key] = {"items": [], "first": now}
+            box["items"][:0] = items
+            box["deadline"] = now + self.window
+            self._seq += 1
+            heapq.heappush(self._heap, (box["deadline"], self._seq, key))
+            self._buffered += len(items)
+            self.batches -= 1
+            self.requeued += 1
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": int(self.window * 1000),
+            "max_ms": int(self.max_wait * 1000),
+            "received": self.received,
+            "turns": self.batches,
+            "buffered": self._buffered,
+            "rejected": self.rejected,
+            "requeued": self.requeued,
+            # cada mensaje juntado con otro es un turno (y un llamado al LLM) menos
+            "turns_saved": self.received - self.batches - self._buffered,
+            "pool": self.pool.stats(),
+        }
+
+
+class AsyncMailbox:
+    """
+    Mismo agrupamiento que CoalescingMailbox para el loop de asyncio (asgi.py):
+    una tarea por buzón abierto duerme hasta el vencimiento y llama
+    `await handler(key, [items])`. El orden por remitente lo da el lock de
+    sesión de aprocess_chat. len() cuenta los mensajes pendientes, en el
+    buzón o en un turno en curso, cada uno una vez.
+    """
+
+    def __init__(self, handler, window_ms: int = 1500, max_ms: int = 5000, spawn=None):
+        self.handler = handler
+        self.window = max(0, window_ms) / 1000
+        self.max_wait = max(self.window, max_ms / 1000)
+        self.spawn = spawn
+        self._boxes = {}
+        self._in_flight = 0
+        self.received = 0
+        self.batches = 0
+
+    def _buffered(self) -> int:
+        return sum(len(b["items"]) for b in self._boxes.values())
+
+    def __len__(self):
+        return self._buffered() + self._in_flight
+
+    def submit(self, key, item):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.received += 1
+        box = self._boxes.get(key)
+        if box is None:
+            box = self._boxes[key] = {"items": [], "first": now}
+            self.spawn(self._flush_later(key, box))
+        box["items"].append(item)
+        box["deadline"] = min(now + self.window, box["first"] + self.max_wait)
+
+    async def _flush_later(self, key, box):
+        loop = asyncio.get_running_loop()
+        while (delay := box["deadline"] - loop.time()) > 0:
+            await asyncio.sleep(delay)
+        self._boxes.pop(key, None)
+        self.batches += 1
+        self._in_flight += len(box["items"])
+        try:
+            await self.handler(key, box["items"])
+        finally:
+            self._in_flight -= len(box["items"])
+
+    def stats(self) -> dict:
+        buffered = self._buffered()
+        return {
+            "window_ms": int(self.window * 1000),
+            "max_ms": int(self.max_wait * 1000),
+            "received": self.received,
+            "turns": self.batches,
+            "buffered": buffered,
+            "in_flight": self._in_flight,
+            "turns_saved": self.received - self.batches - buffered,
+        }